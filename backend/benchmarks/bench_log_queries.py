@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+基准测试：日志列表与仪表盘查询（索引迁移前后对比）
+
+预置大量日志（默认 100 万条）后删除迁移创建的索引，模拟升级前的数据库，
+测量日志列表各种过滤条件与仪表盘接口的耗时；再执行迁移重建索引，重复测量。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_log_queries.py
+    python benchmarks/bench_log_queries.py --rows 200000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["DB_PATH"] = os.path.join(
+    tempfile.mkdtemp(prefix="llmgateway-bench-"), "bench.db"
+)
+
+from datetime import datetime, timedelta  # noqa: E402
+
+from sqlalchemy import insert, text  # noqa: E402
+
+from config.database import SessionLocal, engine, init_db  # noqa: E402
+from config.migrations import run_migrations  # noqa: E402
+from models.model_config import ModelConfig  # noqa: E402
+from models.operation_log import OperationLog  # noqa: E402
+from models.quota_stat import QuotaStat  # noqa: E402
+from routers.logs import get_log_list  # noqa: E402
+from routers.stats import get_dashboard_stats  # noqa: E402
+from services.routing_table import RoutingTable  # noqa: E402
+from services.stats_rollup import StatsRollup  # noqa: E402
+
+CHUNK = 50000
+MODELS = 20
+# 迁移 2 创建的索引，删除后可模拟升级前的数据库
+OPERATION_LOG_MIGRATION = 2
+
+
+def _percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def seed(rows: int):
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(
+            insert(ModelConfig),
+            [
+                {
+                    "id": i,
+                    "vendor": "openai",
+                    "model_name": f"bench-{i}",
+                    "api_key": "k",
+                    "priority": i,
+                    "status": 1,
+                    "connect_status": 1,
+                }
+                for i in range(1, MODELS + 1)
+            ],
+        )
+        db.execute(
+            insert(QuotaStat),
+            [{"model_id": i, "total_quota": 1000000} for i in range(1, MODELS + 1)],
+        )
+
+        # 日志均匀分布在最近 30 天：访问日志为主，少量切换、错误日志
+        now = datetime.now()
+        step = timedelta(days=30) / rows
+        content = json.dumps({"usage": {"prompt_tokens": 20, "completion_tokens": 80}})
+        for start in range(0, rows, CHUNK):
+            db.execute(
+                insert(OperationLog),
+                [
+                    {
+                        "log_type": 2 if i % 200 == 0 else 3 if i % 50 == 0 else 1,
+                        "model_id": i % MODELS + 1,
+                        "log_content": content,
+                        "status": 0 if i % 50 == 0 else 1,
+                        "create_time": now - step * i,
+                    }
+                    for i in range(start, min(start + CHUNK, rows))
+                ],
+            )
+        db.commit()
+    finally:
+        db.close()
+    StatsRollup.backfill()
+    RoutingTable.rebuild()
+
+
+def drop_log_indexes():
+    """删除日志表索引并清除对应的迁移记录"""
+    with engine.begin() as conn:
+        for index in OperationLog.__table__.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        conn.execute(
+            text("DELETE FROM schema_migrations WHERE version = :version"),
+            {"version": OPERATION_LOG_MIGRATION},
+        )
+
+
+def cases(rows: int):
+    day_ago = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    last_page = rows // 20 // 2
+    log_list = {
+        "page": 1,
+        "size": 20,
+        "log_type": None,
+        "model_id": None,
+        "status": None,
+        "start_time": None,
+        "end_time": None,
+    }
+    return [
+        ("log list", {}),
+        ("log list type=2", {"log_type": 2}),
+        ("log list model=3", {"model_id": 3}),
+        ("log list status=0", {"status": 0}),
+        ("log list last 24h", {"start_time": day_ago}),
+        ("log list type+24h", {"log_type": 1, "start_time": day_ago}),
+        (f"log list page {last_page}", {"page": last_page}),
+        ("dashboard", None),
+    ], log_list
+
+
+def measure(rows: int, repeat: int) -> dict:
+    results = {}
+    items, defaults = cases(rows)
+    for name, params in items:
+        latencies = []
+        for _ in range(repeat):
+            db = SessionLocal()
+            try:
+                start = time.perf_counter()
+                if params is None:
+                    asyncio.run(get_dashboard_stats(db=db))
+                else:
+                    asyncio.run(get_log_list(db=db, **{**defaults, **params}))
+                latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                db.close()
+        results[name] = (_percentile(latencies, 0.5), max(latencies))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日志列表与仪表盘查询基准测试")
+    parser.add_argument("--rows", type=int, default=1000000, help="预置日志行数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个查询执行次数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.rows)
+    print(f"seeded {args.rows} logs in {time.perf_counter() - start:.1f}s")
+
+    drop_log_indexes()
+    before = measure(args.rows, args.repeat)
+
+    start = time.perf_counter()
+    run_migrations(engine)
+    print(f"migrated in {time.perf_counter() - start:.1f}s")
+    after = measure(args.rows, args.repeat)
+
+    print(
+        f"{'query':<22}{'before p50':>12}{'before max':>12}"
+        f"{'after p50':>12}{'after max':>12}{'speedup':>9}"
+    )
+    for name, (p50, worst) in before.items():
+        new_p50, new_worst = after[name]
+        print(
+            f"{name:<22}{p50:>12.2f}{worst:>12.2f}{new_p50:>12.2f}"
+            f"{new_worst:>12.2f}{p50 / new_p50:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+基准测试：auto 模式路由策略对比
+
+用模拟上游构造三个特性不同的模型，对每种路由策略发送相同的并发请求负载，
+对比端到端延迟分布与各模型分到的请求比例：
+  fast      基础延迟 50ms，但只能并发处理 4 个请求，超出部分排队
+  steady    基础延迟 120ms，并发能力充足
+  spiky     基础延迟 80ms，10% 的请求出现 1s 长尾
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_routing_strategies.py
+    python benchmarks/bench_routing_strategies.py --requests 2000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="llmgateway-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp_dir, "bench.db")
+os.environ.setdefault("CIRCUIT_BREAKER_ENABLED", "false")
+# 屏蔽请求路径上的日志输出
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+
+from config.database import init_db
+from services.http_client_pool import HttpClientPool
+from services.log_writer import LogWriter
+from services.routing_strategy import RoutingStats, RoutingStrategy
+from services.routing_table import ModelRoute, RoutingTable
+
+STRATEGIES = ["priority", "weighted_round_robin", "least_outstanding", "p2c_ewma"]
+
+# (名称, 基础延迟秒, 并发能力, 长尾概率, 长尾延迟秒, 轮询权重)
+UPSTREAMS = [
+    ("fast", 0.05, 4, 0.0, 0.0, 1),
+    ("steady", 0.12, 1000, 0.0, 0.0, 3),
+    ("spiky", 0.08, 1000, 0.1, 1.0, 1),
+]
+
+
+class MockUpstream:
+    """模拟上游：超过并发能力的请求排队等待"""
+
+    def __init__(self, base, capacity, tail_ratio, tail_latency, rng):
+        self.base = base
+        self.tail_ratio = tail_ratio
+        self.tail_latency = tail_latency
+        self.slots = asyncio.Semaphore(capacity)
+        self.rng = rng
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        async with self.slots:
+            latency = self.base
+            if self.rng.random() < self.tail_ratio:
+                latency = self.tail_latency
+            await asyncio.sleep(latency)
+        return httpx.Response(
+            200,
+            json={
+                "id": "bench",
+                "model": request.url.host.split(".")[0],
+                "choices": [{"index": 0, "message": {"content": "ok"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1},
+            },
+        )
+
+
+def build_routes():
+    return [
+        ModelRoute(
+            id=i + 1,
+            vendor="openai",
+            model_name=name,
+            api_base=f"http://{name}.mock/v1",
+            api_path=None,
+            api_spec="openai",
+            api_key="sk-bench",
+            priority=i + 1,
+            params={"weight": weight},
+        )
+        for i, (name, _, _, _, _, weight) in enumerate(UPSTREAMS)
+    ]
+
+
+async def run_strategy(strategy: str, args) -> dict:
+    from main import chat_completions, ChatCompletionRequest
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    upstreams = {
+        f"{name}.mock": MockUpstream(base, capacity, tail, tail_latency, rng)
+        for name, base, capacity, tail, tail_latency, _ in UPSTREAMS
+    }
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return await upstreams[request.url.host].handle(request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    HttpClientPool.get_client = classmethod(lambda cls, url: client)
+
+    routes = build_routes()
+    names = {route.id: route.model_name for route in routes}
+    RoutingTable.get_routes = classmethod(lambda cls: list(routes))
+    RoutingStrategy.NAME = strategy
+    RoutingStrategy._wrr_current = {}
+    RoutingStats._loads = {}
+
+    latencies = []
+    served = {name: 0 for name in names.values()}
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": f"req-{i}"}]
+            )
+            started = time.perf_counter()
+            response = await chat_completions(
+                request, authorization="Bearer bench", x_hedge=None, cache_control=None
+            )
+            latencies.append(time.perf_counter() - started)
+            served[response["model"]] += 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - wall_start
+    await client.aclose()
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "rps": len(latencies) / wall,
+        "served": served,
+    }
+
+
+async def main(args):
+    init_db()
+    await LogWriter.start()
+
+    try:
+        results = {}
+        for strategy in args.strategies.split(","):
+            results[strategy] = await run_strategy(strategy.strip(), args)
+    finally:
+        await LogWriter.stop()
+
+    print(f"\n请求数: {args.requests}, 并发: {args.concurrency}")
+    names = [u[0] for u in UPSTREAMS]
+    header = f"{'策略':<22}{'p50(ms)':>9}{'p95(ms)':>9}{'p99(ms)':>9}{'rps':>8}"
+    print(header + "".join(f"{name:>9}" for name in names))
+    for strategy, r in results.items():
+        share = "".join(f"{r['served'][name] / args.requests:>9.0%}" for name in names)
+        print(
+            f"{strategy:<22}{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}"
+            f"{r['rps']:>8.1f}{share}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="路由策略模拟基准测试")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="逗号分隔")
+    parser.add_argument("--requests", type=int, default=1000, help="每种策略的请求数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+基准测试：SQLite 日志写入与读取并发
+
+模拟 docker-compose 中 gateway 与 backend 两个容器共用同一个数据库文件：
+一个进程持续写入 OperationLog（逐条提交），另一个进程持续执行仪表盘/日志查询。
+分别在 SQLITE_PROFILE=default 与 SQLITE_PROFILE=tuned 下运行，对比吞吐、延迟与锁冲突。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_sqlite_concurrency.py
+    python benchmarks/bench_sqlite_concurrency.py --profiles tuned --duration 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def _worker(role: str, threads: int, duration: float, result_queue):
+    """子进程：按角色执行写入或读取（数据库配置在导入时从环境变量读取）"""
+    sys.path.insert(0, BACKEND_DIR)
+
+    from datetime import datetime, timedelta
+    from sqlalchemy import func, desc
+    from config.database import SessionLocal
+    from models.operation_log import OperationLog
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def write_loop():
+        db = SessionLocal()
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    db.add(
+                        OperationLog(
+                            log_type=1,
+                            model_id=1,
+                            log_content='{"status": "success"}',
+                            status=1,
+                        )
+                    )
+                    db.commit()
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        latencies.append(elapsed)
+                except Exception:
+                    db.rollback()
+                    with lock:
+                        errors[0] += 1
+        finally:
+            db.close()
+
+    def read_loop():
+        db = SessionLocal()
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        i = 0
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    if i % 3 == 0:
+                        db.query(func.count(OperationLog.id)).filter(
+                            OperationLog.log_type == 1,
+                            OperationLog.create_time >= today,
+                        ).scalar()
+                    elif i % 3 == 1:
+                        db.query(
+                            func.date(OperationLog.create_time),
+                            func.count(OperationLog.id),
+                        ).filter(
+                            OperationLog.create_time >= today - timedelta(days=7)
+                        ).group_by(func.date(OperationLog.create_time)).all()
+                    else:
+                        db.query(OperationLog).order_by(
+                            desc(OperationLog.create_time)
+                        ).limit(20).all()
+                    db.rollback()
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        latencies.append(elapsed)
+                except Exception:
+                    db.rollback()
+                    with lock:
+                        errors[0] += 1
+                i += 1
+        finally:
+            db.close()
+
+    target = write_loop if role == "writer" else read_loop
+    pool = [threading.Thread(target=target) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    result_queue.put(
+        {
+            "role": role,
+            "ops": len(latencies),
+            "p50": _percentile(latencies, 0.5),
+            "p99": _percentile(latencies, 0.99),
+            "errors": errors[0],
+        }
+    )
+
+
+def _seed(rows: int):
+    sys.path.insert(0, BACKEND_DIR)
+
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    from config.database import SessionLocal, init_db
+    from models.operation_log import OperationLog
+
+    init_db()
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        db.execute(
+            insert(OperationLog),
+            [
+                {
+                    "log_type": 1 + i % 3,
+                    "model_id": 1,
+                    "log_content": '{"status": "success"}',
+                    "status": 1,
+                    "create_time": now - timedelta(seconds=i * 10),
+                }
+                for i in range(rows)
+            ],
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_profile(profile: str, args) -> list:
+    os.environ["SQLITE_PROFILE"] = profile
+    os.environ["DB_PATH"] = os.path.join(
+        tempfile.mkdtemp(prefix="llmgateway-bench-"), "bench.db"
+    )
+
+    ctx = multiprocessing.get_context("spawn")
+    seeder = ctx.Process(target=_seed, args=(args.rows,))
+    seeder.start()
+    seeder.join()
+
+    result_queue = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=_worker, args=("writer", args.writers, args.duration, result_queue)
+        ),
+        ctx.Process(
+            target=_worker, args=("reader", args.readers, args.duration, result_queue)
+        ),
+    ]
+    for p in procs:
+        p.start()
+    results = [result_queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return sorted(results, key=lambda r: r["role"], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 读写并发基准测试")
+    parser.add_argument("--profiles", default="default,tuned", help="逗号分隔")
+    parser.add_argument("--rows", type=int, default=100000, help="预置日志行数")
+    parser.add_argument("--writers", type=int, default=4, help="写入线程数")
+    parser.add_argument("--readers", type=int, default=4, help="读取线程数")
+    parser.add_argument("--duration", type=float, default=5.0, help="运行时长(秒)")
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':<10}{'role':<8}{'ops/s':>10}{'p50(ms)':>10}"
+        f"{'p99(ms)':>10}{'errors':>8}"
+    )
+    for profile in args.profiles.split(","):
+        for r in run_profile(profile.strip(), args):
+            print(
+                f"{profile:<10}{r['role']:<8}{r['ops'] / args.duration:>10.1f}"
+                f"{r['p50']:>10.2f}{r['p99']:>10.2f}{r['errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
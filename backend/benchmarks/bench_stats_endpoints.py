@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+基准测试：统计接口的查询次数与耗时
+
+预置大量模型、额度统计与日志（默认 500 个模型、100 万条日志，日志同时回填小时汇总），
+依次调用仪表盘、使用趋势、模型排行、额度概览接口，统计每次调用执行的 SQL 条数与耗时。
+查询次数应与模型数量无关：模型名称读内存路由表，不再逐行查询 ModelConfig。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_stats_endpoints.py
+    python benchmarks/bench_stats_endpoints.py --models 50 --rows 100000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["DB_PATH"] = os.path.join(
+    tempfile.mkdtemp(prefix="llmgateway-bench-"), "bench.db"
+)
+
+from datetime import datetime, timedelta  # noqa: E402
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from config.database import SessionLocal, engine, init_db  # noqa: E402
+from models.model_config import ModelConfig  # noqa: E402
+from models.operation_log import OperationLog  # noqa: E402
+from models.quota_stat import QuotaStat  # noqa: E402
+from routers.stats import (  # noqa: E402
+    get_dashboard_stats,
+    get_model_ranking,
+    get_quota_overview,
+    get_usage_trend,
+)
+from services.routing_table import RoutingTable  # noqa: E402
+from services.stats_rollup import StatsRollup  # noqa: E402
+
+CHUNK = 50000
+
+
+def _percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def seed(models: int, rows: int):
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(
+            insert(ModelConfig),
+            [
+                {
+                    "id": i,
+                    "vendor": "openai",
+                    "model_name": f"bench-{i}",
+                    "api_key": "k",
+                    "priority": i,
+                    "status": 1,
+                    "connect_status": 1 if i % 5 else 0,
+                }
+                for i in range(1, models + 1)
+            ],
+        )
+        db.execute(
+            insert(QuotaStat),
+            [
+                {
+                    "model_id": i,
+                    "total_quota": 1000000,
+                    "used_quota": i * 1000 % 1000000,
+                    "remain_quota": 1000000 - i * 1000 % 1000000,
+                    "used_ratio": i * 1000 % 1000000 / 10000,
+                }
+                for i in range(1, models + 1)
+            ],
+        )
+
+        # 日志均匀分布在最近 30 天
+        now = datetime.now()
+        step = timedelta(days=30) / rows
+        usage = json.dumps({"usage": {"prompt_tokens": 20, "completion_tokens": 80}})
+        for start in range(0, rows, CHUNK):
+            db.execute(
+                insert(OperationLog),
+                [
+                    {
+                        "log_type": 2 if i % 50 == 0 else 1,
+                        "model_id": i % models + 1,
+                        "log_content": usage,
+                        "status": 0 if i % 20 == 0 else 1,
+                        "create_time": now - step * i,
+                    }
+                    for i in range(start, min(start + CHUNK, rows))
+                ],
+            )
+        db.commit()
+    finally:
+        db.close()
+    StatsRollup.backfill()
+    RoutingTable.rebuild()
+
+
+def measure(name: str, call, repeat: int):
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", count)
+    latencies = []
+    try:
+        for _ in range(repeat):
+            statements.clear()
+            db = SessionLocal()
+            try:
+                start = time.perf_counter()
+                asyncio.run(call(db))
+                latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                db.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    print(
+        f"{name:<22}{len(statements):>9}{_percentile(latencies, 0.5):>10.2f}"
+        f"{max(latencies):>10.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计接口查询次数与耗时基准测试")
+    parser.add_argument("--models", type=int, default=500, help="模型数量")
+    parser.add_argument("--rows", type=int, default=1000000, help="预置日志行数")
+    parser.add_argument("--repeat", type=int, default=10, help="每个接口调用次数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.models, args.rows)
+    print(
+        f"seeded {args.models} models, {args.rows} logs "
+        f"in {time.perf_counter() - start:.1f}s ({os.environ['DB_PATH']})"
+    )
+
+    print(f"{'endpoint':<22}{'queries':>9}{'p50(ms)':>10}{'max(ms)':>10}")
+    measure("/api/stats/dashboard", lambda db: get_dashboard_stats(db=db), args.repeat)
+    measure("/api/stats/usage", lambda db: get_usage_trend(days=30, db=db), args.repeat)
+    measure("/api/stats/models", lambda db: get_model_ranking(db=db), args.repeat)
+    measure("/api/stats/quota", lambda db: get_quota_overview(db=db), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+基准测试：仪表盘轮询期间的流式响应延迟
+
+启动进程内网关 + 模拟上游，先单独跑流式请求，再在仪表盘/日志接口被持续轮询时
+重复一次，对比两轮的 chunk 间隔分布。数据库调用在独立线程池中执行时，两轮应基本持平。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_stream_latency.py
+    python benchmarks/bench_stream_latency.py --inline   # 对照：数据库调用直接在事件循环上执行
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import Executor, Future
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="llmgateway-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp_dir, "bench.db")
+os.environ.setdefault("ROUTING_REFRESH_INTERVAL", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+import uvicorn
+from sqlalchemy import insert
+
+import config.database as database
+from config.database import SessionLocal, init_db
+from models.model_config import ModelConfig
+from models.operation_log import OperationLog
+from services.http_client_pool import HttpClientPool
+
+
+class _InlineExecutor(Executor):
+    """对照组：在调用线程（事件循环）上同步执行"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def seed(log_rows: int):
+    """写入一个可用模型和大量历史日志"""
+    init_db()
+    db = SessionLocal()
+    try:
+        db.add(
+            ModelConfig(
+                vendor="openai",
+                model_name="bench-model",
+                api_key="sk-bench",
+                api_base="http://mock-upstream/v1",
+                priority=1,
+                status=1,
+                connect_status=1,
+            )
+        )
+        now = datetime.now()
+        batch = []
+        for i in range(log_rows):
+            batch.append(
+                {
+                    "log_type": 1 + i % 3,
+                    "model_id": 1,
+                    "log_content": '{"status": "success"}',
+                    "status": 1,
+                    "create_time": now - timedelta(seconds=i * 5),
+                }
+            )
+            if len(batch) >= 50000:
+                db.execute(insert(OperationLog), batch)
+                batch = []
+        if batch:
+            db.execute(insert(OperationLog), batch)
+        db.commit()
+    finally:
+        db.close()
+
+
+def mock_upstream(chunks: int, interval: float) -> httpx.AsyncClient:
+    """模拟上游：按固定间隔输出 SSE chunk"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        async def body():
+            for i in range(chunks):
+                await asyncio.sleep(interval)
+                yield (
+                    'data: {"id": "bench", "created": 0, "model": "bench-model", '
+                    '"choices": [{"index": 0, "delta": {"content": "tok%d"}}]}\n\n' % i
+                ).encode()
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(
+            200, headers={"content-type": "text/event-stream"}, content=body()
+        )
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def stream_once(client: httpx.AsyncClient, gaps: list):
+    payload = {
+        "model": "bench-model",
+        "messages": [{"role": "user", "content": "hi"}],
+        "stream": True,
+    }
+    headers = {"Authorization": "Bearer bench"}
+    async with client.stream(
+        "POST", "/v1/chat/completions", json=payload, headers=headers
+    ) as response:
+        last = time.perf_counter()
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                now = time.perf_counter()
+                gaps.append((now - last) * 1000)
+                last = now
+
+
+async def poll_dashboard(client: httpx.AsyncClient, stop: asyncio.Event, counter: list):
+    paths = [
+        "/api/stats/dashboard",
+        "/api/stats/usage?days=30",
+        "/api/stats/models",
+        "/api/stats/quota",
+        "/api/log/list?page=1&size=20",
+    ]
+    i = 0
+    while not stop.is_set():
+        await client.get(paths[i % len(paths)])
+        counter[0] += 1
+        i += 1
+
+
+async def run_phase(base_url: str, streams: int, pollers: int) -> dict:
+    gaps = []
+    counter = [0]
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        poll_tasks = [
+            asyncio.create_task(poll_dashboard(client, stop, counter))
+            for _ in range(pollers)
+        ]
+        await asyncio.gather(*(stream_once(client, gaps) for _ in range(streams)))
+        stop.set()
+        await asyncio.gather(*poll_tasks)
+
+    gaps.sort()
+    return {
+        "chunks": len(gaps),
+        "p50": statistics.median(gaps),
+        "p99": gaps[int(len(gaps) * 0.99) - 1],
+        "max": gaps[-1],
+        "polls": counter[0],
+    }
+
+
+async def main(args):
+    if args.inline:
+        database.db_executor = _InlineExecutor()
+
+    upstream = mock_upstream(args.chunks, args.interval)
+    HttpClientPool.get_client = classmethod(lambda cls, url: upstream)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    from main import app
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        idle = await run_phase(base_url, args.streams, 0)
+        busy = await run_phase(base_url, args.streams, args.pollers)
+    finally:
+        server.should_exit = True
+        await server_task
+        await upstream.aclose()
+
+    mode = "inline (事件循环)" if args.inline else "db_executor (线程池)"
+    print(f"\n数据库执行方式: {mode}")
+    print(f"上游 chunk 间隔: {args.interval * 1000:.0f}ms, 并发流: {args.streams}")
+    print(
+        f"{'场景':<16}{'chunks':>8}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'轮询数':>8}"
+    )
+    for name, r in (("仅流式", idle), ("流式+仪表盘轮询", busy)):
+        print(
+            f"{name:<16}{r['chunks']:>8}{r['p50']:>10.1f}{r['p99']:>10.1f}"
+            f"{r['max']:>10.1f}{r['polls']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流式延迟 vs 仪表盘轮询基准测试")
+    parser.add_argument("--logs", type=int, default=300000, help="预置日志行数")
+    parser.add_argument("--streams", type=int, default=8, help="并发流式请求数")
+    parser.add_argument("--pollers", type=int, default=4, help="并发轮询客户端数")
+    parser.add_argument("--chunks", type=int, default=100, help="每个流的 chunk 数")
+    parser.add_argument(
+        "--interval", type=float, default=0.02, help="上游 chunk 间隔(秒)"
+    )
+    parser.add_argument(
+        "--inline", action="store_true", help="对照组：数据库调用在事件循环上执行"
+    )
+    args = parser.parse_args()
+
+    print(f"预置 {args.logs} 条日志到 {os.environ['DB_PATH']} ...")
+    seed(args.logs)
+    asyncio.run(main(args))
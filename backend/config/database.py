@@ -1,5 +1,6 @@
 from sqlalchemy import (
     create_engine,
+    event,
     Column,
     Integer,
     String,
@@ -11,7 +12,10 @@ from sqlalchemy import (
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import asyncio
+import functools
 import os
 import sqlite3
 
@@ -26,26 +30,97 @@ if DB_TYPE == "sqlite":
 else:
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./llmgateway.db")
 
+# 连接池配置
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# SQLite 调优配置: tuned=WAL 等调优参数, default=SQLite 默认行为
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned").lower()
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # 毫秒
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # 负数单位为 KiB
+
+
+def get_sqlite_pragmas() -> dict:
+    """当前配置下每个连接需要执行的 PRAGMA"""
+    if SQLITE_PROFILE != "tuned":
+        return {}
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "cache_size": SQLITE_CACHE_SIZE,
+        "temp_store": "MEMORY",
+    }
+
+
 # 创建引擎
 if DB_TYPE == "sqlite":
     engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}, echo=False
+        DATABASE_URL,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT / 1000,
+        },
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        echo=False,
     )
+
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        """新建连接时应用 SQLite PRAGMA"""
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in get_sqlite_pragmas().items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
 else:
-    engine = create_engine(DATABASE_URL, echo=False)
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        echo=False,
+    )
 
 # 创建会话工厂
 session_factory = sessionmaker(bind=engine)
 SessionLocal = scoped_session(session_factory)
 
+# 数据库专用线程池：同步 SQLAlchemy 调用不占用事件循环
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db-worker"
+)
 
-def get_db():
-    """获取数据库会话"""
-    db = SessionLocal()
+
+async def run_in_db(fn, *args, **kwargs):
+    """在数据库线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(fn, *args, **kwargs)
+    )
+
+
+async def get_db():
+    """获取数据库会话
+
+    每个请求独立创建会话，查询须通过 run_in_db 在数据库线程池中执行
+    """
+    db = session_factory()
     try:
         yield db
     finally:
-        db.close()
+        await run_in_db(db.close)
 
 
 def init_db():
@@ -57,6 +132,11 @@ def init_db():
     # 创建所有表
     Base.metadata.create_all(bind=engine)
 
+    # 已有数据库的结构变更（新增列、索引、约束）
+    from config.migrations import run_migrations
+
+    run_migrations(engine)
+
 
 def init_default_config():
     """初始化默认配置"""
@@ -113,3 +193,4 @@ from models.quota_stat import QuotaStat
 from models.system_config import SystemConfig
 from models.operation_log import OperationLog
 from models.notification import Notification
+from models.log_rollup import LogRollup
@@ -0,0 +1,171 @@
+import logging
+import time
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# 等待其他进程执行迁移的最长时间（秒），单次等待受 SQLite busy_timeout 限制
+_LOCK_WAIT = 600
+
+# 已执行的迁移版本
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_time", DateTime, default=datetime.now),
+)
+
+
+def _create_indexes(conn: Connection, table):
+    """创建模型中声明、数据库中尚不存在的索引"""
+    for index in sorted(table.indexes, key=lambda i: i.name):
+        index.create(conn, checkfirst=True)
+
+
+def _add_model_api_spec(conn: Connection):
+    columns = {c["name"] for c in inspect(conn).get_columns("model_config")}
+    if "api_spec" not in columns:
+        conn.execute(
+            text(
+                "ALTER TABLE model_config "
+                "ADD COLUMN api_spec VARCHAR(50) DEFAULT 'openai'"
+            )
+        )
+
+
+def _index_operation_log(conn: Connection):
+    from models.operation_log import OperationLog
+
+    _create_indexes(conn, OperationLog.__table__)
+
+
+def _unique_quota_model(conn: Connection):
+    from models.quota_stat import QuotaStat
+
+    # 同一模型有多条额度记录时合并到最早的一条（原先 .first() 读到的那条）：
+    # 已用额度累加，总额度取最大值，再删除其余记录
+    conn.execute(
+        text(
+            "UPDATE quota_stat SET "
+            "used_quota = (SELECT SUM(COALESCE(q.used_quota, 0)) FROM quota_stat q "
+            "WHERE q.model_id = quota_stat.model_id), "
+            "total_quota = (SELECT MAX(COALESCE(q.total_quota, 0)) FROM quota_stat q "
+            "WHERE q.model_id = quota_stat.model_id) "
+            "WHERE id IN (SELECT MIN(id) FROM quota_stat GROUP BY model_id "
+            "HAVING COUNT(*) > 1)"
+        )
+    )
+    conn.execute(
+        text(
+            "UPDATE quota_stat SET "
+            "remain_quota = CASE WHEN total_quota > used_quota "
+            "THEN total_quota - used_quota ELSE 0 END, "
+            "used_ratio = CASE WHEN total_quota > 0 "
+            "THEN used_quota * 100 / total_quota ELSE 0 END "
+            "WHERE model_id IN (SELECT model_id FROM quota_stat GROUP BY model_id "
+            "HAVING COUNT(*) > 1)"
+        )
+    )
+    result = conn.execute(
+        text(
+            "DELETE FROM quota_stat WHERE id NOT IN "
+            "(SELECT MIN(id) FROM quota_stat GROUP BY model_id)"
+        )
+    )
+    if result.rowcount:
+        logger.warning("已合并并删除 %s 条重复的模型额度记录", result.rowcount)
+    _create_indexes(conn, QuotaStat.__table__)
+
+
+def _index_log_rollup(conn: Connection):
+    from models.log_rollup import LogRollup
+
+    _create_indexes(conn, LogRollup.__table__)
+
+
+# (版本, 名称, 迁移函数)：只追加，不修改已发布的版本
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "model_config_api_spec", _add_model_api_spec),
+    (2, "operation_log_indexes", _index_operation_log),
+    (3, "quota_stat_unique_model", _unique_quota_model),
+    (4, "log_rollup_indexes", _index_log_rollup),
+]
+
+
+def _lock(conn: Connection):
+    """获取迁移写锁，其他进程的迁移提交前在此等待"""
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        conn.execute(text("LOCK TABLE schema_migrations IN EXCLUSIVE MODE"))
+    elif dialect == "sqlite":
+        # 事务开始时即获取写锁，而不是等到第一条写语句
+        deadline = time.monotonic() + _LOCK_WAIT
+        while True:
+            try:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                return
+            except OperationalError:
+                if time.monotonic() > deadline:
+                    raise
+                logger.info("等待其他进程完成数据库迁移")
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """按版本顺序执行尚未执行的迁移，返回本次执行的版本
+
+    在 create_all 之后调用：新库的表已按最新模型创建，迁移均可重复执行，只记录版本。
+    每个迁移与版本记录在同一事务中提交。gateway 与 backend 同时启动时，
+    执行迁移前先获取写锁并重新检查版本，后获得锁的一方跳过已完成的迁移；
+    不支持加锁的数据库仍以版本记录的主键冲突兜底。
+    """
+    # 多个进程同时启动时 create_all 的先检查后创建会冲突
+    with engine.begin() as conn:
+        conn.execute(CreateTable(schema_migrations, if_not_exists=True))
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+    executed = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as conn:
+                _lock(conn)
+                done = conn.execute(
+                    select(schema_migrations.c.version).where(
+                        schema_migrations.c.version == version
+                    )
+                ).first()
+                if done is None:
+                    migrate(conn)
+                    conn.execute(
+                        schema_migrations.insert().values(
+                            version=version, name=name, applied_time=datetime.now()
+                        )
+                    )
+        except IntegrityError:
+            done = True
+        if done is not None:
+            logger.info("数据库迁移 %s 已由其他进程执行", version)
+            continue
+        executed.append(version)
+        logger.info("已执行数据库迁移 %s: %s", version, name)
+    return executed
@@ -1,26 +1,47 @@
 from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, List, Dict, Any
+from typing import Callable, Optional, List, Dict, Any, Tuple
 from contextlib import asynccontextmanager
 import uvicorn
 import json
 import httpx
 import asyncio
 from datetime import datetime
+import functools
+import logging
+import math
 import os
-from sqlalchemy import text
+import time
 
-from config.database import get_db, init_db, SessionLocal
+from config.database import get_db, init_db, run_in_db, SessionLocal
+from config.logging_config import RequestIdMiddleware, setup_logging
 
 from models.model_config import ModelConfig
 from models.quota_stat import QuotaStat
 from models.system_config import SystemConfig
 from models.operation_log import OperationLog
 from models.notification import Notification
+from services.circuit_breaker import CircuitBreaker
+from services.credential_cache import CredentialCache
 from services.gateway_core import GatewayCore
+from services.health_monitor import HealthMonitor
+from services.hedging import HedgePolicy
+from services.http_client_pool import HttpClientPool
+from services.log_writer import LogWriter
+from services.metrics import Metrics
+from services.rate_limiter import RateLimiter, RateLimitExceeded
+from services.response_cache import ResponseCache
+from services.routing_strategy import RoutingStats, RoutingStrategy
+from services.routing_table import RoutingTable
+from services.semantic_cache import SemanticCache
+from services.single_flight import SingleFlight
+from services.stats_rollup import StatsRollup
+from services.stream_usage import StreamUsage
+from services.token_estimator import TokenEstimator
 from services.quota_monitor import QuotaMonitor
+from services.quota_tracker import QuotaTracker
 
 # 导入路由
 from routers.auth import auth_router
@@ -29,6 +50,10 @@ from routers.stats import stats_router
 from routers.logs import logs_router
 from routers.config import config_router
 
+# 结构化日志：级别取 LOG_LEVEL，由后台线程写出
+setup_logging()
+logger = logging.getLogger(__name__)
+
 
 # 启动事件
 @asynccontextmanager
@@ -37,7 +62,35 @@ async def lifespan(app: FastAPI):
     from config.database import init_default_config
 
     init_default_config()
-    yield
+
+    # 预先派生加密密钥，路由表构建时每个模型的 Key 只解密一次
+    CredentialCache.warm_up()
+    # 上游连接池：复用 TCP/TLS 连接
+    HttpClientPool.open()
+    # 内存路由表：请求路径不再查询数据库选择模型
+    await RoutingTable.start()
+    # 升级前的历史日志回填到小时汇总表（仅汇总表为空时）
+    await run_in_db(StatsRollup.backfill)
+    # 日志异步批量写入，同时维护小时汇总
+    await LogWriter.start()
+    # 额度用量内存累加、定时批量写入
+    await QuotaTracker.start()
+    # 语义缓存：加载持久化索引
+    await SemanticCache.start()
+    # 熔断器半开探测
+    await CircuitBreaker.start()
+    # 定时健康检查，维护模型连通状态
+    await HealthMonitor.start()
+    try:
+        yield
+    finally:
+        await HealthMonitor.stop()
+        await CircuitBreaker.stop()
+        await SemanticCache.stop()
+        await QuotaTracker.stop()
+        await LogWriter.stop()
+        await RoutingTable.stop()
+        await HttpClientPool.close()
 
 
 app = FastAPI(
@@ -54,6 +107,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 请求 ID：写入日志上下文并通过 X-Request-ID 回传
+app.add_middleware(RequestIdMiddleware)
 
 # 注册路由
 app.include_router(auth_router)
@@ -74,27 +129,14 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
-@app.on_event("startup")
-async def startup_event():
-    """数据库迁移：添加新列"""
-    db = SessionLocal()
-    try:
-        # 检查 api_spec 列是否存在
-        result = db.execute(text("PRAGMA table_info(model_config)"))
-        columns = [row[1] for row in result.fetchall()]
-
-        if "api_spec" not in columns:
-            db.execute(
-                text(
-                    "ALTER TABLE model_config ADD COLUMN api_spec VARCHAR(50) DEFAULT 'openai'"
-                )
-            )
-            db.commit()
-            print("[INFO] 已添加 api_spec 列到 model_config 表")
-    except Exception as e:
-        print(f"[WARN] 数据库迁移检查: {e}")
-    finally:
-        db.close()
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标"""
+    if not Metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(
+        Metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 # ==================== 模型配置接口 ====================
@@ -112,35 +154,39 @@ class AddModelRequest(BaseModel):
 @app.get("/api/models/{model_id}")
 async def get_model_detail(model_id: int, db: SessionLocal = Depends(get_db)):
     """获取单个模型详情（包含解密后的API Key）"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
 
-    if not model:
-        raise HTTPException(status_code=404, detail="模型不存在")
+    def fetch():
+        model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+        if not model:
+            raise HTTPException(status_code=404, detail="模型不存在")
+
+        return {
+            "code": 200,
+            "msg": "success",
+            "data": {
+                "id": model.id,
+                "vendor": model.vendor,
+                "model_name": model.model_name,
+                "api_base": model.api_base,
+                "api_path": model.api_path,
+                "api_spec": model.api_spec,
+                "api_key": model.api_key,
+                "priority": model.priority,
+                "status": model.status,
+                "connect_status": model.connect_status,
+                "quota_status": model.quota_status,
+                "params": model.params,
+                "create_time": model.create_time.strftime("%Y-%m-%d %H:%M:%S")
+                if model.create_time
+                else None,
+                "update_time": model.update_time.strftime("%Y-%m-%d %H:%M:%S")
+                if model.update_time
+                else None,
+            },
+        }
 
-    return {
-        "code": 200,
-        "msg": "success",
-        "data": {
-            "id": model.id,
-            "vendor": model.vendor,
-            "model_name": model.model_name,
-            "api_base": model.api_base,
-            "api_path": model.api_path,
-            "api_spec": model.api_spec,
-            "api_key": model.api_key,
-            "priority": model.priority,
-            "status": model.status,
-            "connect_status": model.connect_status,
-            "quota_status": model.quota_status,
-            "params": model.params,
-            "create_time": model.create_time.strftime("%Y-%m-%d %H:%M:%S")
-            if model.create_time
-            else None,
-            "update_time": model.update_time.strftime("%Y-%m-%d %H:%M:%S")
-            if model.update_time
-            else None,
-        },
-    }
+    return await run_in_db(fetch)
 
 
 @app.get("/api/models")
@@ -150,106 +196,128 @@ async def list_models(
     db: SessionLocal = Depends(get_db),
 ):
     """获取模型配置列表"""
-    query = db.query(ModelConfig)
 
-    if vendor:
-        query = query.filter(ModelConfig.vendor == vendor)
-    if status is not None:
-        query = query.filter(ModelConfig.status == status)
+    def fetch():
+        query = db.query(ModelConfig)
 
-    models = query.order_by(ModelConfig.priority).all()
+        if vendor:
+            query = query.filter(ModelConfig.vendor == vendor)
+        if status is not None:
+            query = query.filter(ModelConfig.status == status)
 
-    result = []
-    for m in models:
-        result.append(
-            {
-                "id": m.id,
-                "vendor": m.vendor,
-                "model_name": m.model_name,
-                "api_base": m.api_base,
-                "api_path": m.api_path,
-                "api_spec": m.api_spec,
-                "api_key": m.api_key or "",
-                "priority": m.priority,
-                "status": m.status,
-                "connect_status": m.connect_status,
-                "quota_status": m.quota_status,
-                "create_time": m.create_time.strftime("%Y-%m-%d %H:%M:%S")
-                if m.create_time
-                else None,
-                "update_time": m.update_time.strftime("%Y-%m-%d %H:%M:%S")
-                if m.update_time
-                else None,
-            }
-        )
+        models = query.order_by(ModelConfig.priority).all()
 
-    return {
-        "code": 200,
-        "msg": "success",
-        "data": result,
-    }
+        result = []
+        for m in models:
+            result.append(
+                {
+                    "id": m.id,
+                    "vendor": m.vendor,
+                    "model_name": m.model_name,
+                    "api_base": m.api_base,
+                    "api_path": m.api_path,
+                    "api_spec": m.api_spec,
+                    "api_key": m.api_key or "",
+                    "priority": m.priority,
+                    "status": m.status,
+                    "connect_status": m.connect_status,
+                    "quota_status": m.quota_status,
+                    "create_time": m.create_time.strftime("%Y-%m-%d %H:%M:%S")
+                    if m.create_time
+                    else None,
+                    "update_time": m.update_time.strftime("%Y-%m-%d %H:%M:%S")
+                    if m.update_time
+                    else None,
+                }
+            )
+
+        return {
+            "code": 200,
+            "msg": "success",
+            "data": result,
+        }
+
+    return await run_in_db(fetch)
 
 
 @app.post("/api/models")
 async def add_model(request: AddModelRequest, db: SessionLocal = Depends(get_db)):
     """新增模型配置"""
-    exist = (
-        db.query(ModelConfig)
-        .filter(
-            ModelConfig.vendor == request.vendor,
-            ModelConfig.model_name == request.model_name,
+
+    def execute():
+        exist = (
+            db.query(ModelConfig)
+            .filter(
+                ModelConfig.vendor == request.vendor,
+                ModelConfig.model_name == request.model_name,
+            )
+            .first()
         )
-        .first()
-    )
 
-    if exist:
-        raise HTTPException(status_code=400, detail="模型配置已存在")
-
-    model = ModelConfig(
-        vendor=request.vendor,
-        model_name=request.model_name,
-        api_key=request.api_key,
-        api_base=request.api_base
-        or get_vendor_template(request.vendor).get("api_base"),
-        api_path=request.api_path,
-        api_spec=request.api_spec or "openai",
-        params=request.params or {},
-        priority=request.priority,
-    )
+        if exist:
+            raise HTTPException(status_code=400, detail="模型配置已存在")
+
+        model = ModelConfig(
+            vendor=request.vendor,
+            model_name=request.model_name,
+            api_key=request.api_key,
+            api_base=request.api_base
+            or get_vendor_template(request.vendor).get("api_base"),
+            api_path=request.api_path,
+            api_spec=request.api_spec or "openai",
+            params=request.params or {},
+            priority=request.priority,
+        )
 
-    db.add(model)
-    db.commit()
-    db.refresh(model)
-
-    # 创建额度记录
-    quota = QuotaStat(
-        model_id=model.id,
-        total_quota=0,
-        used_quota=0,
-        remain_quota=0,
-        used_ratio=0,
-        sync_type=0,
-    )
-    db.add(quota)
-    db.commit()
+        db.add(model)
+        db.commit()
+        db.refresh(model)
+
+        # 创建额度记录
+        quota = QuotaStat(
+            model_id=model.id,
+            total_quota=0,
+            used_quota=0,
+            remain_quota=0,
+            used_ratio=0,
+            sync_type=0,
+        )
+        db.add(quota)
+        db.commit()
+        RoutingTable.rebuild(db)
 
-    return {"code": 200, "msg": "success", "data": {"id": model.id}}
+        return {"code": 200, "msg": "success", "data": {"id": model.id}}
+
+    return await run_in_db(execute)
 
 
 @app.post("/api/models/{model_id}/test")
 async def test_model_connectivity(model_id: int, db: SessionLocal = Depends(get_db)):
     """测试模型连通性"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+    def fetch():
+        return db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+    model = await run_in_db(fetch)
 
     if not model:
         raise HTTPException(status_code=404, detail="模型不存在")
 
     success = await GatewayCore.test_connectivity(
-        model.vendor, model.api_base, model.api_key, model.model_name
+        model.vendor,
+        model.api_base,
+        CredentialCache.get(model.id, model.api_key),
+        model.model_name,
     )
 
-    model.connect_status = 1 if success else 0
-    db.commit()
+    def execute():
+        model.connect_status = 1 if success else 0
+        db.commit()
+        RoutingTable.rebuild(db)
+
+    # 连通状态只在变化时写入
+    if model.connect_status != (1 if success else 0):
+        await run_in_db(execute)
 
     if success:
         return {"code": 200, "msg": "连通测试成功"}
@@ -288,29 +356,39 @@ async def fetch_available_models_api(request: FetchModelsRequest):
 @app.post("/api/models/{model_id}/enable")
 async def enable_model(model_id: int, db: SessionLocal = Depends(get_db)):
     """启用模型"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
 
-    if not model:
-        raise HTTPException(status_code=404, detail="模型不存在")
+    def execute():
+        model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+        if not model:
+            raise HTTPException(status_code=404, detail="模型不存在")
+
+        model.status = 1
+        db.commit()
+        RoutingTable.rebuild(db)
 
-    model.status = 1
-    db.commit()
+        return {"code": 200, "msg": "模型已启用"}
 
-    return {"code": 200, "msg": "模型已启用"}
+    return await run_in_db(execute)
 
 
 @app.post("/api/models/{model_id}/disable")
 async def disable_model(model_id: int, db: SessionLocal = Depends(get_db)):
     """禁用模型"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
 
-    if not model:
-        raise HTTPException(status_code=404, detail="模型不存在")
+    def execute():
+        model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+        if not model:
+            raise HTTPException(status_code=404, detail="模型不存在")
 
-    model.status = 0
-    db.commit()
+        model.status = 0
+        db.commit()
+        RoutingTable.rebuild(db)
 
-    return {"code": 200, "msg": "模型已禁用"}
+        return {"code": 200, "msg": "模型已禁用"}
+
+    return await run_in_db(execute)
 
 
 class UpdateModelRequest(BaseModel):
@@ -329,52 +407,72 @@ async def update_model(
     model_id: int, request: UpdateModelRequest, db: SessionLocal = Depends(get_db)
 ):
     """更新模型配置"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
 
-    if not model:
-        raise HTTPException(status_code=404, detail="模型不存在")
+    def execute():
+        model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+        if not model:
+            raise HTTPException(status_code=404, detail="模型不存在")
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "更新模型 %s",
+                model_id,
+                extra={
+                    "request_data": request.dict(
+                        exclude={"api_key"}, exclude_none=True
+                    ),
+                    "priority": model.priority,
+                },
+            )
 
-    print(f"[DEBUG] 更新模型 {model_id}, 请求数据: {request.dict()}")
-    print(f"[DEBUG] 更新前 priority: {model.priority}")
-
-    # 更新字段（如果提供了新值）
-    if request.vendor is not None:
-        model.vendor = request.vendor
-    if request.model_name is not None:
-        model.model_name = request.model_name
-    if request.api_base is not None:
-        model.api_base = request.api_base
-    if request.api_key is not None:
-        model.api_key = request.api_key
-    if request.api_path is not None:
-        model.api_path = request.api_path
-    if request.api_spec is not None:
-        model.api_spec = request.api_spec
-    if request.params is not None:
-        model.params = request.params
-    if request.priority is not None:
-        model.priority = request.priority
-        print(f"[DEBUG] 更新 priority 为: {request.priority}")
-
-    db.commit()
-    db.refresh(model)
-    print(f"[DEBUG] 更新后 priority: {model.priority}")
-
-    return {"code": 200, "msg": "success", "data": {"id": model.id}}
+        # 更新字段（如果提供了新值）
+        if request.vendor is not None:
+            model.vendor = request.vendor
+        if request.model_name is not None:
+            model.model_name = request.model_name
+        if request.api_base is not None:
+            model.api_base = request.api_base
+        if request.api_key is not None:
+            model.api_key = request.api_key
+        if request.api_path is not None:
+            model.api_path = request.api_path
+        if request.api_spec is not None:
+            model.api_spec = request.api_spec
+        if request.params is not None:
+            model.params = request.params
+        if request.priority is not None:
+            model.priority = request.priority
+
+        db.commit()
+        db.refresh(model)
+        CredentialCache.invalidate(model_id)
+        RoutingTable.rebuild(db)
+        logger.debug("模型 %s 更新后 priority: %s", model_id, model.priority)
+
+        return {"code": 200, "msg": "success", "data": {"id": model.id}}
+
+    return await run_in_db(execute)
 
 
 @app.delete("/api/models/{model_id}")
 async def delete_model(model_id: int, db: SessionLocal = Depends(get_db)):
     """删除模型"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
 
-    if not model:
-        raise HTTPException(status_code=404, detail="模型不存在")
+    def execute():
+        model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+        if not model:
+            raise HTTPException(status_code=404, detail="模型不存在")
+
+        db.delete(model)
+        db.commit()
+        CredentialCache.invalidate(model_id)
+        RoutingTable.rebuild(db)
 
-    db.delete(model)
-    db.commit()
+        return {"code": 200, "msg": "删除成功"}
 
-    return {"code": 200, "msg": "删除成功"}
+    return await run_in_db(execute)
 
 
 # ==================== 额度统计接口 ====================
@@ -383,35 +481,43 @@ async def get_quota_stats(
     model_id: Optional[int] = None, db: SessionLocal = Depends(get_db)
 ):
     """获取额度统计"""
-    query = db.query(QuotaStat)
 
-    if model_id:
-        query = query.filter(QuotaStat.model_id == model_id)
+    def fetch():
+        query = db.query(QuotaStat)
 
-    stats = query.all()
+        if model_id:
+            query = query.filter(QuotaStat.model_id == model_id)
 
-    return {
-        "code": 200,
-        "msg": "success",
-        "data": [
-            {
-                "model_id": s.model_id,
-                "total_quota": s.total_quota,
-                "used_quota": s.used_quota,
-                "remain_quota": s.remain_quota,
-                "used_ratio": s.used_ratio,
-                "sync_type": s.sync_type,
-                "last_sync_time": s.last_sync_time,
-            }
-            for s in stats
-        ],
-    }
+        stats = query.all()
+
+        return {
+            "code": 200,
+            "msg": "success",
+            "data": [
+                {
+                    "model_id": s.model_id,
+                    "total_quota": s.total_quota,
+                    "used_quota": s.used_quota,
+                    "remain_quota": s.remain_quota,
+                    "used_ratio": s.used_ratio,
+                    "sync_type": s.sync_type,
+                    "last_sync_time": s.last_sync_time,
+                }
+                for s in stats
+            ],
+        }
+
+    return await run_in_db(fetch)
 
 
 @app.post("/api/quota/sync/{model_id}")
 async def sync_quota(model_id: int, db: SessionLocal = Depends(get_db)):
     """同步模型额度"""
-    model = db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+    def fetch():
+        return db.query(ModelConfig).filter(ModelConfig.id == model_id).first()
+
+    model = await run_in_db(fetch)
 
     if not model:
         raise HTTPException(status_code=404, detail="模型不存在")
@@ -480,55 +586,309 @@ async def list_models_v1(authorization: Optional[str] = Header(None)):
 
     gateway_api_key = authorization.replace("Bearer ", "")
 
-    # 获取所有启用的模型
-    db = SessionLocal()
-    try:
-        models = (
-            db.query(ModelConfig)
-            .filter(ModelConfig.status == 1)
-            .order_by(ModelConfig.priority)
-            .all()
-        )
-
-        # 如果没有启用任何模型，返回空列表
-        if not models:
-            return {"object": "list", "data": []}
+    def fetch():
+        # 获取所有启用的模型
+        db = SessionLocal()
+        try:
+            models = (
+                db.query(ModelConfig)
+                .filter(ModelConfig.status == 1)
+                .order_by(ModelConfig.priority)
+                .all()
+            )
 
-        # 转换为 OpenAI 格式
-        models_data = []
+            # 如果没有启用任何模型，返回空列表
+            if not models:
+                return {"object": "list", "data": []}
 
-        # 只有启用了模型才添加 auto 选项
-        models_data.append(
-            {
-                "id": "auto",
-                "object": "model",
-                "created": 0,
-                "owned_by": "gateway",
-                "description": "自动根据优先级切换模型",
-                "capabilities": {"auto_switch": True, "priority_based": True},
-            }
-        )
+            # 转换为 OpenAI 格式
+            models_data = []
 
-        for model in models:
+            # 只有启用了模型才添加 auto 选项
             models_data.append(
                 {
-                    "id": model.model_name,
+                    "id": "auto",
                     "object": "model",
-                    "created": int(model.create_time.timestamp())
-                    if model.create_time
-                    else 0,
-                    "owned_by": model.vendor,
+                    "created": 0,
+                    "owned_by": "gateway",
+                    "description": "自动根据优先级切换模型",
+                    "capabilities": {"auto_switch": True, "priority_based": True},
                 }
             )
 
-        return {"object": "list", "data": models_data}
+            for model in models:
+                models_data.append(
+                    {
+                        "id": model.model_name,
+                        "object": "model",
+                        "created": int(model.create_time.timestamp())
+                        if model.create_time
+                        else 0,
+                        "owned_by": model.vendor,
+                    }
+                )
+
+            return {"object": "list", "data": models_data}
+        finally:
+            db.close()
+
+    return await run_in_db(fetch)
+
+
+def _build_chat_request_data(request: ChatCompletionRequest, model) -> Dict[str, Any]:
+    """按目标模型构建转发请求体"""
+    request_data = {
+        "model": model.model_name,
+        "messages": [m.model_dump() for m in request.messages],
+        "stream": request.stream,
+    }
+
+    if request.temperature is not None:
+        request_data["temperature"] = request.temperature
+    if request.max_tokens is not None:
+        request_data["max_tokens"] = request.max_tokens
+    # 客户端请求的流式用量选项原样转发
+    stream_options = (request.model_extra or {}).get("stream_options")
+    if request.stream and isinstance(stream_options, dict):
+        request_data["stream_options"] = stream_options
+
+    return request_data
+
+
+def _estimate_tokens(model, request_data: Dict[str, Any]) -> int:
+    """按目标模型的分词器估算请求消耗的 token 数（输入 + 输出上限）"""
+    prompt_tokens = TokenEstimator.count_messages(
+        model.vendor, model.model_name, request_data["messages"]
+    )
+    return prompt_tokens + (
+        request_data.get("max_tokens") or RateLimiter.DEFAULT_COMPLETION_TOKENS
+    )
+
+
+def _token_budget_error(
+    model,
+    messages: List[Dict[str, Any]],
+    max_tokens: Optional[int],
+    check_quota: bool = True,
+) -> Optional[HTTPException]:
+    """按本地 token 估算检查上下文长度与剩余额度，超出时返回对应的错误
+
+    check_quota 为 False 时（所有模型额度均已达到切换阈值，仍全部尝试），
+    剩余额度不足只记录告警，由上游决定是否接受请求。
+    """
+    prompt_tokens = TokenEstimator.count_messages(
+        model.vendor, model.model_name, messages
+    )
+    required = prompt_tokens + (max_tokens or 0)
+
+    # 只按模型参数中配置的上下文长度拒绝；按模型名推断的长度可能过时，只记录告警
+    context_window = TokenEstimator.context_window(model.params)
+    if context_window and required > context_window:
+        return HTTPException(
+            status_code=400,
+            detail=f"请求约 {prompt_tokens} tokens（max_tokens {max_tokens or 0}），"
+            f"超过模型 '{model.model_name}' 的上下文长度 {context_window}",
+        )
+    if context_window is None:
+        guessed = TokenEstimator.guess_context_window(model.model_name)
+        if guessed and required > guessed:
+            logger.warning(
+                "请求约 %s tokens，可能超过模型 '%s' 的上下文长度 %s"
+                "（按模型名推断，未配置 context_window），仍然转发",
+                required,
+                model.model_name,
+                guessed,
+            )
+
+    remaining = QuotaTracker.remaining(model.id)
+    if remaining is not None and required > remaining:
+        if not check_quota:
+            logger.warning(
+                "模型 '%s' 剩余额度 %.0f tokens，不足以处理约 %s tokens 的请求，仍然尝试",
+                model.model_name,
+                remaining,
+                required,
+            )
+            return None
+        return HTTPException(
+            status_code=429,
+            detail=f"模型 '{model.model_name}' 剩余额度 {remaining:.0f} tokens，"
+            f"不足以处理约 {required} tokens 的请求",
+        )
+    return None
+
+
+def _lookup_cache(
+    request: ChatCompletionRequest,
+    model,
+    use_cache: bool,
+    semantic_query,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """查找模型的精确匹配缓存与语义缓存，返回 (命中层级, 响应)"""
+    if use_cache:
+        response = ResponseCache.get(
+            ResponseCache.make_key(model.id, _build_chat_request_data(request, model))
+        )
+        if response is not None:
+            return "exact", response
+    if semantic_query is not None:
+        response = SemanticCache.get(
+            model.id, semantic_query, model.params.get("semantic_cache_threshold")
+        )
+        if response is not None:
+            return "semantic", response
+    return None, None
+
+
+def _rate_limit_hook(model):
+    """上游响应回调：按限流响应头调整模型令牌桶"""
+    return lambda response: RateLimiter.observe_upstream(
+        model.id, response.status_code, response.headers
+    )
+
+
+def _rate_limit_error(error: RateLimitExceeded) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+async def _call_model(
+    model, request_data: Dict[str, Any], max_wait: float = 0.0
+) -> Dict[str, Any]:
+    """向单个模型发起非流式请求，校验响应并记录延迟、负载与熔断统计
+
+    发出请求前先通过模型限流，令牌不足时最多排队 max_wait 秒。
+    """
+    tokens = _estimate_tokens(model, request_data)
+    await RateLimiter.acquire_model(model, tokens, max_wait)
+
+    started = time.perf_counter()
+    RoutingStats.acquire(model.id)
+    try:
+        response = await GatewayCore.sync_request(
+            model.vendor,
+            model.api_base,
+            model.api_key,
+            request_data,
+            on_response=_rate_limit_hook(model),
+        )
+
+        # 验证响应是否有效（必须有 choices 且有内容）
+        choices = response.get("choices", [])
+        if not choices or not choices[0].get("message", {}).get("content", "").strip():
+            raise ValueError(f"模型返回空响应")
+    except Exception as e:
+        latency = time.perf_counter() - started
+        RoutingStats.observe(model.id, latency, success=False)
+        await CircuitBreaker.record(model, False, latency, e)
+        raise
+    finally:
+        RoutingStats.release(model.id)
+
+    latency = time.perf_counter() - started
+    RoutingStats.observe(model.id, latency)
+    HedgePolicy.observe(model.id, latency)
+    await CircuitBreaker.record(model, True, latency)
+    RateLimiter.settle_model(model.id, tokens, response.get("usage"))
+    # 只统计实际发往上游的调用：缓存命中与合并的请求不经过这里
+    usage = QuotaMonitor.calculate_usage(model.vendor, response)
+    QuotaTracker.record(model.id, usage)
+    Metrics.record_tokens(model.vendor, model.model_name, usage)
+    return response
+
+
+async def _track_stream(
+    stream,
+    model,
+    usage: StreamUsage,
+    log_content: Dict[str, Any],
+    on_usage: Callable[[Dict[str, Any]], None],
+    started: float,
+):
+    """转发流式响应，结束（或客户端断开）时释放进行中计数、统计用量并记录日志
+
+    started 为发出上游请求的时间：熔断按整个流的耗时判断慢调用，与非流式请求一致。
+    已开始响应后上游出错或中断时无法再切换模型：向客户端发送错误事件，
+    按失败记录日志、路由统计与熔断。
+    """
+    error = None
+    try:
+        async for chunk in stream:
+            yield chunk
+    except Exception as e:
+        error = e
+        logger.warning("流式响应中断: %s - %s: %s", model.vendor, model.model_name, e)
+        yield f"data: {json.dumps({'error': '上游流式响应中断'})}\n\n"
     finally:
-        db.close()
+        RoutingStats.release(model.id)
+        latency = time.perf_counter() - started
+        await CircuitBreaker.record(model, error is None, latency, error)
+        if error is not None:
+            RoutingStats.observe(model.id, latency, success=False)
+            log_content = {**log_content, "status": "failed", "error": str(error)}
+        result = usage.result()
+        QuotaTracker.record(model.id, result)
+        Metrics.record_tokens(model.vendor, model.model_name, result)
+        on_usage(result)
+        await LogWriter.write(
+            log_type=1,
+            model_id=model.id,
+            log_content=json.dumps({**log_content, "usage": result}),
+            status=0 if error is not None else 1,
+            usage=result,
+        )
+
+
+async def _sync_chat(
+    request: ChatCompletionRequest,
+    model,
+    coalesce: bool = False,
+    max_wait: float = 0.0,
+) -> Dict[str, Any]:
+    """非流式请求，coalesce 时相同的进行中请求共享一次上游调用"""
+    request_data = _build_chat_request_data(request, model)
+    if not coalesce:
+        return await _call_model(model, request_data, max_wait)
+
+    key = ResponseCache.make_key(model.id, request_data)
+    return await SingleFlight.run(
+        key, lambda: _call_model(model, request_data, max_wait)
+    )
+
+
+def _track_request(handler):
+    """统计 chat completions 请求数、处理耗时与进行中请求数"""
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        Metrics.inflight.inc()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await handler(*args, **kwargs)
+            outcome = "success"
+            return response
+        except HTTPException as e:
+            outcome = Metrics.outcome(e.status_code)
+            raise
+        finally:
+            Metrics.inflight.inc(amount=-1)
+            Metrics.requests.inc((outcome,))
+            Metrics.request_latency.observe(time.perf_counter() - started)
+
+    return wrapper
 
 
 @app.post("/v1/chat/completions")
+@_track_request
 async def chat_completions(
-    request: ChatCompletionRequest, authorization: Optional[str] = Header(None)
+    request: ChatCompletionRequest,
+    authorization: Optional[str] = Header(None),
+    x_hedge: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
 ):
     """OpenAI兼容的Chat Completions接口，支持自动切换模型"""
     if not authorization or not authorization.startswith("Bearer "):
@@ -536,150 +896,313 @@ async def chat_completions(
 
     gateway_api_key = authorization.replace("Bearer ", "")
     requested_model = request.model
-    print(
-        f"[DEBUG] requested_model: '{requested_model}', type: {type(requested_model)}"
-    )
     is_auto_mode = (
         requested_model in ["auto", "Auto", "AUTO", ""] or not requested_model
     )
-    print(f"[DEBUG] is_auto_mode: {is_auto_mode}")
-
-    # 获取所有可用的模型（按优先级排序）
-    db = SessionLocal()
-    try:
-        available_models = (
-            db.query(ModelConfig)
-            .filter(ModelConfig.status == 1, ModelConfig.connect_status == 1)
-            .order_by(ModelConfig.priority)
-            .all()
-        )
-
-        if not available_models:
-            raise HTTPException(status_code=503, detail="无可用模型，请先配置模型")
+    logger.debug(
+        "chat completions 请求",
+        extra={"requested_model": requested_model, "auto_mode": is_auto_mode},
+    )
 
-        # 决定要尝试的模型列表
-        if is_auto_mode:
-            # auto 模式：尝试所有可用模型
-            models_to_try = available_models
-        else:
-            # 指定具体模型：只试指定的模型
-            print(f"[DEBUG] Looking for model: '{requested_model}'")
-            print(
-                f"[DEBUG] Available models: {[m.model_name for m in available_models]}"
-            )
-            target_model = next(
-                (m for m in available_models if m.model_name == requested_model), None
+    # 从内存路由表获取所有可用的模型（按优先级排序）
+    available_models = RoutingTable.get_routes()
+
+    if not available_models:
+        raise HTTPException(status_code=503, detail="无可用模型，请先配置模型")
+
+    # 决定要尝试的模型列表
+    if is_auto_mode:
+        # auto 模式：跳过额度达到切换阈值的模型，全部达到时仍全部尝试
+        candidates = [m for m in available_models if QuotaTracker.allow(m.id)]
+        quota_exhausted = not candidates
+        if quota_exhausted:
+            logger.warning("所有可用模型的额度均已达到切换阈值")
+            candidates = available_models
+        # 尝试所有未熔断的可用模型，全部熔断时仍按优先级尝试
+        models_to_try = [m for m in candidates if CircuitBreaker.allow(m.id)]
+        if not models_to_try:
+            logger.warning("所有可用模型均处于熔断状态")
+            models_to_try = candidates
+        # 按路由策略（默认静态优先级）决定尝试顺序
+        models_to_try = RoutingStrategy.order(models_to_try)
+    else:
+        # 指定具体模型：只试指定的模型
+        target_model = RoutingTable.get_route(requested_model)
+        if target_model and not CircuitBreaker.allow(target_model.id):
+            raise HTTPException(
+                status_code=503,
+                detail=f"模型 '{requested_model}' 暂时不可用（熔断中）",
             )
-            print(f"[DEBUG] target_model found: {target_model}")
-            if target_model:
-                models_to_try = [target_model]
-            else:
-                # 指定模型不存在或不可用
-                print(f"[DEBUG] Model not found, raising 404")
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"模型 '{requested_model}' 不存在或不可用",
+        if target_model:
+            models_to_try = [target_model]
+            quota_exhausted = False
+        else:
+            # 指定模型不存在或不可用
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "指定模型不存在或不可用: %s",
+                    requested_model,
+                    extra={"available": [m.model_name for m in available_models]},
                 )
+            raise HTTPException(
+                status_code=404,
+                detail=f"模型 '{requested_model}' 不存在或不可用",
+            )
 
-        last_error = None
-        successful_model = None
-        response = None
-
-        for model in models_to_try:
-            try:
-                print(f"[INFO] 使用模型: {model.vendor} - {model.model_name}")
+    # 对冲请求：仅 auto 模式非流式请求，需开启 HEDGE_ENABLED 或携带 X-Hedge 请求头
+    use_hedge = is_auto_mode and not request.stream and HedgePolicy.is_enabled(x_hedge)
+    # 精确匹配缓存：仅非流式、确定性采样的请求，Cache-Control: no-cache 可跳过
+    use_cache = not request.stream and ResponseCache.is_cacheable(
+        request.temperature, cache_control
+    )
+    # 请求合并：与缓存规则一致，允许复用响应的请求才共享进行中的上游调用
+    use_coalesce = (
+        not request.stream
+        and SingleFlight.ENABLED
+        and ResponseCache.allows_request(request.temperature, cache_control)
+    )
+    # 语义缓存：精确匹配未命中时按消息相似度查找，查询向量与目标模型无关，只计算一次
+    semantic_query = None
+    if (
+        not request.stream
+        and SemanticCache.is_available()
+        and ResponseCache.allows_request(request.temperature, cache_control)
+    ):
+        semantic_query = SemanticCache.prepare(
+            _build_chat_request_data(request, models_to_try[0])
+        )
 
-                request_data = {
-                    "model": model.model_name,
-                    "messages": [m.model_dump() for m in request.messages],
-                    "stream": request.stream,
+    # 缓存命中不调用上游：在额度检查与限流之前查找，不占用网关 Key 的令牌
+    for model in models_to_try:
+        cached, response = _lookup_cache(request, model, use_cache, semantic_query)
+        if cached:
+            logger.info("命中%s缓存: %s - %s", cached, model.vendor, model.model_name)
+            await LogWriter.write(
+                log_type=1,
+                model_id=model.id,
+                log_content=json.dumps(
+                    {
+                        "model": requested_model or "auto",
+                        "actual_model": model.model_name,
+                        "status": "success",
+                        "usage": response.get("usage", {}),
+                        "cached": True,
+                        "cache_tier": cached,
+                    }
+                ),
+                status=1,
+                # 缓存命中未调用上游，不计 token
+                usage=None,
+            )
+            return response
+
+    # 发出请求前按本地 token 估算检查上下文长度与剩余额度：
+    # auto 模式跳过放不下的模型，没有可用模型或指定模型时直接拒绝；
+    # 所有模型额度均已达到切换阈值时不再按剩余额度拒绝
+    messages = [m.model_dump() for m in request.messages]
+    budget_errors = []
+    fitting_models = []
+    for model in models_to_try:
+        error = _token_budget_error(
+            model, messages, request.max_tokens, check_quota=not quota_exhausted
+        )
+        if error is None:
+            fitting_models.append(model)
+        else:
+            budget_errors.append(error)
+            logger.warning(error.detail)
+    if not fitting_models:
+        raise budget_errors[0]
+    models_to_try = fitting_models
+
+    # 本地限流：网关 Key 令牌不足时最多排队 RATE_LIMIT_MAX_WAIT 秒，超时返回 429
+    deadline = time.monotonic() + RateLimiter.MAX_WAIT
+    estimated_tokens = RateLimiter.estimate_tokens(messages, request.max_tokens)
+    try:
+        await RateLimiter.acquire_key(
+            gateway_api_key, estimated_tokens, RateLimiter.MAX_WAIT
+        )
+    except RateLimitExceeded as e:
+        raise _rate_limit_error(e)
+
+    async def log_failure(model, error):
+        error_msg = str(error)
+        if isinstance(error, RateLimitExceeded):
+            # 本地限流未发出请求，不是模型故障，不写失败日志
+            logger.warning(error_msg)
+            return
+
+        logger.error("模型 %s - %s 失败: %s", model.vendor, model.model_name, error_msg)
+
+        # 记录失败日志
+        await LogWriter.write(
+            log_type=3,
+            model_id=model.id,
+            log_content=json.dumps(
+                {
+                    "model": requested_model or "auto",
+                    "attempted_model": model.model_name,
+                    "error": error_msg,
                 }
+            ),
+            status=0,
+        )
 
-                if request.temperature is not None:
-                    request_data["temperature"] = request.temperature
-                if request.max_tokens is not None:
-                    request_data["max_tokens"] = request.max_tokens
-
-                if request.stream:
-                    return StreamingResponse(
-                        GatewayCore.stream_request(
-                            model.vendor, model.api_base, model.api_key, request_data
-                        ),
-                        media_type="text/event-stream",
+    last_error = None
+    successful_model = None
+    response = None
+    attempted = set()
+
+    for index, model in enumerate(models_to_try):
+        if model.id in attempted:
+            # 已作为对冲请求尝试过
+            continue
+        attempted.add(model.id)
+        has_fallback = is_auto_mode and index < len(models_to_try) - 1
+        # 模型限流：还有备选模型时不排队直接切换，最后一个模型排队至截止时间
+        max_wait = 0.0 if has_fallback else max(0.0, deadline - time.monotonic())
+
+        try:
+            logger.debug("使用模型: %s - %s", model.vendor, model.model_name)
+
+            if request.stream:
+                # 等到首个内容 chunk 才开始响应，此前失败或超时可切换下一个模型；
+                # 已向客户端发送字节后不再切换
+                request_data = _build_chat_request_data(request, model)
+                model_tokens = _estimate_tokens(model, request_data)
+                await RateLimiter.acquire_model(model, model_tokens, max_wait)
+                usage = StreamUsage(
+                    prompt_tokens=TokenEstimator.count_messages(
+                        model.vendor, model.model_name, messages
                     )
-                else:
-                    response = await GatewayCore.sync_request(
-                        model.vendor, model.api_base, model.api_key, request_data
+                )
+                started = time.perf_counter()
+                RoutingStats.acquire(model.id)
+                try:
+                    stream = await GatewayCore.open_stream(
+                        model.vendor,
+                        model.api_base,
+                        model.api_key,
+                        request_data,
+                        ttft_budget=GatewayCore.STREAM_TTFT_BUDGET
+                        if has_fallback
+                        else None,
+                        on_response=_rate_limit_hook(model),
+                        usage=usage,
                     )
-
-                # 验证响应是否有效（必须有 choices 且有内容）
-                choices = response.get("choices", [])
-                if (
-                    not choices
-                    or not choices[0].get("message", {}).get("content", "").strip()
-                ):
-                    raise ValueError(f"模型返回空响应")
-
-                # 成功：记录日志并返回
-                successful_model = model
-                log = OperationLog(
-                    log_type=1,
-                    model_id=model.id,
-                    log_content=json.dumps(
-                        {
-                            "model": requested_model or "auto",
-                            "actual_model": model.model_name,
-                            "status": "success",
-                            "usage": response.get("usage", {}),
-                        }
+                except BaseException as e:
+                    RoutingStats.release(model.id)
+                    if isinstance(e, Exception):
+                        ttft = time.perf_counter() - started
+                        RoutingStats.observe(model.id, ttft, success=False)
+                        await CircuitBreaker.record(model, False, ttft, e)
+                    raise
+                ttft = time.perf_counter() - started
+                RoutingStats.observe(model.id, ttft)
+
+                def settle_stream(result, model=model, model_tokens=model_tokens):
+                    RateLimiter.settle_model(model.id, model_tokens, result)
+                    RateLimiter.settle_key(gateway_api_key, estimated_tokens, result)
+
+                logger.info(
+                    "模型开始流式响应: %s - %s",
+                    model.vendor,
+                    model.model_name,
+                    extra={"ttft": round(ttft, 3)},
+                )
+                # 成功日志在流结束时写入，包含本次用量
+                log_content = {
+                    "model": requested_model or "auto",
+                    "actual_model": model.model_name,
+                    "status": "success",
+                    "stream": True,
+                }
+                return StreamingResponse(
+                    _track_stream(
+                        stream, model, usage, log_content, settle_stream, started
                     ),
-                    status=1,
+                    media_type="text/event-stream",
                 )
-                db.add(log)
-                db.commit()
-
-                print(f"[SUCCESS] 模型响应成功: {model.vendor} - {model.model_name}")
-                return response
 
-            except Exception as e:
-                last_error = e
-                error_msg = str(e)
-                print(
-                    f"[ERROR] 模型 {model.vendor} - {model.model_name} 失败: {error_msg}"
+            cache_key = None
+            if use_cache:
+                cache_key = ResponseCache.make_key(
+                    model.id, _build_chat_request_data(request, model)
                 )
 
-                # 记录失败日志
-                log = OperationLog(
-                    log_type=3,
-                    model_id=model.id,
-                    log_content=json.dumps(
-                        {
-                            "model": requested_model or "auto",
-                            "attempted_model": model.model_name,
-                            "error": error_msg,
-                        }
-                    ),
-                    status=0,
+            if use_hedge and index < len(models_to_try) - 1:
+                winner, response, failures = await HedgePolicy.run(
+                    model,
+                    models_to_try[index + 1],
+                    lambda m: _sync_chat(request, m, use_coalesce),
                 )
-                db.add(log)
-                db.commit()
-
-                # 如果是指定模型模式，失败直接抛出错误
-                if not is_auto_mode:
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"模型 '{requested_model}' 请求失败: {error_msg}",
-                    )
+                for failed_model, error in failures:
+                    attempted.add(failed_model.id)
+                    last_error = error
+                    await log_failure(failed_model, error)
+                if winner is None:
+                    continue
+                if winner is not model:
+                    # 备用模型的请求体不同，不写入主模型的缓存键
+                    cache_key = None
+                model = winner
+            else:
+                response = await _sync_chat(request, model, use_coalesce, max_wait)
 
-                # auto 模式继续尝试下一个
-                continue
+            if cache_key:
+                ResponseCache.put(cache_key, response)
+            if semantic_query is not None:
+                SemanticCache.put(model.id, semantic_query, response)
 
-        # 所有模型都失败了
-        error_detail = str(last_error) if last_error else "所有可用模型均失败"
-        raise HTTPException(status_code=500, detail=error_detail)
+            # 成功：记录日志并返回
+            successful_model = model
+            RateLimiter.settle_key(
+                gateway_api_key, estimated_tokens, response.get("usage")
+            )
+            await LogWriter.write(
+                log_type=1,
+                model_id=model.id,
+                log_content=json.dumps(
+                    {
+                        "model": requested_model or "auto",
+                        "actual_model": model.model_name,
+                        "status": "success",
+                        "usage": response.get("usage", {}),
+                        "cached": False,
+                        "cache_tier": None,
+                    }
+                ),
+                status=1,
+                usage=response.get("usage"),
+            )
 
-    finally:
-        db.close()
+            logger.info("模型响应成功: %s - %s", model.vendor, model.model_name)
+            return response
+
+        except Exception as e:
+            last_error = e
+            error_msg = str(e)
+            await log_failure(model, e)
+
+            # 如果是指定模型模式，失败直接抛出错误
+            if not is_auto_mode:
+                RateLimiter.refund_key(gateway_api_key, estimated_tokens)
+                if isinstance(e, RateLimitExceeded):
+                    raise _rate_limit_error(e)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"模型 '{requested_model}' 请求失败: {error_msg}",
+                )
+
+            # auto 模式继续尝试下一个
+            continue
+
+    # 所有模型都失败了：返还预扣的 token
+    RateLimiter.refund_key(gateway_api_key, estimated_tokens)
+    if isinstance(last_error, RateLimitExceeded):
+        raise _rate_limit_error(last_error)
+    error_detail = str(last_error) if last_error else "所有可用模型均失败"
+    raise HTTPException(status_code=500, detail=error_detail)
 
 
 # ==================== 工具函数 ====================
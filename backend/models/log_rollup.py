@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Index, Integer, String, UniqueConstraint
+from config.database import Base
+
+
+class LogRollup(Base):
+    """日志小时汇总表 - 按 (小时, 模型, 日志类型, 状态) 累计请求数与 token 数"""
+
+    __tablename__ = "log_rollup"
+    __table_args__ = (
+        UniqueConstraint(
+            "hour", "model_id", "log_type", "status", name="uq_log_rollup_key"
+        ),
+        # 使用趋势（按类型、时间范围）与模型排行（按类型、模型）只读索引即可完成
+        Index("ix_log_rollup_type_hour", "log_type", "hour", "request_count"),
+        Index("ix_log_rollup_type_model", "log_type", "model_id", "request_count"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    hour = Column(String(13), nullable=False, comment="小时桶: YYYY-MM-DD HH")
+    model_id = Column(
+        Integer, nullable=False, default=0, comment="关联模型ID，无关联模型时为 0"
+    )
+    log_type = Column(Integer, nullable=False, comment="日志类型，同 operation_log")
+    status = Column(Integer, nullable=False, comment="状态: 0=失败, 1=成功")
+    request_count = Column(Integer, nullable=False, default=0, comment="日志条数")
+    prompt_tokens = Column(Integer, nullable=False, default=0, comment="输入 token 数")
+    completion_tokens = Column(
+        Integer, nullable=False, default=0, comment="输出 token 数"
+    )
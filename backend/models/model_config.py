@@ -49,7 +49,7 @@ class ModelConfig(Base):
             "update_time": self.update_time.isoformat() if self.update_time else None,
         }
         if include_sensitive:
-            from config.encryption import decrypt_api_key
+            from services.credential_cache import CredentialCache
 
-            data["api_key"] = decrypt_api_key(self.api_key)
+            data["api_key"] = CredentialCache.get(self.id, self.api_key)
         return data
@@ -1,10 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
 from datetime import datetime
 from config.database import Base
 
 class OperationLog(Base):
     """操作日志表"""
     __tablename__ = "operation_log"
+    # 与日志列表、仪表盘的查询一致：按条件过滤后按时间倒序
+    __table_args__ = (
+        Index("ix_operation_log_create_time", "create_time"),
+        Index("ix_operation_log_type_time", "log_type", "create_time"),
+        Index("ix_operation_log_model_time", "model_id", "create_time"),
+        Index("ix_operation_log_status_time", "status", "create_time"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     log_type = Column(Integer, default=1, comment="日志类型: 1=访问日志, 2=切换日志, 3=错误日志, 4=测试日志")
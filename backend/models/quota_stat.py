@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, Float, DateTime
+from sqlalchemy import Column, Integer, Float, DateTime, Index
 from datetime import datetime
 from config.database import Base
 
 class QuotaStat(Base):
     """额度统计表"""
     __tablename__ = "quota_stat"
+    # 每个模型一条额度记录
+    __table_args__ = (
+        Index("uq_quota_stat_model_id", "model_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     model_id = Column(Integer, nullable=False, comment="关联模型ID")
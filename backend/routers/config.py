@@ -2,13 +2,17 @@
 系统配置 API 路由
 """
 
+import logging
+
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
-from config.database import get_db
+from config.database import get_db, run_in_db
 from models.system_config import SystemConfig
 
+logger = logging.getLogger(__name__)
+
 config_router = APIRouter()
 
 # 内存配置存储（生产环境应使用数据库）
@@ -32,22 +36,26 @@ async def list_configs(db: Session = Depends(get_db)):
     """
     获取所有配置（从数据库读取）
     """
-    try:
-        # 从数据库读取所有配置
-        configs = db.query(SystemConfig).all()
-        result = {}
-        for config in configs:
-            result[config.config_key] = config.config_value
 
-        # 合并内存中的配置（作为默认值）
-        for key, value in config_store.items():
-            if key not in result:
-                result[key] = value
+    def fetch():
+        try:
+            # 从数据库读取所有配置
+            configs = db.query(SystemConfig).all()
+            result = {}
+            for config in configs:
+                result[config.config_key] = config.config_value
+
+            # 合并内存中的配置（作为默认值）
+            for key, value in config_store.items():
+                if key not in result:
+                    result[key] = value
 
-        return {"code": 200, "msg": "success", "data": result}
-    except Exception as e:
-        print(f"从数据库读取配置失败: {e}")
-        return {"code": 200, "msg": "success", "data": config_store}
+            return {"code": 200, "msg": "success", "data": result}
+        except Exception as e:
+            logger.warning("从数据库读取配置失败: %s", e)
+            return {"code": 200, "msg": "success", "data": config_store}
+
+    return await run_in_db(fetch)
 
 
 @config_router.get("/api/config/{key}")
@@ -75,26 +83,32 @@ async def set_config(request: ConfigSetRequest, db: Session = Depends(get_db)):
     """
     设置配置
     """
-    config_store[request.key] = request.value
-
-    # 保存到数据库
-    try:
-        existing = (
-            db.query(SystemConfig)
-            .filter(SystemConfig.config_key == request.key)
-            .first()
-        )
-        if existing:
-            existing.config_value = request.value
-        else:
-            config = SystemConfig(config_key=request.key, config_value=request.value)
-            db.add(config)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        print(f"保存配置到数据库失败: {e}")
-
-    return {"code": 200, "msg": "配置已更新"}
+
+    def execute():
+        config_store[request.key] = request.value
+
+        # 保存到数据库
+        try:
+            existing = (
+                db.query(SystemConfig)
+                .filter(SystemConfig.config_key == request.key)
+                .first()
+            )
+            if existing:
+                existing.config_value = request.value
+            else:
+                config = SystemConfig(
+                    config_key=request.key, config_value=request.value
+                )
+                db.add(config)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning("保存配置到数据库失败: %s", e)
+
+        return {"code": 200, "msg": "配置已更新"}
+
+    return await run_in_db(execute)
 
 
 @config_router.post("/api/config/reset-encrypt-key")
@@ -7,7 +7,7 @@ from typing import List, Optional
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
-from config.database import get_db
+from config.database import get_db, run_in_db
 from models.notification import Notification
 
 notification_router = APIRouter()
@@ -34,22 +34,25 @@ async def create_notification(
     """
     创建新通知
     """
-    notification = Notification(
-        title=request.title,
-        content=request.content,
-        type=request.type,
-        is_read=False
-    )
+    def execute():
+        notification = Notification(
+            title=request.title,
+            content=request.content,
+            type=request.type,
+            is_read=False
+        )
     
-    db.add(notification)
-    db.commit()
-    db.refresh(notification)
+        db.add(notification)
+        db.commit()
+        db.refresh(notification)
     
-    return {
-        "code": 200,
-        "msg": "创建成功",
-        "data": notification.to_dict()
-    }
+        return {
+            "code": 200,
+            "msg": "创建成功",
+            "data": notification.to_dict()
+        }
+
+    return await run_in_db(execute)
 
 @notification_router.get("/api/notifications")
 async def get_notifications(
@@ -62,22 +65,25 @@ async def get_notifications(
     """
     获取通知列表
     """
-    query = db.query(Notification)
+    def fetch():
+        query = db.query(Notification)
     
-    if is_read is not None:
-        query = query.filter(Notification.is_read == is_read)
-    if notification_type:
-        query = query.filter(Notification.type == notification_type)
+        if is_read is not None:
+            query = query.filter(Notification.is_read == is_read)
+        if notification_type:
+            query = query.filter(Notification.type == notification_type)
     
-    notifications = query.order_by(
-        desc(Notification.created_at)
-    ).offset((page - 1) * page_size).limit(page_size).all()
+        notifications = query.order_by(
+            desc(Notification.created_at)
+        ).offset((page - 1) * page_size).limit(page_size).all()
     
-    return {
-        "code": 200,
-        "msg": "success",
-        "data": [n.to_dict() for n in notifications]
-    }
+        return {
+            "code": 200,
+            "msg": "success",
+            "data": [n.to_dict() for n in notifications]
+        }
+
+    return await run_in_db(fetch)
 
 @notification_router.put("/api/notifications/{notification_id}/read")
 async def mark_as_read(
@@ -87,18 +93,21 @@ async def mark_as_read(
     """
     标记通知为已读
     """
-    notification = db.query(Notification).filter(
-        Notification.id == notification_id
-    ).first()
+    def execute():
+        notification = db.query(Notification).filter(
+            Notification.id == notification_id
+        ).first()
     
-    if not notification:
-        raise HTTPException(status_code=404, detail="通知不存在")
+        if not notification:
+            raise HTTPException(status_code=404, detail="通知不存在")
     
-    notification.is_read = True
-    notification.read_at = datetime.now()
-    db.commit()
+        notification.is_read = True
+        notification.read_at = datetime.now()
+        db.commit()
     
-    return {"code": 200, "msg": "已标记为已读"}
+        return {"code": 200, "msg": "已标记为已读"}
+
+    return await run_in_db(execute)
 
 @notification_router.put("/api/notifications/read-all")
 async def mark_all_as_read(
@@ -107,15 +116,18 @@ async def mark_all_as_read(
     """
     标记所有通知为已读
     """
-    db.query(Notification).filter(
-        Notification.is_read == False
-    ).update({
-        "is_read": True,
-        "read_at": datetime.now()
-    })
-    db.commit()
+    def execute():
+        db.query(Notification).filter(
+            Notification.is_read == False
+        ).update({
+            "is_read": True,
+            "read_at": datetime.now()
+        })
+        db.commit()
     
-    return {"code": 200, "msg": "已全部标记为已读"}
+        return {"code": 200, "msg": "已全部标记为已读"}
+
+    return await run_in_db(execute)
 
 @notification_router.delete("/api/notifications/{notification_id}")
 async def delete_notification(
@@ -125,17 +137,20 @@ async def delete_notification(
     """
     删除通知
     """
-    notification = db.query(Notification).filter(
-        Notification.id == notification_id
-    ).first()
+    def execute():
+        notification = db.query(Notification).filter(
+            Notification.id == notification_id
+        ).first()
     
-    if not notification:
-        raise HTTPException(status_code=404, detail="通知不存在")
+        if not notification:
+            raise HTTPException(status_code=404, detail="通知不存在")
     
-    db.delete(notification)
-    db.commit()
+        db.delete(notification)
+        db.commit()
     
-    return {"code": 200, "msg": "删除成功"}
+        return {"code": 200, "msg": "删除成功"}
+
+    return await run_in_db(execute)
 
 @notification_router.get("/api/notifications/unread-count")
 async def get_unread_count(
@@ -144,11 +159,14 @@ async def get_unread_count(
     """
     获取未读通知数量
     """
-    count = db.query(Notification).filter(
-        Notification.is_read == False
-    ).count()
+    def fetch():
+        count = db.query(Notification).filter(
+            Notification.is_read == False
+        ).count()
     
-    return {"code": 200, "msg": "success", "data": {"count": count}}
+        return {"code": 200, "msg": "success", "data": {"count": count}}
+
+    return await run_in_db(fetch)
 
 @notification_router.delete("/api/notifications/clear-read")
 async def clear_read_notifications(
@@ -157,9 +175,12 @@ async def clear_read_notifications(
     """
     清除所有已读通知
     """
-    db.query(Notification).filter(
-        Notification.is_read == True
-    ).delete()
-    db.commit()
+    def execute():
+        db.query(Notification).filter(
+            Notification.is_read == True
+        ).delete()
+        db.commit()
     
-    return {"code": 200, "msg": "清除成功"}
+        return {"code": 200, "msg": "清除成功"}
+
+    return await run_in_db(execute)
@@ -4,16 +4,19 @@
 
 from fastapi import APIRouter, Depends, Query
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
-from config.database import get_db
+from config.database import get_db, run_in_db
 from models.model_config import ModelConfig
 from models.quota_stat import QuotaStat
 from models.operation_log import OperationLog
+from models.log_rollup import LogRollup
 from models.notification import Notification
 from models.system_config import SystemConfig
+from services.routing_table import ModelMeta, RoutingTable
+from services.stats_rollup import StatsRollup
 
 stats_router = APIRouter()
 
@@ -42,78 +45,84 @@ class DashboardResponse(BaseModel):
     data: dict
 
 
+def _model_map(db: Session, model_ids) -> Dict[int, ModelMeta]:
+    """按ID批量获取模型元数据
+
+    优先读内存路由表；其他进程刚新增、路由表尚未刷新的模型合并为一次查询
+    """
+    models = RoutingTable.get_models()
+    result = {}
+    missing = set()
+    for model_id in model_ids:
+        if model_id in models:
+            result[model_id] = models[model_id]
+        elif model_id:
+            missing.add(model_id)
+    if missing:
+        for model in db.query(ModelConfig).filter(ModelConfig.id.in_(missing)):
+            result[model.id] = ModelMeta.from_model(model)
+    return result
+
+
 @stats_router.get("/api/stats/dashboard")
 async def get_dashboard_stats(db: Session = Depends(get_db)):
     """
     获取仪表盘统计数据
     """
-    # 活跃模型数量
-    active_models = (
-        db.query(ModelConfig)
-        .filter(ModelConfig.status == 1, ModelConfig.connect_status == 1)
-        .count()
-    )
-
-    # 今日切换次数
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    switch_count = (
-        db.query(func.count(OperationLog.id))
-        .filter(
-            OperationLog.log_type == 2,  # 切换类型
-            OperationLog.create_time >= today,
-        )
-        .scalar()
-        or 0
-    )
-
-    # 今日请求次数
-    today_requests = (
-        db.query(func.count(OperationLog.id))
-        .filter(
-            OperationLog.log_type == 1,  # 请求类型
-            OperationLog.create_time >= today,
-        )
-        .scalar()
-        or 0
-    )
-
-    # 统计额度
-    quota_stats = db.query(QuotaStat).all()
-    total_quota = sum(s.total_quota for s in quota_stats)
-    used_quota = sum(s.used_quota for s in quota_stats)
-
-    # 当前使用模型
-    current_model = (
-        db.query(ModelConfig)
-        .filter(ModelConfig.status == 1)
-        .order_by(ModelConfig.priority)
-        .first()
-    )
-
-    current_quota = None
-    if current_model:
-        current_quota = (
-            db.query(QuotaStat).filter(QuotaStat.model_id == current_model.id).first()
-        )
 
-    # 额度预警模型
-    # 从配置中获取阈值，默认为80%
-    threshold = 80
-    try:
-        threshold_config = (
-            db.query(SystemConfig)
-            .filter(SystemConfig.config_key == "alert_threshold")
-            .first()
+    def fetch():
+        # 模型信息读内存路由表
+        models = RoutingTable.get_models()
+
+        # 活跃模型数量
+        active_models = len(RoutingTable.get_routes())
+
+        # 今日切换次数、请求次数（读取小时汇总）
+        today = StatsRollup.hour_of(datetime.now().replace(hour=0))
+        today_counts = dict(
+            db.query(LogRollup.log_type, func.sum(LogRollup.request_count))
+            .filter(
+                LogRollup.log_type.in_((1, 2)),  # 1=请求, 2=切换
+                LogRollup.hour >= today,
+            )
+            .group_by(LogRollup.log_type)
+            .all()
         )
-        if threshold_config and threshold_config.config_value:
-            threshold = int(threshold_config.config_value)
-    except Exception:
-        pass
-
-    alert_models = []
-    for qs in quota_stats:
-        if qs.used_ratio >= threshold:
-            model = db.query(ModelConfig).filter(ModelConfig.id == qs.model_id).first()
+        switch_count = today_counts.get(2) or 0
+        today_requests = today_counts.get(1) or 0
+
+        # 统计额度
+        quota_stats = db.query(QuotaStat).all()
+        total_quota = sum(s.total_quota for s in quota_stats)
+        used_quota = sum(s.used_quota for s in quota_stats)
+        quota_by_model = {qs.model_id: qs for qs in quota_stats}
+
+        # 当前使用模型（元数据按优先级排序）
+        current_model = next((m for m in models.values() if m.status == 1), None)
+
+        current_quota = None
+        if current_model:
+            current_quota = quota_by_model.get(current_model.id)
+
+        # 额度预警模型
+        # 从配置中获取阈值，默认为80%
+        threshold = 80
+        try:
+            threshold_config = (
+                db.query(SystemConfig)
+                .filter(SystemConfig.config_key == "alert_threshold")
+                .first()
+            )
+            if threshold_config and threshold_config.config_value:
+                threshold = int(threshold_config.config_value)
+        except Exception:
+            pass
+
+        alert_stats = [qs for qs in quota_stats if qs.used_ratio >= threshold]
+        alert_model_map = _model_map(db, [qs.model_id for qs in alert_stats])
+        alert_models = []
+        for qs in alert_stats:
+            model = alert_model_map.get(qs.model_id)
             if model:
                 alert_models.append(
                     {
@@ -124,58 +133,60 @@ async def get_dashboard_stats(db: Session = Depends(get_db)):
                     }
                 )
 
-    # 最近切换日志
-    switch_logs = (
-        db.query(OperationLog)
-        .filter(OperationLog.log_type == 2)
-        .order_by(desc(OperationLog.create_time))
-        .limit(10)
-        .all()
-    )
-
-    return {
-        "code": 200,
-        "msg": "success",
-        "data": {
-            "stats": {
-                "totalRequests": today_requests,
-                "activeModels": active_models,
-                "totalQuota": round(total_quota / 1000000, 2) if total_quota else 0,
-                "switchCount": switch_count,
-            },
-            "currentModel": {
-                "id": current_model.id,
-                "vendor": current_model.vendor,
-                "model_name": current_model.model_name,
-                "priority": current_model.priority,
-                "remain_quota": current_quota.remain_quota if current_quota else 0,
-                "used_ratio": round(current_quota.used_ratio, 2)
-                if current_quota
-                else 0,
-            }
-            if current_model
-            else None,
-            "switchLogs": [
-                {
-                    "id": log.id,
-                    "from_model": log.log_content.get("from_model")
-                    if isinstance(log.log_content, dict)
-                    else None,
-                    "to_model": log.log_content.get("to_model")
-                    if isinstance(log.log_content, dict)
-                    else None,
-                    "reason": log.log_content.get("reason")
-                    if isinstance(log.log_content, dict)
-                    else None,
-                    "create_time": log.create_time.strftime("%Y-%m-%d %H:%M:%S")
-                    if log.create_time
-                    else None,
+        # 最近切换日志
+        switch_logs = (
+            db.query(OperationLog)
+            .filter(OperationLog.log_type == 2)
+            .order_by(desc(OperationLog.create_time))
+            .limit(10)
+            .all()
+        )
+
+        return {
+            "code": 200,
+            "msg": "success",
+            "data": {
+                "stats": {
+                    "totalRequests": today_requests,
+                    "activeModels": active_models,
+                    "totalQuota": round(total_quota / 1000000, 2) if total_quota else 0,
+                    "switchCount": switch_count,
+                },
+                "currentModel": {
+                    "id": current_model.id,
+                    "vendor": current_model.vendor,
+                    "model_name": current_model.model_name,
+                    "priority": current_model.priority,
+                    "remain_quota": current_quota.remain_quota if current_quota else 0,
+                    "used_ratio": round(current_quota.used_ratio, 2)
+                    if current_quota
+                    else 0,
                 }
-                for log in switch_logs
-            ],
-            "alertModels": alert_models,
-        },
-    }
+                if current_model
+                else None,
+                "switchLogs": [
+                    {
+                        "id": log.id,
+                        "from_model": log.log_content.get("from_model")
+                        if isinstance(log.log_content, dict)
+                        else None,
+                        "to_model": log.log_content.get("to_model")
+                        if isinstance(log.log_content, dict)
+                        else None,
+                        "reason": log.log_content.get("reason")
+                        if isinstance(log.log_content, dict)
+                        else None,
+                        "create_time": log.create_time.strftime("%Y-%m-%d %H:%M:%S")
+                        if log.create_time
+                        else None,
+                    }
+                    for log in switch_logs
+                ],
+                "alertModels": alert_models,
+            },
+        }
+
+    return await run_in_db(fetch)
 
 
 @stats_router.get("/api/stats/usage")
@@ -185,32 +196,39 @@ async def get_usage_trend(
     """
     获取使用量趋势
     """
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-
-    # 按日期分组统计请求
-    daily_stats = (
-        db.query(
-            func.date(OperationLog.create_time).label("date"),
-            func.count(OperationLog.id).label("requests"),
+
+    def fetch():
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+
+        # 按小时分组（按索引顺序读取，无需临时排序），再合并为按日期统计
+        hourly_stats = (
+            db.query(LogRollup.hour, func.sum(LogRollup.request_count))
+            .filter(
+                LogRollup.log_type == 1,
+                LogRollup.hour >= StatsRollup.hour_of(start_date),
+            )
+            .group_by(LogRollup.hour)
+            .all()
         )
-        .filter(OperationLog.log_type == 1, OperationLog.create_time >= start_date)
-        .group_by(func.date(OperationLog.create_time))
-        .order_by(func.date(OperationLog.create_time))
-        .all()
-    )
 
-    # 转换为字典
-    trend_dict = {str(stat.date): stat.requests for stat in daily_stats}
+        # 转换为字典（小时桶的前 10 位即日期）
+        trend_dict = {}
+        for hour, requests in hourly_stats:
+            trend_dict[hour[:10]] = trend_dict.get(hour[:10], 0) + requests
+
+        # 生成完整日期序列
+        full_trend = []
+        for i in range(days):
+            date = (end_date - timedelta(days=days - 1 - i)).date()
+            date_str = date.strftime("%Y-%m-%d")
+            full_trend.append(
+                {"date": date_str, "requests": trend_dict.get(str(date), 0)}
+            )
 
-    # 生成完整日期序列
-    full_trend = []
-    for i in range(days):
-        date = (end_date - timedelta(days=days - 1 - i)).date()
-        date_str = date.strftime("%Y-%m-%d")
-        full_trend.append({"date": date_str, "requests": trend_dict.get(str(date), 0)})
+        return {"code": 200, "msg": "success", "data": {"trend": full_trend}}
 
-    return {"code": 200, "msg": "success", "data": {"trend": full_trend}}
+    return await run_in_db(fetch)
 
 
 @stats_router.get("/api/stats/models")
@@ -218,34 +236,42 @@ async def get_model_ranking(db: Session = Depends(get_db)):
     """
     获取模型使用排行
     """
-    # 统计每个模型的请求次数
-    model_stats = (
-        db.query(
-            OperationLog.model_id, func.count(OperationLog.id).label("request_count")
+
+    def fetch():
+        # 统计每个模型的请求次数
+        request_count = func.sum(LogRollup.request_count)
+        model_stats = (
+            db.query(
+                LogRollup.model_id,
+                request_count.label("request_count"),
+            )
+            .filter(LogRollup.log_type == 1)
+            .group_by(LogRollup.model_id)
+            .order_by(desc(request_count))
+            .limit(10)
+            .all()
         )
-        .filter(OperationLog.log_type == 1)
-        .group_by(OperationLog.model_id)
-        .order_by(desc(func.count(OperationLog.id)))
-        .limit(10)
-        .all()
-    )
 
-    total_requests = sum(stat.request_count for stat in model_stats) or 1
+        total_requests = sum(stat.request_count for stat in model_stats) or 1
 
-    rankings = []
-    for stat in model_stats:
-        model = db.query(ModelConfig).filter(ModelConfig.id == stat.model_id).first()
+        model_map = _model_map(db, [stat.model_id for stat in model_stats])
+        rankings = []
+        for stat in model_stats:
+            model = model_map.get(stat.model_id)
+            if model:
+                rankings.append(
+                    {
+                        "model": f"{model.vendor} - {model.model_name}",
+                        "requests": stat.request_count,
+                        "percentage": round(
+                            stat.request_count / total_requests * 100, 2
+                        ),
+                    }
+                )
 
-        if model:
-            rankings.append(
-                {
-                    "model": f"{model.vendor} - {model.model_name}",
-                    "requests": stat.request_count,
-                    "percentage": round(stat.request_count / total_requests * 100, 2),
-                }
-            )
+        return {"code": 200, "msg": "success", "data": {"rankings": rankings}}
 
-    return {"code": 200, "msg": "success", "data": {"rankings": rankings}}
+    return await run_in_db(fetch)
 
 
 @stats_router.get("/api/stats/quota")
@@ -253,39 +279,44 @@ async def get_quota_overview(db: Session = Depends(get_db)):
     """
     获取额度概览
     """
-    quota_stats = db.query(QuotaStat).all()
-
-    total = sum(q.total_quota for q in quota_stats)
-    used = sum(q.used_quota for q in quota_stats)
-    remain = total - used
-
-    models_data = []
-    for qs in quota_stats:
-        model = db.query(ModelConfig).filter(ModelConfig.id == qs.model_id).first()
-        models_data.append(
-            {
-                "model_id": qs.model_id,
-                "model_name": model.model_name if model else f"模型_{qs.model_id}",
-                "vendor": model.vendor if model else "未知",
-                "total": qs.total_quota,
-                "used": qs.used_quota,
-                "remain": qs.remain_quota,
-                "usage_rate": round(qs.used_ratio, 2),
-                "sync_type": qs.sync_type,
-                "last_sync_time": qs.update_time.strftime("%Y-%m-%d %H:%M:%S")
-                if qs.update_time
-                else None,
-            }
-        )
 
-    return {
-        "code": 200,
-        "msg": "success",
-        "data": {
-            "total": total,
-            "used": used,
-            "remain": remain,
-            "usage_rate": round(used / total * 100, 2) if total > 0 else 0,
-            "models": models_data,
-        },
-    }
+    def fetch():
+        quota_stats = db.query(QuotaStat).all()
+
+        total = sum(q.total_quota for q in quota_stats)
+        used = sum(q.used_quota for q in quota_stats)
+        remain = total - used
+
+        model_map = _model_map(db, [qs.model_id for qs in quota_stats])
+        models_data = []
+        for qs in quota_stats:
+            model = model_map.get(qs.model_id)
+            models_data.append(
+                {
+                    "model_id": qs.model_id,
+                    "model_name": model.model_name if model else f"模型_{qs.model_id}",
+                    "vendor": model.vendor if model else "未知",
+                    "total": qs.total_quota,
+                    "used": qs.used_quota,
+                    "remain": qs.remain_quota,
+                    "usage_rate": round(qs.used_ratio, 2),
+                    "sync_type": qs.sync_type,
+                    "last_sync_time": qs.update_time.strftime("%Y-%m-%d %H:%M:%S")
+                    if qs.update_time
+                    else None,
+                }
+            )
+
+        return {
+            "code": 200,
+            "msg": "success",
+            "data": {
+                "total": total,
+                "used": used,
+                "remain": remain,
+                "usage_rate": round(used / total * 100, 2) if total > 0 else 0,
+                "models": models_data,
+            },
+        }
+
+    return await run_in_db(fetch)
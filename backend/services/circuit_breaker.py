@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+from services.gateway_core import GatewayCore, UpstreamError
+from services.log_writer import LogWriter
+from services.routing_table import RoutingTable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _ModelCircuit:
+    """单个模型的熔断状态与滑动窗口统计"""
+
+    def __init__(self, route):
+        self.route = route
+        self.state = CLOSED
+        self.opened_at = 0.0
+        # (时间, 是否失败, 是否慢调用)
+        self.window = deque()
+        self.errors = 0
+        self.slow = 0
+
+    def add(self, now: float, failed: bool, slow: bool, window_seconds: float):
+        self.window.append((now, failed, slow))
+        self.errors += failed
+        self.slow += slow
+        while self.window and self.window[0][0] < now - window_seconds:
+            _, old_failed, old_slow = self.window.popleft()
+            self.errors -= old_failed
+            self.slow -= old_slow
+
+    def reset(self):
+        self.window.clear()
+        self.errors = 0
+        self.slow = 0
+
+
+class CircuitBreaker:
+    """模型熔断器 - 按模型统计错误率与慢调用比例
+
+    窗口内请求数达到 MIN_REQUESTS 且错误率或慢调用比例超过阈值时熔断（open），
+    auto 模式选择模型时跳过熔断中的模型。熔断 OPEN_DURATION 秒后由后台定时任务
+    发送探测请求（half_open），成功则恢复（closed），失败则继续熔断。
+    只有上游 5xx、超时与连接错误计为错误，4xx 等请求本身的问题不计入。
+    慢调用按整个请求的耗时判断，流式请求在流结束时按总耗时记录。
+    已删除或停用（不在路由表中）的模型在探测时移除。
+    熔断与恢复记录为切换日志（log_type=2）。
+    """
+
+    ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+    WINDOW = float(os.getenv("CIRCUIT_WINDOW", "60"))
+    MIN_REQUESTS = int(os.getenv("CIRCUIT_MIN_REQUESTS", "5"))
+    ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+    SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "30"))
+    SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+    OPEN_DURATION = float(os.getenv("CIRCUIT_OPEN_DURATION", "30"))
+    PROBE_INTERVAL = float(os.getenv("CIRCUIT_PROBE_INTERVAL", "5"))
+    PROBE_TIMEOUT = float(os.getenv("CIRCUIT_PROBE_TIMEOUT", "15"))
+
+    _circuits: Dict[int, _ModelCircuit] = {}
+    _probe_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def allow(cls, model_id: int) -> bool:
+        """模型是否可接收请求（熔断及探测期间不接收）"""
+        if not cls.ENABLED:
+            return True
+        circuit = cls._circuits.get(model_id)
+        return circuit is None or circuit.state == CLOSED
+
+    @staticmethod
+    def is_failure(error: BaseException) -> bool:
+        """异常是否说明模型不可用（上游 5xx、超时、连接错误）"""
+        if isinstance(error, UpstreamError):
+            return error.status_code >= 500
+        return isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError))
+
+    @classmethod
+    async def record(
+        cls,
+        route,
+        success: bool,
+        latency: float,
+        error: Optional[BaseException] = None,
+    ):
+        """记录一次请求结果，达到阈值时熔断
+
+        传入 error 时只有 is_failure 的异常计为失败，其余异常不计入统计。
+        """
+        if not cls.ENABLED:
+            return
+        if not success and error is not None and not cls.is_failure(error):
+            return
+
+        circuit = cls._circuits.get(route.id)
+        if circuit is None:
+            circuit = cls._circuits[route.id] = _ModelCircuit(route)
+        circuit.route = route
+        if circuit.state != CLOSED:
+            return
+
+        now = time.monotonic()
+        circuit.add(now, not success, latency >= cls.SLOW_CALL_SECONDS, cls.WINDOW)
+
+        total = len(circuit.window)
+        if total < cls.MIN_REQUESTS:
+            return
+
+        error_rate = circuit.errors / total
+        slow_rate = circuit.slow / total
+        if error_rate >= cls.ERROR_RATE:
+            reason = f"错误率 {error_rate:.0%} ({circuit.errors}/{total})"
+        elif slow_rate >= cls.SLOW_CALL_RATE:
+            reason = f"慢调用比例 {slow_rate:.0%} (>= {cls.SLOW_CALL_SECONDS:g}s)"
+        else:
+            return
+
+        circuit.state = OPEN
+        circuit.opened_at = now
+        circuit.reset()
+        await cls._log_transition(route, CLOSED, OPEN, f"熔断: {reason}")
+
+    @classmethod
+    async def _probe(cls, circuit: _ModelCircuit):
+        """半开探测：发送最小请求，成功则恢复"""
+        route = circuit.route
+        circuit.state = HALF_OPEN
+        try:
+            await asyncio.wait_for(
+                GatewayCore.sync_request(
+                    route.vendor,
+                    route.api_base,
+                    route.api_key,
+                    {
+                        "model": route.model_name,
+                        "messages": [{"role": "user", "content": "Hi"}],
+                        "max_tokens": 1,
+                    },
+                ),
+                cls.PROBE_TIMEOUT,
+            )
+        except Exception as e:
+            # 探测失败，重新计时
+            circuit.state = OPEN
+            circuit.opened_at = time.monotonic()
+            logger.warning(
+                "熔断探测失败: %s - %s: %s", route.vendor, route.model_name, e
+            )
+            return
+
+        circuit.state = CLOSED
+        await cls._log_transition(route, OPEN, CLOSED, "探测成功，恢复")
+
+    @classmethod
+    async def _log_transition(cls, route, from_state: str, to_state: str, reason: str):
+        logger.info(
+            "熔断状态变更: %s - %s %s -> %s (%s)",
+            route.vendor,
+            route.model_name,
+            from_state,
+            to_state,
+            reason,
+        )
+        await LogWriter.write(
+            log_type=2,
+            model_id=route.id,
+            log_content=json.dumps(
+                {
+                    "from_model": route.model_name if to_state == OPEN else None,
+                    "to_model": route.model_name if to_state == CLOSED else None,
+                    "reason": reason,
+                    "circuit": {"from": from_state, "to": to_state},
+                }
+            ),
+            status=1 if to_state == CLOSED else 0,
+        )
+
+    @classmethod
+    async def probe_due(cls):
+        """探测所有熔断时间已到的模型
+
+        先按路由表移除已删除或停用的模型，并使用路由表中的最新配置探测。
+        """
+        routes = {route.id: route for route in RoutingTable.get_routes()}
+        for model_id in list(cls._circuits):
+            route = routes.get(model_id)
+            if route is None:
+                del cls._circuits[model_id]
+            else:
+                cls._circuits[model_id].route = route
+
+        now = time.monotonic()
+        due = [
+            circuit
+            for circuit in cls._circuits.values()
+            if circuit.state == OPEN and now - circuit.opened_at >= cls.OPEN_DURATION
+        ]
+        if due:
+            await asyncio.gather(*(cls._probe(circuit) for circuit in due))
+
+    @classmethod
+    async def _probe_loop(cls):
+        while True:
+            await asyncio.sleep(cls.PROBE_INTERVAL)
+            try:
+                await cls.probe_due()
+            except Exception as e:
+                logger.warning("熔断探测任务异常: %s", e)
+
+    @classmethod
+    async def start(cls):
+        """启动半开探测定时任务（lifespan 启动时调用）"""
+        if cls.ENABLED and cls.PROBE_INTERVAL > 0:
+            cls._probe_task = asyncio.create_task(cls._probe_loop())
+
+    @classmethod
+    async def stop(cls):
+        """停止探测任务"""
+        task = cls._probe_task
+        cls._probe_task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @classmethod
+    def get_stats(cls) -> Dict[int, Dict[str, Any]]:
+        """获取各模型熔断状态"""
+        return {
+            model_id: {
+                "state": circuit.state,
+                "requests": len(circuit.window),
+                "errors": circuit.errors,
+                "slow": circuit.slow,
+            }
+            for model_id, circuit in cls._circuits.items()
+        }
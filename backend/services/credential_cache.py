@@ -0,0 +1,53 @@
+from typing import Dict, Optional, Tuple
+
+from cryptography.fernet import InvalidToken
+
+from config.encryption import decrypt_api_key, get_fernet
+
+
+class CredentialCache:
+    """凭据缓存 - 模型 API Key 解密结果只保存在进程内存中
+
+    lifespan 启动时预先派生加密密钥（PBKDF2），避免首个请求承担派生耗时；
+    每个模型的 Key 只解密一次，数据库中的值变化或模型更新/删除时重新解密。
+    历史数据中的 Key 可能是明文（见 fix_api_keys.py），无法解密时按明文使用。
+    """
+
+    # model_id -> (数据库中的值, 明文)
+    _secrets: Dict[int, Tuple[str, str]] = {}
+
+    @classmethod
+    def warm_up(cls):
+        """预先派生加密密钥并初始化 Fernet（lifespan 启动时调用）"""
+        get_fernet()
+
+    @classmethod
+    def get(cls, model_id: Optional[int], stored_key: Optional[str]) -> Optional[str]:
+        """获取模型的明文 API Key"""
+        if not stored_key:
+            return stored_key
+
+        entry = cls._secrets.get(model_id)
+        if entry is not None and entry[0] == stored_key:
+            return entry[1]
+
+        plaintext = cls._decrypt(stored_key)
+        if model_id is not None:
+            cls._secrets[model_id] = (stored_key, plaintext)
+        return plaintext
+
+    @classmethod
+    def _decrypt(cls, stored_key: str) -> str:
+        try:
+            return decrypt_api_key(stored_key)
+        except InvalidToken:
+            # 明文存储的 Key
+            return stored_key
+
+    @classmethod
+    def invalidate(cls, model_id: Optional[int] = None):
+        """清除单个模型（或全部）的缓存"""
+        if model_id is None:
+            cls._secrets.clear()
+        else:
+            cls._secrets.pop(model_id, None)
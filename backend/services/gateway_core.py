@@ -1,7 +1,28 @@
+import asyncio
+import codecs
 import json
+import logging
+import os
 import time
+from typing import AsyncGenerator, Callable, Dict, Any, List, Optional, Union
+from urllib.parse import urlparse
+
 import httpx
-from typing import AsyncGenerator, Dict, Any, List
+
+from services.http_client_pool import HttpClientPool
+from services.metrics import Metrics
+from services.stream_usage import StreamUsage
+from services.vendor_adapter import VendorAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """上游返回非 200 响应"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
 
 
 class GatewayCore:
@@ -17,6 +38,7 @@ class GatewayCore:
             "auth_format": "Bearer",
             "stream_support": True,
             "api_spec": "openai",
+            "stream_usage": True,
         },
         "qwen": {
             "name": "通义千问",
@@ -26,6 +48,7 @@ class GatewayCore:
             "auth_format": "Bearer",
             "stream_support": True,
             "api_spec": "openai",
+            "stream_usage": True,
         },
         "zhipu": {
             "name": "智谱 AI",
@@ -81,6 +104,7 @@ class GatewayCore:
             "auth_format": "Bearer",
             "stream_support": True,
             "api_spec": "openai",
+            "stream_usage": True,
         },
         "claude": {
             "name": "Claude",
@@ -162,6 +186,7 @@ class GatewayCore:
             "auth_format": "Bearer",
             "stream_support": True,
             "api_spec": "openai",
+            "stream_usage": True,
         },
         "minimax": {
             "name": "MiniMax",
@@ -180,6 +205,7 @@ class GatewayCore:
             "auth_format": "Bearer",
             "stream_support": True,
             "api_spec": "openai",
+            "stream_usage": True,
         },
         "moonshot": {
             "name": "月之暗面 (Moonshot)",
@@ -292,38 +318,90 @@ class GatewayCore:
         },
     }
 
+    # 已预编译的厂商适配器缓存: (vendor, api_base, api_key) -> VendorAdapter
+    MAX_ADAPTERS = 256
+    # OpenAI 兼容上游的流式响应是否直接透传
+    STREAM_PASSTHROUGH = os.getenv("STREAM_PASSTHROUGH", "true").lower() == "true"
+    # auto 模式下等待首个内容 chunk 的时间预算 (秒)，超时切换下一个模型
+    STREAM_TTFT_BUDGET = float(os.getenv("STREAM_TTFT_BUDGET", "10"))
+    # 流式请求是否向支持的上游请求 stream_options.include_usage
+    STREAM_INCLUDE_USAGE = os.getenv("STREAM_INCLUDE_USAGE", "true").lower() == "true"
+    _adapters: Dict[tuple, VendorAdapter] = {}
+
+    @classmethod
+    def get_adapter(cls, vendor: str, api_base: str, api_key: str) -> VendorAdapter:
+        """获取模型配置对应的厂商适配器，首次使用时创建并缓存"""
+        key = (vendor, api_base, api_key)
+        adapter = cls._adapters.get(key)
+
+        if adapter is None:
+            config = cls.VENDOR_CONFIGS.get(vendor, {})
+            adapter = VendorAdapter(
+                vendor,
+                url=cls._build_url(api_base, config),
+                headers=cls._build_headers(vendor, api_key, config),
+                stream_passthrough=cls._supports_stream_passthrough(vendor, config),
+                stream_usage=cls.STREAM_INCLUDE_USAGE
+                and bool(config.get("stream_usage")),
+            )
+            if len(cls._adapters) >= cls.MAX_ADAPTERS:
+                # 淘汰最早创建的适配器
+                cls._adapters.pop(next(iter(cls._adapters)))
+            cls._adapters[key] = adapter
+
+        return adapter
+
+    @classmethod
+    def _supports_stream_passthrough(cls, vendor: str, config: Dict) -> bool:
+        """上游流式响应是否已是 OpenAI SSE 格式，无需转换"""
+        if not cls.STREAM_PASSTHROUGH:
+            return False
+        if config.get("openai_compatible"):
+            return True
+        # 注册了自定义转换的厂商（如 qwen 原生格式）仍需逐行解析
+        return config.get("api_spec") == "openai" and not VendorAdapter.is_registered(
+            vendor
+        )
+
+    @classmethod
+    def _build_url(cls, api_base: str, config: Dict) -> str:
+        """构建请求 URL，避免路径重复"""
+        api_base_clean = api_base.rstrip("/")
+        api_path = config.get("api_path", "/v1/chat/completions")
+
+        # 检查 api_base 是否已经包含 api_path 的部分路径
+        # 例如 api_base="https://example.com/v1" 且 api_path="/v1/chat/completions"
+        if api_path.startswith("/v1") and api_base_clean.endswith("/v1"):
+            # 去掉重复的 /v1
+            return f"{api_base_clean}{api_path[3:]}"
+        return f"{api_base_clean}{api_path}"
+
     # 厂商特定的请求体构建器
     @classmethod
     def _build_vendor_request(cls, vendor: str, request_data: Dict) -> Dict:
         """根据厂商构建特定的请求体"""
+        return VendorAdapter.get_handlers(vendor)["request"](request_data)
+
+    @classmethod
+    def _build_base_request(cls, request_data: Dict) -> Dict:
+        """构建 OpenAI 兼容请求体（默认）"""
         base_request = {
             "model": request_data.get("model"),
             "messages": request_data.get("messages", []),
         }
 
         # 复制标准参数
-        for param in ["temperature", "max_tokens", "top_p", "stop", "stream"]:
+        for param in [
+            "temperature",
+            "max_tokens",
+            "top_p",
+            "stop",
+            "stream",
+            "stream_options",
+        ]:
             if param in request_data:
                 base_request[param] = request_data[param]
 
-        # 厂商特定处理
-        config = cls.VENDOR_CONFIGS.get(vendor, {})
-
-        # 如果是 OpenAI 兼容模式，直接使用标准格式
-        if config.get("openai_compatible"):
-            return request_data
-
-        if vendor == "gemini":
-            return cls._build_gemini_request(request_data)
-        elif vendor == "claude":
-            return cls._build_claude_request(request_data)
-        elif vendor == "qwen":
-            return cls._build_qwen_request(request_data)
-        elif vendor in ["qwen_official"]:
-            return cls._build_qwen_official_request(request_data)
-        elif vendor == "spark":
-            return cls._build_spark_request(request_data)
-
         return base_request
 
     @classmethod
@@ -523,8 +601,8 @@ class GatewayCore:
         """测试模型连通性"""
         try:
             if not api_base.startswith(("http://", "https://")):
-                print(
-                    f"连通性测试失败: API Base URL 格式错误，应以 http:// 或 https:// 开头"
+                logger.warning(
+                    "连通性测试失败: API Base URL 格式错误，应以 http:// 或 https:// 开头"
                 )
                 return False
 
@@ -539,29 +617,84 @@ class GatewayCore:
                 api_base_clean = api_base_clean[:-3]
             url = f"{api_base_clean}{api_path}"
 
-            async with httpx.AsyncClient(
-                timeout=10.0, follow_redirects=False
-            ) as client:
-                response = await client.post(url, json=test_request, headers=headers)
-                print(f"[DEBUG] Test response status: {response.status_code}")
-                if response.status_code == 200:
-                    return True
-                elif response.status_code == 429:
-                    # 429 表示 API 可达但额度限制（如余额不足），视为连通
-                    print(f"[DEBUG] API 返回 429，视为连通（可能是余额不足）")
-                    return True
-                elif 400 <= response.status_code < 500:
-                    print(
-                        f"[DEBUG] Client error {response.status_code}: {response.text[:200]}"
-                    )
-                    return False
-                else:
-                    return True
+            client = HttpClientPool.get_client(url)
+            response = await client.post(
+                url, json=test_request, headers=headers, timeout=10.0
+            )
+            logger.debug(
+                "连通性测试响应: %s - %s",
+                vendor,
+                model_name,
+                extra={"status_code": response.status_code},
+            )
+            if response.status_code == 200:
+                return True
+            elif response.status_code == 429:
+                # 429 表示 API 可达但额度限制（如余额不足），视为连通
+                logger.debug("API 返回 429，视为连通（可能是余额不足）")
+                return True
+            elif 400 <= response.status_code < 500:
+                logger.warning(
+                    "连通性测试失败: HTTP %s: %s",
+                    response.status_code,
+                    response.text[:200],
+                )
+                return False
+            else:
+                return True
 
         except Exception as e:
-            print(f"连通性测试失败: {e}")
+            logger.warning("连通性测试失败: %s", e)
             return False
 
+    # 不支持模型列表接口的厂商，健康检查只发送 HEAD 请求确认服务可达
+    HEAD_PROBE_VENDORS = {"spark", "qwen_official", "minimax"}
+
+    @classmethod
+    async def probe_health(
+        cls, vendor: str, api_base: str, api_key: str, timeout: float = 10.0
+    ) -> Optional[bool]:
+        """轻量健康检查：不调用模型，只请求模型列表或发送 HEAD
+
+        2xx 视为可用；认证失败（401/403）、5xx、超时和网络错误视为不可用；
+        其他状态码（如不支持模型列表接口或 HEAD 时的 404/405/501）
+        和无法探测的地址（如 WebSocket）无法判断，返回 None。
+        """
+        if not api_base or not api_base.startswith(("http://", "https://")):
+            return None
+
+        config = cls.VENDOR_CONFIGS.get(vendor, {})
+        headers = cls._build_headers(vendor, api_key or "", config)
+        api_base_clean = api_base.rstrip("/")
+        if vendor in cls.HEAD_PROBE_VENDORS:
+            method, url = "HEAD", api_base_clean
+        elif vendor == "ollama":
+            if api_base_clean.endswith("/v1"):
+                api_base_clean = api_base_clean[:-3]
+            method, url = "GET", f"{api_base_clean}/api/tags"
+        else:
+            # 与 _fetch_openai_models 一致：只填了域名时补上默认地址的版本路径
+            default_base = config.get("api_base", "")
+            if default_base.endswith("/v1") and not urlparse(api_base_clean).path:
+                api_base_clean = f"{api_base_clean}/v1"
+            method, url = "GET", f"{api_base_clean}/models"
+
+        try:
+            client = HttpClientPool.get_client(url)
+            response = await client.request(
+                method, url, headers=headers, timeout=timeout
+            )
+        except Exception as e:
+            logger.warning("健康检查失败: %s %s: %s", vendor, url, e)
+            return False
+
+        status = response.status_code
+        if 200 <= status < 300:
+            return True
+        if status in (401, 403) or status >= 500:
+            return False
+        return None
+
     @classmethod
     async def fetch_available_models(
         cls, vendor: str, api_base: str, api_key: str
@@ -614,48 +747,46 @@ class GatewayCore:
 
             url = f"{api_base_clean}/models"
 
-            async with httpx.AsyncClient(
-                timeout=10.0, follow_redirects=False
-            ) as client:
-                response = await client.get(url, headers=headers)
-
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
-                    for model in data.get("data", []):
-                        model_id = model.get("id", "")
-                        # 过滤出对话模型
-                        if any(
-                            keyword in model_id.lower()
-                            for keyword in [
-                                "gpt",
-                                "claude",
-                                "qwen",
-                                "glm",
-                                "llama",
-                                "mistral",
-                                "gemini",
-                            ]
-                        ):
-                            models.append(
-                                {
-                                    "id": model_id,
-                                    "name": model_id,
-                                    "description": model.get("description", ""),
-                                }
-                            )
-
-                    return {
-                        "success": True,
-                        "message": f"成功获取 {len(models)} 个模型",
-                        "models": models,
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"API返回错误: {response.status_code}",
-                        "models": [],
-                    }
+            client = HttpClientPool.get_client(url)
+            response = await client.get(url, headers=headers, timeout=10.0)
+
+            if response.status_code == 200:
+                data = response.json()
+                models = []
+                for model in data.get("data", []):
+                    model_id = model.get("id", "")
+                    # 过滤出对话模型
+                    if any(
+                        keyword in model_id.lower()
+                        for keyword in [
+                            "gpt",
+                            "claude",
+                            "qwen",
+                            "glm",
+                            "llama",
+                            "mistral",
+                            "gemini",
+                        ]
+                    ):
+                        models.append(
+                            {
+                                "id": model_id,
+                                "name": model_id,
+                                "description": model.get("description", ""),
+                            }
+                        )
+
+                return {
+                    "success": True,
+                    "message": f"成功获取 {len(models)} 个模型",
+                    "models": models,
+                }
+            else:
+                return {
+                    "success": False,
+                    "message": f"API返回错误: {response.status_code}",
+                    "models": [],
+                }
 
         except Exception as e:
             return {"success": False, "message": f"请求失败: {str(e)}", "models": []}
@@ -667,36 +798,34 @@ class GatewayCore:
             api_base_clean = api_base.rstrip("/")
             url = f"{api_base_clean}/v1beta/models?key={api_key}"
 
-            async with httpx.AsyncClient(
-                timeout=10.0, follow_redirects=False
-            ) as client:
-                response = await client.get(url)
-
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
-                    for model in data.get("models", []):
-                        model_name = model.get("name", "").replace("models/", "")
-                        if "gemini" in model_name.lower():
-                            models.append(
-                                {
-                                    "id": model_name,
-                                    "name": model_name,
-                                    "description": model.get("description", ""),
-                                }
-                            )
-
-                    return {
-                        "success": True,
-                        "message": f"成功获取 {len(models)} 个模型",
-                        "models": models,
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"API返回错误: {response.status_code}",
-                        "models": [],
-                    }
+            client = HttpClientPool.get_client(url)
+            response = await client.get(url, timeout=10.0)
+
+            if response.status_code == 200:
+                data = response.json()
+                models = []
+                for model in data.get("models", []):
+                    model_name = model.get("name", "").replace("models/", "")
+                    if "gemini" in model_name.lower():
+                        models.append(
+                            {
+                                "id": model_name,
+                                "name": model_name,
+                                "description": model.get("description", ""),
+                            }
+                        )
+
+                return {
+                    "success": True,
+                    "message": f"成功获取 {len(models)} 个模型",
+                    "models": models,
+                }
+            else:
+                return {
+                    "success": False,
+                    "message": f"API返回错误: {response.status_code}",
+                    "models": [],
+                }
 
         except Exception as e:
             return {"success": False, "message": f"请求失败: {str(e)}", "models": []}
@@ -730,37 +859,35 @@ class GatewayCore:
             # 构建 Ollama tags API URL
             url = f"http://{host}/api/tags"
 
-            print(f"[DEBUG] 获取 Ollama 模型列表: {url}")
-
-            async with httpx.AsyncClient(
-                timeout=10.0, follow_redirects=False
-            ) as client:
-                response = await client.get(url)
-
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
-                    for model in data.get("models", []):
-                        model_name = model.get("name", "")
-                        models.append(
-                            {
-                                "id": model_name,
-                                "name": model_name,
-                                "description": f"Size: {model.get('size', 'unknown')}",
-                            }
-                        )
+            logger.debug("获取 Ollama 模型列表: %s", url)
+
+            client = HttpClientPool.get_client(url)
+            response = await client.get(url, timeout=10.0)
+
+            if response.status_code == 200:
+                data = response.json()
+                models = []
+                for model in data.get("models", []):
+                    model_name = model.get("name", "")
+                    models.append(
+                        {
+                            "id": model_name,
+                            "name": model_name,
+                            "description": f"Size: {model.get('size', 'unknown')}",
+                        }
+                    )
 
-                    return {
-                        "success": True,
-                        "message": f"成功获取 {len(models)} 个本地模型",
-                        "models": models,
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"Ollama API返回错误: {response.status_code}",
-                        "models": [],
-                    }
+                return {
+                    "success": True,
+                    "message": f"成功获取 {len(models)} 个本地模型",
+                    "models": models,
+                }
+            else:
+                return {
+                    "success": False,
+                    "message": f"Ollama API返回错误: {response.status_code}",
+                    "models": [],
+                }
 
         except Exception as e:
             return {"success": False, "message": f"请求失败: {str(e)}", "models": []}
@@ -905,77 +1032,250 @@ class GatewayCore:
 
     @classmethod
     async def sync_request(
-        cls, vendor: str, api_base: str, api_key: str, request_data: Dict[str, Any]
+        cls,
+        vendor: str,
+        api_base: str,
+        api_key: str,
+        request_data: Dict[str, Any],
+        on_response: Optional[Callable[[httpx.Response], None]] = None,
     ) -> Dict[str, Any]:
-        """同步请求转发"""
-        config = cls.VENDOR_CONFIGS.get(vendor, {})
-        headers = cls._build_headers(vendor, api_key, config)
+        """同步请求转发，on_response 在收到上游响应（含错误响应）时回调"""
+        adapter = cls.get_adapter(vendor, api_base, api_key)
 
         # 参数映射
-        mapped_request = cls._map_params(vendor, request_data)
-
-        # 构建 URL，避免路径重复
-        api_base_clean = api_base.rstrip("/")
-        api_path = config.get("api_path", "/v1/chat/completions")
-
-        # 检查 api_base 是否已经包含 api_path 的部分路径
-        # 例如 api_base="https://example.com/v1" 且 api_path="/v1/chat/completions"
-        url = api_base_clean
-        if api_path.startswith("/v1") and api_base_clean.endswith("/v1"):
-            # 去掉重复的 /v1
-            url = f"{api_base_clean}{api_path[3:]}"
-        else:
-            url = f"{api_base_clean}{api_path}"
+        mapped_request = adapter.build_request(request_data)
 
-        async with httpx.AsyncClient(timeout=120.0, follow_redirects=False) as client:
-            response = await client.post(url, json=mapped_request, headers=headers)
+        client = HttpClientPool.get_client(adapter.url)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await client.post(
+                adapter.url, json=mapped_request, headers=adapter.headers, timeout=120.0
+            )
+            outcome = Metrics.outcome(response.status_code)
+        except asyncio.CancelledError:
+            # 对冲请求中落后的一方被取消
+            outcome = "cancelled"
+            raise
+        finally:
+            Metrics.observe_upstream(
+                vendor,
+                request_data.get("model"),
+                outcome,
+                time.perf_counter() - started,
+            )
+        if on_response:
+            on_response(response)
 
-            if response.status_code != 200:
-                raise Exception(
-                    f"API请求失败: {response.status_code} - {response.text}"
-                )
+        if response.status_code != 200:
+            raise UpstreamError(
+                response.status_code,
+                f"API请求失败: {response.status_code} - {response.text}",
+            )
 
-            response_data = response.json()
+        response_data = response.json()
 
-            # 响应标准化为OpenAI格式
-            return cls._standardize_response(vendor, response_data)
+        # 响应标准化为OpenAI格式
+        return adapter.parse_response(response_data)
 
     @classmethod
     async def stream_request(
-        cls, vendor: str, api_base: str, api_key: str, request_data: Dict[str, Any]
-    ) -> AsyncGenerator[str, None]:
-        """流式请求转发"""
-        config = cls.VENDOR_CONFIGS.get(vendor, {})
-        headers = cls._build_headers(vendor, api_key, config)
+        cls,
+        vendor: str,
+        api_base: str,
+        api_key: str,
+        request_data: Dict[str, Any],
+        on_response: Optional[Callable[[httpx.Response], None]] = None,
+        usage: Optional[StreamUsage] = None,
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """流式请求转发，on_response 在收到上游响应头时回调
+
+        传入 usage 时逐个事件统计用量：支持的上游请求 stream_options.include_usage，
+        网关代为请求时不把只含 usage 的 chunk 转发给客户端。
+        """
+        adapter = cls.get_adapter(vendor, api_base, api_key)
 
         # 参数映射
-        mapped_request = cls._map_params(vendor, request_data)
-
-        # 构建 URL，避免路径重复
-        api_base_clean = api_base.rstrip("/")
-        api_path = config.get("api_path", "/v1/chat/completions")
-
-        # 检查 api_base 是否已经包含 api_path 的部分路径
-        if api_path.startswith("/v1") and api_base_clean.endswith("/v1"):
-            # 去掉重复的 /v1
-            url = f"{api_base_clean}{api_path[3:]}"
-        else:
-            url = f"{api_base_clean}{api_path}"
+        mapped_request = adapter.build_request(request_data)
+        if usage is not None and adapter.stream_usage:
+            stream_options = mapped_request.get("stream_options") or {}
+            if not stream_options.get("include_usage"):
+                usage.strip_usage_chunk = True
+                mapped_request = {
+                    **mapped_request,
+                    "stream_options": {**stream_options, "include_usage": True},
+                }
 
-        async with httpx.AsyncClient(timeout=300.0, follow_redirects=False) as client:
+        client = HttpClientPool.get_client(adapter.url)
+        labels = (vendor, request_data.get("model"))
+        started = time.perf_counter()
+        first_chunk = True
+        outcome = "error"
+        try:
             async with client.stream(
-                "POST", url, json=mapped_request, headers=headers
+                "POST",
+                adapter.url,
+                json=mapped_request,
+                headers=adapter.headers,
+                timeout=300.0,
             ) as response:
+                if on_response:
+                    on_response(response)
                 if response.status_code != 200:
-                    yield f"data: {json.dumps({'error': '请求失败'})}\n\n"
-                    return
+                    outcome = Metrics.outcome(response.status_code)
+                    body = await response.aread()
+                    raise UpstreamError(
+                        response.status_code,
+                        f"API请求失败: {response.status_code} - "
+                        f"{body.decode('utf-8', errors='replace')}",
+                    )
 
-                async for chunk in response.aiter_lines():
+                if adapter.stream_passthrough:
+                    # OpenAI 兼容上游：直接转发字节流，不做 JSON 重建
+                    chunks = response.aiter_bytes()
+                else:
+                    chunks = cls._standardize_lines(adapter, response.aiter_lines())
+
+                # 客户端断开或切换模型时流被提前关闭，计为取消
+                outcome = "cancelled"
+                async for chunk in chunks:
+                    if first_chunk:
+                        first_chunk = False
+                        Metrics.upstream_ttft.observe(
+                            time.perf_counter() - started, labels
+                        )
+                    if usage is not None:
+                        chunk = usage.feed(chunk)
                     if chunk:
-                        # 转换为OpenAI SSE格式
-                        standardized = cls._standardize_stream_chunk(vendor, chunk)
-                        if standardized:
-                            yield standardized
+                        yield chunk
+                if usage is not None:
+                    tail = usage.flush()
+                    if tail:
+                        yield tail
+                outcome = "success"
+        except UpstreamError:
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            Metrics.observe_upstream(*labels, outcome, time.perf_counter() - started)
+
+    @classmethod
+    async def _standardize_lines(
+        cls, adapter: VendorAdapter, lines: AsyncGenerator[str, None]
+    ) -> AsyncGenerator[str, None]:
+        async for line in lines:
+            if line:
+                # 转换为OpenAI SSE格式
+                standardized = adapter.parse_stream_chunk(line)
+                if standardized:
+                    yield standardized
+
+    @classmethod
+    async def open_stream(
+        cls,
+        vendor: str,
+        api_base: str,
+        api_key: str,
+        request_data: Dict[str, Any],
+        ttft_budget: float = None,
+        on_response: Optional[Callable[[httpx.Response], None]] = None,
+        usage: Optional[StreamUsage] = None,
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """打开流式请求，等到首个内容 chunk 后再返回
+
+        上游报错、返回错误事件、在内容前结束或超过 ttft_budget 秒未出内容时抛出异常，
+        此时尚未向客户端发送任何字节，调用方可以切换其他模型。
+        返回的生成器先重放已读取的 chunk，再继续转发剩余流。
+        """
+        stream = cls.stream_request(
+            vendor, api_base, api_key, request_data, on_response, usage
+        )
+        try:
+            if ttft_budget:
+                try:
+                    head = await asyncio.wait_for(
+                        cls._read_until_content(stream), ttft_budget
+                    )
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"首个 token 超时 ({ttft_budget}s)")
+            else:
+                head = await cls._read_until_content(stream)
+        except BaseException:
+            await stream.aclose()
+            raise
+
+        return cls._replay_stream(head, stream)
+
+    @classmethod
+    async def _read_until_content(
+        cls, stream: AsyncGenerator[Union[str, bytes], None]
+    ) -> List[Union[str, bytes]]:
+        """读取流直到出现首个内容事件，返回已读取的原始 chunk"""
+        head = []
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        buffer = ""
+
+        async for chunk in stream:
+            head.append(chunk)
+            text = decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            buffer += text.replace("\r\n", "\n")
+
+            # 只检查完整的 SSE 事件，透传字节流可能在事件中间断开
+            *events, buffer = buffer.split("\n\n")
+            for event in events:
+                if cls._sse_event_has_content(event):
+                    return head
+
+        raise Exception("上游流在返回内容前结束")
+
+    @classmethod
+    def _sse_event_has_content(cls, event: str) -> bool:
+        """判断一个 SSE 事件是否包含内容，错误事件或提前结束时抛出异常"""
+        for line in event.split("\n"):
+            if not line.startswith("data:"):
+                continue
+
+            data = line[5:].strip()
+            if data == "[DONE]":
+                raise Exception("上游流在返回内容前结束")
+
+            try:
+                data_obj = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(data_obj, dict):
+                continue
+
+            if data_obj.get("error"):
+                raise Exception(f"上游返回错误: {data_obj['error']}")
+
+            for choice in data_obj.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if (
+                    delta.get("content")
+                    or delta.get("reasoning_content")
+                    or delta.get("tool_calls")
+                ):
+                    return True
+
+        return False
+
+    @classmethod
+    async def _replay_stream(
+        cls,
+        head: List[Union[str, bytes]],
+        stream: AsyncGenerator[Union[str, bytes], None],
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """先输出已缓冲的 chunk，再转发剩余流"""
+        try:
+            for chunk in head:
+                yield chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
 
     @classmethod
     def _build_headers(cls, vendor: str, api_key: str, config: Dict) -> Dict:
@@ -1048,25 +1348,8 @@ class GatewayCore:
     @classmethod
     def _standardize_response(cls, vendor: str, response_data: Dict) -> Dict:
         """响应标准化 - 将厂商响应转换为OpenAI格式"""
-        # 根据厂商使用特定的解析器
-        config = cls.VENDOR_CONFIGS.get(vendor, {})
-
-        # 如果是 OpenAI 兼容模式，直接返回原始响应
-        if config.get("openai_compatible"):
-            return response_data
-
-        if vendor == "gemini":
-            return cls._parse_gemini_response(response_data)
-        elif vendor == "claude":
-            return cls._parse_claude_response(response_data)
-        elif vendor == "qwen":
-            return cls._parse_qwen_response(response_data)
-        elif vendor == "qwen_official":
-            return cls._parse_qwen_official_response(response_data)
-        elif vendor == "spark":
-            return cls._parse_spark_response(response_data)
-        else:
-            return cls._parse_openai_compatible_response(response_data)
+        # 根据厂商使用注册的解析器
+        return VendorAdapter.get_handlers(vendor)["response"](response_data)
 
     @classmethod
     def _parse_openai_compatible_response(cls, response_data: Dict) -> Dict:
@@ -1346,6 +1629,11 @@ class GatewayCore:
     @classmethod
     def _standardize_stream_chunk(cls, vendor: str, chunk: str) -> str:
         """流式响应块标准化"""
+        return VendorAdapter.get_handlers(vendor)["stream"](chunk)
+
+    @classmethod
+    def _parse_openai_stream_chunk(cls, chunk: str) -> str:
+        """解析 OpenAI 兼容格式的流式响应块"""
         if not chunk.startswith("data:"):
             return None
 
@@ -1365,8 +1653,52 @@ class GatewayCore:
                 "model": data_obj.get("model", "unknown"),
                 "choices": data_obj.get("choices", []),
             }
+            if data_obj.get("usage"):
+                standardized["usage"] = data_obj["usage"]
 
             return f"data: {json.dumps(standardized)}\n\n"
 
         except json.JSONDecodeError:
             return None
+
+
+# ==================== 注册内置厂商适配器 ====================
+VendorAdapter.set_default(
+    request_builder=GatewayCore._build_base_request,
+    response_parser=GatewayCore._parse_openai_compatible_response,
+    stream_parser=GatewayCore._parse_openai_stream_chunk,
+)
+VendorAdapter.register(
+    "gemini",
+    request_builder=GatewayCore._build_gemini_request,
+    response_parser=GatewayCore._parse_gemini_response,
+)
+VendorAdapter.register(
+    "claude",
+    request_builder=GatewayCore._build_claude_request,
+    response_parser=GatewayCore._parse_claude_response,
+)
+VendorAdapter.register(
+    "qwen",
+    request_builder=GatewayCore._build_qwen_request,
+    response_parser=GatewayCore._parse_qwen_response,
+)
+VendorAdapter.register(
+    "qwen_official",
+    request_builder=GatewayCore._build_qwen_official_request,
+    response_parser=GatewayCore._parse_qwen_official_response,
+)
+VendorAdapter.register(
+    "spark",
+    request_builder=GatewayCore._build_spark_request,
+    response_parser=GatewayCore._parse_spark_response,
+)
+
+# OpenAI 兼容模式：请求与响应原样透传
+for _vendor, _config in GatewayCore.VENDOR_CONFIGS.items():
+    if _config.get("openai_compatible"):
+        VendorAdapter.register(
+            _vendor,
+            request_builder=lambda request_data: request_data,
+            response_parser=lambda response_data: response_data,
+        )
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+
+from config.database import SessionLocal, run_in_db
+from models.model_config import ModelConfig
+from models.operation_log import OperationLog
+from services.credential_cache import CredentialCache
+from services.gateway_core import GatewayCore
+from services.log_writer import LogWriter
+from services.routing_table import RoutingTable
+
+logger = logging.getLogger(__name__)
+
+# (厂商, API 地址, API Key)，同一上游的多个模型只探测一次
+_Endpoint = Tuple[str, str, str]
+
+
+class HealthMonitor:
+    """后台健康检查 - 定时探测所有启用的模型并维护 connect_status
+
+    每轮按上游地址去重后并发探测，并发数受 CONCURRENCY 限制，
+    每个探测随机延迟（不超过 INTERVAL * JITTER）以错开请求。
+    探测使用各厂商最轻量的接口（模型列表或 HEAD），不消耗模型额度。
+    连续失败 FAILURE_THRESHOLD 次才标记为断开，一次成功即恢复；
+    只恢复由健康检查自己断开的模型，管理员未测试通过的模型不会被置为已连通。
+    connect_status 只在变化时批量写入，随后重建内存路由表。
+    """
+
+    ENABLED = os.getenv("HEALTH_CHECK_ENABLED", "true").lower() == "true"
+    INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "60"))
+    CONCURRENCY = int(os.getenv("HEALTH_CHECK_CONCURRENCY", "8"))
+    # 随机延迟占检查间隔的比例
+    JITTER = float(os.getenv("HEALTH_CHECK_JITTER", "0.2"))
+    TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "5"))
+    FAILURE_THRESHOLD = int(os.getenv("HEALTH_CHECK_FAILURE_THRESHOLD", "2"))
+
+    # model_id -> 连续探测失败次数
+    _failures: Dict[int, int] = {}
+    # 由健康检查断开的模型ID，进程启动后首轮从切换日志恢复
+    _disconnected: set = set()
+    _restored = False
+    _task: Optional[asyncio.Task] = None
+    _DOWN_REASON = "健康检查连续"
+    _stats = {"rounds": 0, "probes": 0, "failed_probes": 0, "status_changes": 0}
+
+    @classmethod
+    def _load_models(cls) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(
+                    ModelConfig.id,
+                    ModelConfig.vendor,
+                    ModelConfig.model_name,
+                    ModelConfig.api_base,
+                    ModelConfig.api_key,
+                    ModelConfig.connect_status,
+                ).where(ModelConfig.status == 1)
+            ).all()
+            if not cls._restored:
+                cls._disconnected.update(
+                    cls._restore_disconnected(
+                        db, [row.id for row in rows if row.connect_status == 0]
+                    )
+                )
+                cls._restored = True
+        finally:
+            db.close()
+        return [
+            {
+                "id": row.id,
+                "vendor": row.vendor,
+                "model_name": row.model_name,
+                "api_base": row.api_base,
+                "api_key": CredentialCache.get(row.id, row.api_key) or "",
+                "connect_status": row.connect_status,
+            }
+            for row in rows
+        ]
+
+    @classmethod
+    def _restore_disconnected(cls, db, model_ids: List[int]) -> List[int]:
+        """最近一条切换日志是健康检查断开的模型（进程重启前由健康检查断开）"""
+        if not model_ids:
+            return []
+        latest = (
+            select(func.max(OperationLog.id))
+            .where(OperationLog.log_type == 2, OperationLog.model_id.in_(model_ids))
+            .group_by(OperationLog.model_id)
+        )
+        rows = db.execute(
+            select(OperationLog.model_id, OperationLog.log_content).where(
+                OperationLog.id.in_(latest)
+            )
+        ).all()
+        restored = []
+        for row in rows:
+            try:
+                content = json.loads(row.log_content or "{}")
+            except ValueError:
+                continue
+            if isinstance(content, dict) and str(content.get("reason", "")).startswith(
+                cls._DOWN_REASON
+            ):
+                restored.append(row.model_id)
+        return restored
+
+    @classmethod
+    async def _probe(
+        cls, endpoint: _Endpoint, semaphore: asyncio.Semaphore, max_delay: float
+    ) -> Optional[bool]:
+        if max_delay > 0:
+            await asyncio.sleep(random.uniform(0, max_delay))
+        async with semaphore:
+            vendor, api_base, api_key = endpoint
+            healthy = await GatewayCore.probe_health(
+                vendor, api_base, api_key, cls.TIMEOUT
+            )
+        if healthy is not None:
+            cls._stats["probes"] += 1
+            cls._stats["failed_probes"] += not healthy
+        return healthy
+
+    @classmethod
+    async def check_all(cls, max_delay: Optional[float] = None):
+        """探测一轮所有启用的模型"""
+        if max_delay is None:
+            max_delay = cls.INTERVAL * cls.JITTER
+        models = await run_in_db(cls._load_models)
+
+        endpoints: Dict[_Endpoint, List[Dict[str, Any]]] = {}
+        for model in models:
+            key = (model["vendor"], model["api_base"], model["api_key"])
+            endpoints.setdefault(key, []).append(model)
+
+        semaphore = asyncio.Semaphore(max(1, cls.CONCURRENCY))
+        results = await asyncio.gather(
+            *(cls._probe(endpoint, semaphore, max_delay) for endpoint in endpoints)
+        )
+
+        changes = []
+        for group, healthy in zip(endpoints.values(), results):
+            for model in group:
+                if model["connect_status"] == 1:
+                    # 已由管理员测试恢复
+                    cls._disconnected.discard(model["id"])
+                status = cls._next_status(model, healthy)
+                if status is not None and status != model["connect_status"]:
+                    changes.append((model, status))
+
+        # 清理已删除或停用模型的失败计数
+        active = {model["id"] for model in models}
+        for model_id in [k for k in cls._failures if k not in active]:
+            del cls._failures[model_id]
+        cls._stats["rounds"] += 1
+
+        if not changes:
+            return
+        await run_in_db(cls._save, changes)
+        cls._stats["status_changes"] += len(changes)
+        for model, status in changes:
+            if status:
+                cls._disconnected.discard(model["id"])
+            else:
+                cls._disconnected.add(model["id"])
+            await cls._log_transition(model, status)
+
+    @classmethod
+    def _next_status(cls, model: Dict[str, Any], healthy: Optional[bool]):
+        """根据探测结果计算新的连通状态，无法判断时返回 None"""
+        if healthy is None:
+            return None
+        if healthy:
+            cls._failures.pop(model["id"], None)
+            return 1 if model["id"] in cls._disconnected else None
+        failures = cls._failures[model["id"]] = cls._failures.get(model["id"], 0) + 1
+        if failures >= cls.FAILURE_THRESHOLD:
+            return 0
+        return None
+
+    @classmethod
+    def _save(cls, changes: List[Tuple[Dict[str, Any], int]]):
+        """批量写入变化的连通状态并重建路由表"""
+        db = SessionLocal()
+        try:
+            model_table = ModelConfig.__table__
+            db.execute(
+                update(model_table)
+                .where(model_table.c.id == bindparam("mid"))
+                .values(connect_status=bindparam("new_status")),
+                [
+                    {"mid": model["id"], "new_status": status}
+                    for model, status in changes
+                ],
+            )
+            db.commit()
+            RoutingTable.rebuild(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @classmethod
+    async def _log_transition(cls, model: Dict[str, Any], status: int):
+        if status:
+            reason = "健康检查恢复，加入路由"
+        else:
+            reason = f"{cls._DOWN_REASON} {cls.FAILURE_THRESHOLD} 次失败，移出路由"
+        logger.info(
+            "连通状态变更: %s - %s: %s", model["vendor"], model["model_name"], reason
+        )
+        await LogWriter.write(
+            log_type=2,
+            model_id=model["id"],
+            log_content=json.dumps(
+                {
+                    "from_model": None if status else model["model_name"],
+                    "to_model": model["model_name"] if status else None,
+                    "reason": reason,
+                }
+            ),
+            status=status,
+        )
+
+    @classmethod
+    async def _check_loop(cls):
+        while True:
+            await asyncio.sleep(cls.INTERVAL)
+            try:
+                await cls.check_all()
+            except Exception as e:
+                logger.warning("健康检查任务异常: %s", e)
+
+    @classmethod
+    async def start(cls):
+        """启动定时健康检查（lifespan 启动时调用）"""
+        if cls.ENABLED and cls.INTERVAL > 0:
+            cls._task = asyncio.create_task(cls._check_loop())
+
+    @classmethod
+    async def stop(cls):
+        """停止健康检查任务"""
+        task = cls._task
+        cls._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取健康检查统计"""
+        return {**cls._stats, "failing": len(cls._failures)}
@@ -0,0 +1,145 @@
+import asyncio
+import bisect
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class LatencyHistogram:
+    """延迟直方图 - 对数分桶，计数累计到窗口大小后整体减半（指数衰减旧数据）"""
+
+    # 10ms ~ 约 150s，每档 x1.25
+    BUCKETS = [0.01 * 1.25**i for i in range(44)]
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.total += 1
+        if self.total >= self.window:
+            self.counts = [c // 2 for c in self.counts]
+            self.total = sum(self.counts)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """返回第 q 分位所在桶的上界，无数据时返回 None"""
+        if self.total == 0:
+            return None
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.BUCKETS[min(i, len(self.BUCKETS) - 1)]
+        return self.BUCKETS[-1]
+
+
+class HedgePolicy:
+    """对冲请求 - auto 模式非流式请求的尾延迟优化
+
+    主模型在按其历史延迟分位数计算的时间内未返回时，向下一个优先级模型发出相同请求，
+    取先成功的结果并取消另一个。额外请求量受令牌桶限制：每个可对冲请求存入
+    BUDGET_RATIO 个令牌（上限 BUDGET_BURST），每次对冲消耗一个。
+    """
+
+    # 默认关闭，可通过请求头 X-Hedge 单独开启/关闭
+    ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    # 样本不足时使用的对冲延迟 (秒)
+    DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+    MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+    MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    # 对冲请求占可对冲请求的最大比例
+    BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+    BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "10"))
+
+    _histograms: Dict[int, LatencyHistogram] = {}
+    _tokens = BUDGET_BURST
+    _stats = {"requests": 0, "hedged": 0, "backup_wins": 0, "throttled": 0}
+
+    @classmethod
+    def is_enabled(cls, header: Optional[str] = None) -> bool:
+        """请求头优先，否则使用全局开关"""
+        if header is not None:
+            return header.strip().lower() in ("1", "true", "on")
+        return cls.ENABLED
+
+    @classmethod
+    def observe(cls, model_id: int, seconds: float):
+        """记录一次成功请求的延迟"""
+        histogram = cls._histograms.get(model_id)
+        if histogram is None:
+            histogram = cls._histograms[model_id] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    @classmethod
+    def get_delay(cls, model_id: int) -> float:
+        """主模型的对冲延迟：历史延迟的 PERCENTILE 分位"""
+        histogram = cls._histograms.get(model_id)
+        if histogram is None or histogram.total < cls.MIN_SAMPLES:
+            return cls.DEFAULT_DELAY
+        return max(cls.MIN_DELAY, histogram.percentile(cls.PERCENTILE))
+
+    @classmethod
+    def _try_acquire(cls) -> bool:
+        if cls._tokens >= 1:
+            cls._tokens -= 1
+            return True
+        return False
+
+    @classmethod
+    async def run(
+        cls,
+        primary: Any,
+        backup: Any,
+        call: Callable[[Any], Awaitable[Dict]],
+    ) -> Tuple[Optional[Any], Optional[Dict], List[Tuple[Any, Exception]]]:
+        """执行可对冲请求
+
+        返回 (成功的模型, 响应, [(失败的模型, 异常)])；全部失败时成功模型为 None。
+        未发出对冲的备用模型不会出现在结果中，调用方可按原顺序继续尝试。
+        """
+        cls._stats["requests"] += 1
+        cls._tokens = min(cls.BUDGET_BURST, cls._tokens + cls.BUDGET_RATIO)
+
+        tasks = {asyncio.create_task(call(primary)): primary}
+        pending = set(tasks)
+        failures = []
+        try:
+            done, pending = await asyncio.wait(
+                pending, timeout=cls.get_delay(primary.id)
+            )
+            if pending:
+                if cls._try_acquire():
+                    cls._stats["hedged"] += 1
+                    task = asyncio.create_task(call(backup))
+                    tasks[task] = backup
+                    pending.add(task)
+                else:
+                    cls._stats["throttled"] += 1
+
+            while True:
+                # 同时完成时优先取成功的结果
+                for task in sorted(done, key=lambda t: t.exception() is not None):
+                    model = tasks[task]
+                    if task.exception() is None:
+                        if model is backup:
+                            cls._stats["backup_wins"] += 1
+                        return model, task.result(), failures
+                    failures.append((model, task.exception()))
+
+                if not pending:
+                    return None, None, failures
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            # 取消仍在进行的请求（落败方或客户端断开）
+            for task in pending:
+                task.cancel()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取对冲统计"""
+        return {**cls._stats, "tokens": round(cls._tokens, 2)}
@@ -0,0 +1,130 @@
+import logging
+import os
+import httpcore
+import httpx
+from typing import Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _major_minor(version: str) -> Tuple[int, int]:
+    major, minor = (version.split(".") + ["0"])[:2]
+    return int(major), int(minor)
+
+
+# connection_stats 读取 httpx 私有的 _transport._pool（httpcore 连接池），
+# 只在验证过的版本上读取：httpx 0.2x + httpcore 1.x
+_POOL_STATS_SUPPORTED = (0, 20) <= _major_minor(httpx.__version__) < (1, 0) and (
+    _major_minor(httpcore.__version__)[0] == 1
+)
+
+
+class HttpClientPool:
+    """上游连接池 - 按上游主机复用长连接 httpx.AsyncClient
+
+    每个上游主机（scheme + host + port）对应一个常驻客户端，
+    避免每次转发都重新进行 TCP + TLS 握手。
+    在 FastAPI lifespan 中打开，关闭服务时统一释放。
+    """
+
+    # 连接池参数（可通过环境变量调整）
+    MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+    MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+    KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+    HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+    DEFAULT_TIMEOUT = 120.0
+
+    _clients: Dict[str, httpx.AsyncClient] = {}
+    _opened = False
+    _pool_stats_warned = False
+
+    @classmethod
+    def open(cls):
+        """初始化连接池（lifespan 启动时调用）"""
+        cls._clients = {}
+        cls._opened = True
+
+        if cls.HTTP2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，UPSTREAM_HTTP2 已忽略，回退到 HTTP/1.1")
+                cls.HTTP2 = False
+
+    @classmethod
+    async def close(cls):
+        """关闭所有上游客户端（lifespan 结束时调用）"""
+        clients = list(cls._clients.values())
+        cls._clients = {}
+        cls._opened = False
+
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("关闭上游连接失败: %s", e)
+
+    @classmethod
+    def _host_key(cls, url: str) -> str:
+        """提取上游主机标识：scheme://host:port"""
+        parsed = httpx.URL(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        return f"{parsed.scheme}://{parsed.host}:{port}"
+
+    @classmethod
+    def get_client(cls, url: str) -> httpx.AsyncClient:
+        """获取目标 URL 所属主机的共享客户端，不存在时创建"""
+        key = cls._host_key(url)
+        client = cls._clients.get(key)
+
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=cls.DEFAULT_TIMEOUT,
+                follow_redirects=False,
+                http2=cls.HTTP2,
+                limits=httpx.Limits(
+                    max_connections=cls.MAX_CONNECTIONS,
+                    max_keepalive_connections=cls.MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=cls.KEEPALIVE_EXPIRY,
+                ),
+            )
+            cls._clients[key] = client
+
+        return client
+
+    @classmethod
+    def connection_stats(cls) -> Dict[str, Tuple[int, int]]:
+        """各上游主机的 (活跃连接数, 空闲连接数)
+
+        httpx 未公开连接池状态，只在验证过的 httpx/httpcore 版本上读取内部连接池，
+        其他版本或结构不符时返回空结果并告警一次。
+        """
+        if not _POOL_STATS_SUPPORTED:
+            cls._warn_pool_stats(
+                f"httpx {httpx.__version__} / httpcore {httpcore.__version__}"
+            )
+            return {}
+        stats = {}
+        for key, client in list(cls._clients.items()):
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = getattr(pool, "connections", None)
+            if connections is None:
+                cls._warn_pool_stats(type(getattr(client, "_transport", None)).__name__)
+                continue
+            idle = sum(1 for c in connections if c.is_idle())
+            stats[key] = (len(connections) - idle, idle)
+        return stats
+
+    @classmethod
+    def _warn_pool_stats(cls, detail: str):
+        if not cls._pool_stats_warned:
+            cls._pool_stats_warned = True
+            logger.warning("无法读取上游连接池状态，连接数指标已停用: %s", detail)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取连接池统计"""
+        return {
+            "hosts": len(cls._clients),
+            "opened": cls._opened,
+        }
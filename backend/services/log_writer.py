@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import insert
+
+from config.database import SessionLocal, run_in_db
+from models.operation_log import OperationLog
+from services.metrics import Metrics
+from services.stats_rollup import StatsRollup
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriter:
+    """异步日志写入服务 - OperationLog 批量落库
+
+    请求路径只把日志行放入有界队列，由后台任务按数量或时间批量插入，
+    避免每次请求都在事件循环上同步提交 SQLite 事务。
+    """
+
+    QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+    FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+    # 队列满时的策略: drop=丢弃新日志, block=等待队列空位
+    OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "drop").lower()
+
+    _queue: Optional[asyncio.Queue] = None
+    _task: Optional[asyncio.Task] = None
+    _stats = {"queued": 0, "flushed": 0, "dropped": 0, "failed": 0}
+
+    @classmethod
+    async def start(cls):
+        """启动后台写入任务（lifespan 启动时调用）"""
+        cls._queue = asyncio.Queue(maxsize=cls.QUEUE_SIZE)
+        cls._task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        """停止写入任务并刷出队列中剩余日志（lifespan 结束时调用）"""
+        queue, task = cls._queue, cls._task
+        if queue is None or task is None:
+            return
+
+        # 放入结束标记，后台任务写完剩余日志后退出
+        await queue.put(None)
+        await task
+        cls._queue = None
+        cls._task = None
+
+    @classmethod
+    async def write(
+        cls,
+        log_type: int,
+        model_id: Optional[int],
+        log_content: str,
+        status: int = 1,
+        usage: Optional[Dict[str, Any]] = None,
+    ):
+        """提交一条日志，usage 计入汇总表的 token 数"""
+        row = {
+            "log_type": log_type,
+            "model_id": model_id,
+            "log_content": log_content,
+            "status": status,
+            "create_time": datetime.now(),
+            "usage": usage,
+        }
+
+        queue = cls._queue
+        if queue is None:
+            # 未启动后台任务（如脚本或测试环境），直接同步写入
+            cls._flush([row])
+            return
+
+        if cls.OVERFLOW_POLICY == "block":
+            await queue.put(row)
+        else:
+            try:
+                queue.put_nowait(row)
+            except asyncio.QueueFull:
+                cls._stats["dropped"] += 1
+                return
+
+        cls._stats["queued"] += 1
+
+    @classmethod
+    async def _run(cls):
+        """后台任务：攒批后写入"""
+        loop = asyncio.get_running_loop()
+        queue = cls._queue
+        stopping = False
+
+        while not stopping:
+            row = await queue.get()
+            if row is None:
+                break
+
+            batch = [row]
+            deadline = loop.time() + cls.FLUSH_INTERVAL
+            while len(batch) < cls.BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            started = time.perf_counter()
+            await run_in_db(cls._flush, batch)
+            Metrics.db_flush_latency.observe(time.perf_counter() - started, ("log",))
+
+    @classmethod
+    def _flush(cls, batch: List[Dict[str, Any]]):
+        """批量插入日志，并在同一事务中累加小时汇总"""
+        counts = StatsRollup.aggregate(batch)
+        db = SessionLocal()
+        try:
+            db.execute(insert(OperationLog), batch)
+            StatsRollup.apply(db, counts)
+            db.commit()
+            cls._stats["flushed"] += len(batch)
+        except Exception as e:
+            db.rollback()
+            cls._stats["failed"] += len(batch)
+            logger.warning("日志批量写入失败: %s", e)
+        finally:
+            db.close()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        """获取写入统计"""
+        return {
+            **cls._stats,
+            "pending": cls._queue.qsize() if cls._queue else 0,
+        }
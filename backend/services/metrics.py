@@ -0,0 +1,268 @@
+import os
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 上游延迟分桶（秒），覆盖首 token 的几十毫秒到长输出的数分钟
+LATENCY_BUCKETS = (
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    20.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+# 数据库批量写入延迟分桶（秒）
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数，按标签值元组分组"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Tuple, Tuple, float]]:
+        for values, value in self.values.items():
+            yield self.name, self.labels, values, value
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+
+    kind = "gauge"
+
+    def set(self, labels: Tuple = (), value: float = 0):
+        self.values[labels] = value
+
+
+class Histogram:
+    """固定分桶直方图，写入时只累加所在分桶，导出时再计算累计值"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # 标签值 -> [各分桶计数..., +Inf 计数, 总和]
+        self.values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, labels: Tuple = ()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> Iterable[Tuple[str, Tuple, Tuple, float]]:
+        names = self.labels + ("le",)
+        for values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", names, values + (bound,), cumulative
+            cumulative += series[-2]
+            yield f"{self.name}_bucket", names, values + ("+Inf",), cumulative
+            yield f"{self.name}_count", self.labels, values, cumulative
+            yield f"{self.name}_sum", self.labels, values, series[-1]
+
+
+class Metrics:
+    """进程内指标 - 以 Prometheus 文本格式在 /metrics 导出
+
+    计数只在事件循环线程中更新（线程池中的数据库写入在返回事件循环后再记录），
+    写入路径是一次字典查找加一次累加，不加锁。
+    缓存命中、日志队列、连接池等已有统计在导出时读取，不在请求路径上重复计数。
+    """
+
+    ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+    requests = Counter(
+        "gateway_requests_total",
+        "Chat completion requests handled by the gateway",
+        ("outcome",),
+    )
+    request_latency = Histogram(
+        "gateway_request_duration_seconds",
+        "Gateway chat completion handling time (streams: until first byte)",
+    )
+    inflight = Gauge("gateway_inflight_requests", "Chat completion requests in flight")
+    upstream_requests = Counter(
+        "gateway_upstream_requests_total",
+        "Upstream model calls",
+        ("vendor", "model", "outcome"),
+    )
+    upstream_latency = Histogram(
+        "gateway_upstream_latency_seconds",
+        "Upstream call duration (streams: until the stream ends)",
+        ("vendor", "model"),
+    )
+    upstream_ttft = Histogram(
+        "gateway_upstream_ttft_seconds",
+        "Upstream time to first streamed chunk",
+        ("vendor", "model"),
+    )
+    tokens = Counter(
+        "gateway_tokens_total",
+        "Tokens consumed by upstream calls",
+        ("vendor", "model", "direction"),
+    )
+    db_flush_latency = Histogram(
+        "gateway_db_flush_seconds",
+        "Batched database write duration",
+        ("writer",),
+        DB_BUCKETS,
+    )
+
+    @classmethod
+    def outcome(cls, status_code: Optional[int]) -> str:
+        """上游响应状态码归类"""
+        if status_code is None:
+            return "error"
+        if status_code == 200:
+            return "success"
+        if status_code == 429:
+            return "rate_limited"
+        if status_code >= 500:
+            return "server_error"
+        return "client_error"
+
+    @classmethod
+    def observe_upstream(
+        cls, vendor: str, model: Optional[str], outcome: str, latency: float
+    ):
+        cls.upstream_requests.inc((vendor, model, outcome))
+        cls.upstream_latency.observe(latency, (vendor, model))
+
+    @classmethod
+    def record_tokens(
+        cls, vendor: str, model: Optional[str], usage: Optional[Dict[str, Any]]
+    ):
+        """累加一次上游调用的输入/输出 token 数"""
+        if not usage:
+            return
+        for direction, field in (("in", "prompt_tokens"), ("out", "completion_tokens")):
+            value = usage.get(field)
+            if isinstance(value, (int, float)) and value > 0:
+                cls.tokens.inc((vendor, model, direction), value)
+
+    @classmethod
+    def _collect(cls) -> List:
+        """导出时读取各服务已有的统计"""
+        # 延迟导入：这些服务（如 LogWriter）本身会记录指标
+        from services.http_client_pool import HttpClientPool
+        from services.log_writer import LogWriter
+        from services.response_cache import ResponseCache
+        from services.semantic_cache import SemanticCache
+        from services.token_estimator import TokenEstimator
+
+        cache_lookups = Counter(
+            "gateway_cache_lookups_total", "Cache lookups", ("cache", "result")
+        )
+        cache_ratio = Gauge("gateway_cache_hit_ratio", "Cache hit ratio", ("cache",))
+        for name, stats in (
+            ("response", ResponseCache.get_stats()),
+            ("semantic", SemanticCache.get_stats()),
+            ("token_estimator", TokenEstimator.get_stats()),
+        ):
+            hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+            cache_lookups.inc((name, "hit"), hits)
+            cache_lookups.inc((name, "miss"), misses)
+            cache_ratio.set((name,), hits / (hits + misses) if hits + misses else 0.0)
+
+        log_stats = LogWriter.get_stats()
+        log_rows = Counter(
+            "gateway_log_rows_total", "Operation log rows by result", ("result",)
+        )
+        for result in ("queued", "flushed", "dropped", "failed"):
+            log_rows.inc((result,), log_stats.get(result, 0))
+        log_pending = Gauge("gateway_log_queue_size", "Operation log rows waiting")
+        log_pending.set((), log_stats.get("pending", 0))
+
+        connections = Gauge(
+            "gateway_upstream_connections",
+            "Open upstream connections",
+            ("host", "state"),
+        )
+        for host, (active, idle) in HttpClientPool.connection_stats().items():
+            connections.set((host, "active"), active)
+            connections.set((host, "idle"), idle)
+
+        return [cache_lookups, cache_ratio, log_rows, log_pending, connections]
+
+    @classmethod
+    def render(cls) -> str:
+        """生成 Prometheus 文本格式"""
+        metrics = [
+            cls.requests,
+            cls.request_latency,
+            cls.inflight,
+            cls.upstream_requests,
+            cls.upstream_latency,
+            cls.upstream_ttft,
+            cls.tokens,
+            cls.db_flush_latency,
+            *cls._collect(),
+        ]
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, label_names, values, value in metric.samples():
+                labels = _format_labels(label_names, values)
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def reset(cls):
+        """清空所有计数（测试使用）"""
+        for metric in (
+            cls.requests,
+            cls.request_latency,
+            cls.inflight,
+            cls.upstream_requests,
+            cls.upstream_latency,
+            cls.upstream_ttft,
+            cls.tokens,
+            cls.db_flush_latency,
+        ):
+            metric.values.clear()
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import bindparam, case, select, update
+
+from config.database import SessionLocal, run_in_db
+from models.model_config import ModelConfig
+from models.quota_stat import QuotaStat
+from models.system_config import SystemConfig
+from services.log_writer import LogWriter
+from services.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# ModelConfig.quota_status 取值
+QUOTA_EXHAUSTED = 0
+QUOTA_LOW = 1
+QUOTA_SUFFICIENT = 2
+
+
+class QuotaTracker:
+    """实时额度统计 - 响应 usage 在内存中累加，定时批量写入 QuotaStat
+
+    请求路径只做内存累加，不写数据库；后台任务每 FLUSH_INTERVAL 秒
+    用一条批量 UPDATE 累加 used_quota 并重算 remain_quota / used_ratio，
+    随后重新读取各模型额度（包含其他进程写入的用量），
+    used_ratio 达到 switch_threshold 的模型移出 auto 模式轮换。
+    未配置 total_quota 的模型不参与判断。
+    """
+
+    FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "5"))
+    DEFAULT_SWITCH_THRESHOLD = 99.0
+    DEFAULT_ALERT_THRESHOLD = 80.0
+
+    # model_id -> 尚未写入的 token 数
+    _pending: Dict[int, float] = {}
+    # 额度达到切换阈值的模型
+    _exhausted: Set[int] = set()
+    # 上次写入后读取的剩余额度（仅配置了 total_quota 的模型）
+    _remaining: Dict[int, float] = {}
+    # 首次加载（启动时）不记录切换日志
+    _loaded = False
+    _task: Optional[asyncio.Task] = None
+    _stats = {"recorded": 0, "flushes": 0, "flushed_tokens": 0, "failed": 0}
+
+    @classmethod
+    def record(cls, model_id: int, usage: Optional[Dict[str, Any]]):
+        """累加一次上游调用的 token 用量（仅内存）"""
+        if not usage:
+            return
+        tokens = usage.get("total_tokens") or (
+            (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        )
+        if not isinstance(tokens, (int, float)) or tokens <= 0:
+            return
+        cls._pending[model_id] = cls._pending.get(model_id, 0) + tokens
+        cls._stats["recorded"] += 1
+
+    @classmethod
+    def allow(cls, model_id: int) -> bool:
+        """模型额度是否未达到切换阈值"""
+        return model_id not in cls._exhausted
+
+    @classmethod
+    def remaining(cls, model_id: int) -> Optional[float]:
+        """模型剩余额度（扣除尚未写入的用量），未配置总额度时返回 None"""
+        remaining = cls._remaining.get(model_id)
+        if remaining is None:
+            return None
+        return remaining - cls._pending.get(model_id, 0)
+
+    @classmethod
+    async def flush(cls):
+        """写入累计用量并刷新额度状态"""
+        pending, cls._pending = cls._pending, {}
+        started = time.perf_counter()
+        try:
+            changes = await run_in_db(cls._flush, pending)
+        except Exception as e:
+            # 写入失败时合并回待写入用量，下次重试
+            for model_id, tokens in pending.items():
+                cls._pending[model_id] = cls._pending.get(model_id, 0) + tokens
+            cls._stats["failed"] += 1
+            logger.warning("额度用量写入失败: %s", e)
+            return
+        Metrics.db_flush_latency.observe(time.perf_counter() - started, ("quota",))
+
+        for model_id, model_name, used_ratio, exhausted in changes:
+            await cls._log_transition(model_id, model_name, used_ratio, exhausted)
+
+    @classmethod
+    def _flush(cls, pending: Dict[int, float]) -> list:
+        """批量累加用量，重新读取额度并返回切换状态发生变化的模型"""
+        db = SessionLocal()
+        try:
+            if pending:
+                # Core 语句 + 参数列表，一次 executemany 完成所有模型的累加
+                quota = QuotaStat.__table__
+                used = quota.c.used_quota + bindparam("tokens")
+                db.execute(
+                    update(quota)
+                    .where(quota.c.model_id == bindparam("mid"))
+                    .values(
+                        used_quota=used,
+                        remain_quota=case(
+                            (quota.c.total_quota > used, quota.c.total_quota - used),
+                            else_=0,
+                        ),
+                        used_ratio=case(
+                            (quota.c.total_quota > 0, used * 100 / quota.c.total_quota),
+                            else_=0,
+                        ),
+                        update_time=datetime.now(),
+                    ),
+                    [{"mid": mid, "tokens": tokens} for mid, tokens in pending.items()],
+                )
+
+            switch_threshold = cls._get_threshold(
+                db, "switch_threshold", cls.DEFAULT_SWITCH_THRESHOLD
+            )
+            alert_threshold = cls._get_threshold(
+                db, "alert_threshold", cls.DEFAULT_ALERT_THRESHOLD
+            )
+            rows = db.execute(
+                select(
+                    ModelConfig.id,
+                    ModelConfig.model_name,
+                    ModelConfig.quota_status,
+                    QuotaStat.used_ratio,
+                    QuotaStat.total_quota,
+                    QuotaStat.used_quota,
+                )
+                .join(QuotaStat, QuotaStat.model_id == ModelConfig.id)
+                .where(QuotaStat.total_quota > 0)
+            ).all()
+
+            exhausted = set()
+            remaining = {}
+            changes = []
+            status_updates = []
+            for row in rows:
+                model_id, model_name, quota_status, used_ratio = row[:4]
+                used_ratio = used_ratio or 0
+                remaining[model_id] = max(0.0, row.total_quota - (row.used_quota or 0))
+                if used_ratio >= switch_threshold:
+                    status = QUOTA_EXHAUSTED
+                    exhausted.add(model_id)
+                elif used_ratio >= alert_threshold:
+                    status = QUOTA_LOW
+                else:
+                    status = QUOTA_SUFFICIENT
+                if status != quota_status:
+                    status_updates.append({"mid": model_id, "new_status": status})
+                if cls._loaded and (model_id in exhausted) != (
+                    model_id in cls._exhausted
+                ):
+                    changes.append(
+                        (model_id, model_name, used_ratio, model_id in exhausted)
+                    )
+
+            # 额度状态只在变化时写入
+            if status_updates:
+                model_table = ModelConfig.__table__
+                db.execute(
+                    update(model_table)
+                    .where(model_table.c.id == bindparam("mid"))
+                    .values(quota_status=bindparam("new_status")),
+                    status_updates,
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        cls._exhausted = exhausted
+        cls._remaining = remaining
+        cls._loaded = True
+        cls._stats["flushes"] += 1
+        cls._stats["flushed_tokens"] += sum(pending.values())
+        return changes
+
+    @classmethod
+    def _get_threshold(cls, db, key: str, default: float) -> float:
+        value = db.execute(
+            select(SystemConfig.config_value).where(SystemConfig.config_key == key)
+        ).scalar()
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    async def _log_transition(
+        cls, model_id: int, model_name: str, used_ratio: float, exhausted: bool
+    ):
+        if exhausted:
+            reason = f"额度消耗 {used_ratio:.1f}% 达到切换阈值，移出自动路由"
+        else:
+            reason = f"额度消耗 {used_ratio:.1f}% 低于切换阈值，恢复自动路由"
+        logger.info("%s: %s", model_name, reason)
+        await LogWriter.write(
+            log_type=2,
+            model_id=model_id,
+            log_content=json.dumps(
+                {
+                    "from_model": model_name if exhausted else None,
+                    "to_model": None if exhausted else model_name,
+                    "reason": reason,
+                    "used_ratio": round(used_ratio, 2),
+                }
+            ),
+            status=0 if exhausted else 1,
+        )
+
+    @classmethod
+    async def _flush_loop(cls):
+        while True:
+            await asyncio.sleep(cls.FLUSH_INTERVAL)
+            await cls.flush()
+
+    @classmethod
+    async def start(cls):
+        """加载额度状态并启动定时写入（lifespan 启动时调用）"""
+        await cls.flush()
+        if cls.FLUSH_INTERVAL > 0:
+            cls._task = asyncio.create_task(cls._flush_loop())
+
+    @classmethod
+    async def stop(cls):
+        """停止定时任务并写入剩余用量（lifespan 结束时调用）"""
+        task = cls._task
+        cls._task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await cls.flush()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取额度统计写入情况"""
+        return {
+            **cls._stats,
+            "pending_models": len(cls._pending),
+            "exhausted": sorted(cls._exhausted),
+        }
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+from services.token_estimator import TokenEstimator
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """解析限流重置时间：纯数字（秒）或 OpenAI 风格的 "1m30s"、"20ms" """
+    if not value:
+        return None
+    seconds = _parse_number(value)
+    if seconds is not None:
+        return seconds
+    parts = _DURATION_PART.findall(value.strip())
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    """解析 Retry-After（秒或 HTTP 日期）及 retry-after-ms"""
+    retry_ms = _parse_number(headers.get("retry-after-ms"))
+    if retry_ms is not None:
+        return retry_ms / 1000
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    seconds = _parse_number(value)
+    if seconds is not None:
+        return seconds
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitExceeded(Exception):
+    """本地限流：等待期限内无法获得令牌"""
+
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__(f"{scope} 触发限流，请 {retry_after:.1f}s 后重试")
+
+
+class TokenBucket:
+    """令牌桶，rate 为每秒补充的令牌数，rate <= 0 表示不限速
+
+    预约式扣减：获取令牌时立即扣减（可扣为负数），调用方等待欠额补足，
+    排队的请求因此按到达顺序获得令牌。
+    blocked_until 用于上游要求暂停（Retry-After）的场景，不限速的桶同样生效。
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float = 0.0, capacity: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def configure(self, rate: float, capacity: float):
+        """更新速率与容量（模型参数可能被修改）"""
+        if rate == self.rate and capacity == self.capacity:
+            return
+        self._refill(time.monotonic())
+        if self.rate <= 0:
+            # 由不限速切换为限速时从满桶开始
+            self.tokens = capacity
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            elapsed = max(0.0, now - self.updated)
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """获取 amount 个令牌需要等待的秒数"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate > 0:
+            # 超过容量的请求按满桶放行，否则永远无法获得令牌
+            amount = min(amount, self.capacity)
+            wait = max(wait, (amount - self.tokens) / self.rate)
+        return wait
+
+    def take(self, amount: float):
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """返还令牌，amount 为负数时补扣"""
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def limit_remaining(self, remaining: float):
+        """按上游返回的剩余额度收紧令牌数"""
+        if self.rate > 0:
+            self.tokens = min(self.tokens, remaining)
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Limit:
+    """一个限流对象（网关 Key 或模型）的请求数桶与 token 数桶"""
+
+    __slots__ = ("requests", "tokens")
+
+    def __init__(self):
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+
+    def configure(self, rps: float, burst: float, tpm: float):
+        self.requests.configure(rps, burst if burst > 0 else max(1.0, rps))
+        self.tokens.configure(tpm / 60, tpm)
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def take(self, tokens: float):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def is_idle(self, now: float) -> bool:
+        return self.requests.is_idle(now) and self.tokens.is_idle(now)
+
+
+class RateLimiter:
+    """本地限流 - 按网关 API Key 与上游模型的令牌桶（请求数/秒 + token 数/分钟）
+
+    令牌不足时在等待期限内排队，超过期限直接拒绝，不再把注定被上游 429 的请求发出去。
+    模型限额取模型参数 rate_limit_rps / rate_limit_burst / rate_limit_tpm，
+    未配置时使用环境变量默认值（0 表示不限）。
+    上游返回 429 时按 Retry-After 暂停该模型；成功响应中的 x-ratelimit-remaining-*
+    用于收紧本地令牌数，剩余为 0 时暂停到 x-ratelimit-reset-*。
+    token 数在请求前按估算值扣减，响应返回 usage 后按实际值结算。
+    """
+
+    KEY_RPS = float(os.getenv("RATE_LIMIT_KEY_RPS", "0"))
+    KEY_BURST = float(os.getenv("RATE_LIMIT_KEY_BURST", "0"))
+    KEY_TPM = float(os.getenv("RATE_LIMIT_KEY_TPM", "0"))
+    MODEL_RPS = float(os.getenv("RATE_LIMIT_MODEL_RPS", "0"))
+    MODEL_BURST = float(os.getenv("RATE_LIMIT_MODEL_BURST", "0"))
+    MODEL_TPM = float(os.getenv("RATE_LIMIT_MODEL_TPM", "0"))
+    # 排队等待令牌的最长时间（秒）
+    MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "5"))
+    # 上游 429 未携带 Retry-After 时的暂停时间（秒）
+    DEFAULT_RETRY_AFTER = float(os.getenv("RATE_LIMIT_DEFAULT_RETRY_AFTER", "1"))
+    # 未指定 max_tokens 时按此估算输出 token 数
+    DEFAULT_COMPLETION_TOKENS = int(
+        os.getenv("RATE_LIMIT_DEFAULT_COMPLETION_TOKENS", "256")
+    )
+    # 网关 Key 限流对象上限，超出时清理空闲的桶
+    MAX_KEYS = 10000
+
+    _keys: Dict[str, _Limit] = {}
+    _models: Dict[int, _Limit] = {}
+    _stats = {"admitted": 0, "queued": 0, "rejected": 0, "upstream_throttled": 0}
+
+    @classmethod
+    def key_limits_enabled(cls) -> bool:
+        return cls.KEY_RPS > 0 or cls.KEY_TPM > 0
+
+    @classmethod
+    def estimate_tokens(
+        cls, messages: List[Dict[str, Any]], max_tokens: Optional[int] = None
+    ) -> int:
+        """估算请求消耗的 token 数（与厂商无关的输入估算 + 输出上限）"""
+        return TokenEstimator.count_messages(None, None, messages) + (
+            max_tokens or cls.DEFAULT_COMPLETION_TOKENS
+        )
+
+    @classmethod
+    def _model_limit(cls, model_id: int) -> _Limit:
+        limit = cls._models.get(model_id)
+        if limit is None:
+            limit = cls._models[model_id] = _Limit()
+        return limit
+
+    @classmethod
+    def _param(cls, params: Dict[str, Any], name: str, default: float) -> float:
+        try:
+            return max(0.0, float(params.get(name, default)))
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    async def _acquire(cls, limit: _Limit, tokens: float, max_wait: float, scope: str):
+        wait = limit.wait_time(tokens, time.monotonic())
+        if wait > max_wait:
+            cls._stats["rejected"] += 1
+            raise RateLimitExceeded(scope, wait)
+
+        # 计算与扣减之间没有 await，排队的请求按到达顺序获得令牌
+        limit.take(tokens)
+        cls._stats["admitted"] += 1
+        if wait > 0:
+            cls._stats["queued"] += 1
+            await asyncio.sleep(wait)
+
+    @classmethod
+    async def acquire_key(cls, api_key: str, tokens: float, max_wait: float):
+        """网关 Key 准入，超过 max_wait 仍无令牌时抛出 RateLimitExceeded"""
+        if not cls.key_limits_enabled():
+            return
+
+        limit = cls._keys.get(api_key)
+        if limit is None:
+            if len(cls._keys) >= cls.MAX_KEYS:
+                cls._prune_keys()
+            limit = cls._keys[api_key] = _Limit()
+        limit.configure(cls.KEY_RPS, cls.KEY_BURST, cls.KEY_TPM)
+        await cls._acquire(limit, tokens, max_wait, "网关 API Key")
+
+    @classmethod
+    async def acquire_model(cls, route, tokens: float, max_wait: float):
+        """模型准入，超过 max_wait 仍无令牌时抛出 RateLimitExceeded"""
+        params = route.params or {}
+        limit = cls._model_limit(route.id)
+        limit.configure(
+            cls._param(params, "rate_limit_rps", cls.MODEL_RPS),
+            cls._param(params, "rate_limit_burst", cls.MODEL_BURST),
+            cls._param(params, "rate_limit_tpm", cls.MODEL_TPM),
+        )
+        await cls._acquire(limit, tokens, max_wait, f"模型 {route.model_name}")
+
+    @classmethod
+    def settle_key(cls, api_key: str, estimated: float, usage: Optional[Dict]):
+        """按实际 usage 结算网关 Key 的 token 桶"""
+        limit = cls._keys.get(api_key)
+        actual = (usage or {}).get("total_tokens")
+        if limit is not None and isinstance(actual, (int, float)):
+            limit.tokens.refund(estimated - actual)
+
+    @classmethod
+    def refund_key(cls, api_key: str, estimated: float):
+        """请求未成功（所有模型失败或被拒绝）时返还网关 Key 预扣的 token"""
+        limit = cls._keys.get(api_key)
+        if limit is not None:
+            limit.tokens.refund(estimated)
+
+    @classmethod
+    def settle_model(cls, model_id: int, estimated: float, usage: Optional[Dict]):
+        """按实际 usage 结算模型的 token 桶"""
+        limit = cls._models.get(model_id)
+        actual = (usage or {}).get("total_tokens")
+        if limit is not None and isinstance(actual, (int, float)):
+            limit.tokens.refund(estimated - actual)
+
+    @classmethod
+    def observe_upstream(cls, model_id: int, status_code: int, headers):
+        """根据上游响应的限流头调整模型的令牌桶"""
+        limit = cls._model_limit(model_id)
+        now = time.monotonic()
+
+        if status_code == 429:
+            cls._stats["upstream_throttled"] += 1
+            delay = _parse_retry_after(headers)
+            if delay is None:
+                delay = max(
+                    _parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                    _parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+                )
+            delay = max(0.0, delay or cls.DEFAULT_RETRY_AFTER)
+            limit.requests.block(now + delay)
+            logger.warning("上游限流 (model_id=%s)，暂停 %.1fs", model_id, delay)
+            return
+
+        for kind, bucket in (("requests", limit.requests), ("tokens", limit.tokens)):
+            remaining = _parse_number(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if remaining is None:
+                continue
+            bucket.limit_remaining(remaining)
+            if remaining <= 0:
+                reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    bucket.block(now + reset)
+
+    @classmethod
+    def _prune_keys(cls):
+        now = time.monotonic()
+        for api_key in [k for k, v in cls._keys.items() if v.is_idle(now)]:
+            del cls._keys[api_key]
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取限流统计"""
+        return {**cls._stats, "keys": len(cls._keys), "models": len(cls._models)}
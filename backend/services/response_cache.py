@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class ResponseCache:
+    """精确匹配响应缓存 - 非流式 Chat Completions
+
+    以实际转发的模型 ID 与请求体（消息 + 采样参数）的规范化哈希为键，
+    命中时跳过上游请求。按 LRU 淘汰，同时受条目数、内存占用与 TTL 限制。
+    响应以 JSON 字节保存，每次命中返回独立副本。
+    """
+
+    ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+    MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # 仅缓存 temperature 不超过该值的请求
+    # 未指定 temperature 时上游默认值通常大于 0，不缓存
+    MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0"))
+
+    # key -> (过期时间, 响应 JSON 字节)
+    _entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+    _bytes = 0
+    _stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def is_cacheable(
+        cls, temperature: Optional[float], cache_control: Optional[str] = None
+    ) -> bool:
+        """请求是否可使用精确匹配缓存"""
+        if not cls.ENABLED or cls.MAX_ENTRIES <= 0:
+            return False
+        return cls.allows_request(temperature, cache_control)
+
+    @classmethod
+    def allows_request(
+        cls, temperature: Optional[float], cache_control: Optional[str] = None
+    ) -> bool:
+        """请求本身是否允许缓存（各缓存层共用）
+
+        Cache-Control: no-cache / no-store 可按请求关闭缓存。
+        """
+        if cache_control and (
+            "no-cache" in cache_control.lower() or "no-store" in cache_control.lower()
+        ):
+            return False
+        return temperature is not None and temperature <= cls.MAX_TEMPERATURE
+
+    @classmethod
+    def make_key(cls, model_id: int, request_data: Dict[str, Any]) -> str:
+        """请求的规范化哈希（键顺序与空白不影响结果）"""
+        canonical = json.dumps(
+            [model_id, request_data],
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存，未命中或已过期返回 None"""
+        entry = cls._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                cls._remove(key)
+            cls._stats["misses"] += 1
+            return None
+
+        cls._entries.move_to_end(key)
+        cls._stats["hits"] += 1
+        return json.loads(entry[1])
+
+    @classmethod
+    def put(cls, key: str, response: Dict[str, Any]):
+        """写入缓存，超出条目数或内存上限时淘汰最久未使用的条目"""
+        payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        if len(payload) > cls.MAX_BYTES:
+            return
+
+        if key in cls._entries:
+            cls._remove(key)
+        cls._entries[key] = (time.monotonic() + cls.TTL, payload)
+        cls._bytes += len(payload)
+
+        while len(cls._entries) > cls.MAX_ENTRIES or cls._bytes > cls.MAX_BYTES:
+            oldest = next(iter(cls._entries))
+            cls._remove(oldest)
+            cls._stats["evictions"] += 1
+
+    @classmethod
+    def _remove(cls, key: str):
+        _, payload = cls._entries.pop(key)
+        cls._bytes -= len(payload)
+
+    @classmethod
+    def clear(cls):
+        """清空缓存"""
+        cls._entries.clear()
+        cls._bytes = 0
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = cls._stats["hits"] + cls._stats["misses"]
+        return {
+            **cls._stats,
+            "entries": len(cls._entries),
+            "bytes": cls._bytes,
+            "hit_ratio": round(cls._stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
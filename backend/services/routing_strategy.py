@@ -0,0 +1,159 @@
+import logging
+import os
+import random
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _ModelLoad:
+    """单个模型的实时负载：进行中请求数 + 延迟 EWMA"""
+
+    __slots__ = ("outstanding", "ewma")
+
+    def __init__(self):
+        self.outstanding = 0
+        self.ewma: Optional[float] = None
+
+
+class RoutingStats:
+    """auto 模式路由使用的实时统计（仅内存）"""
+
+    EWMA_ALPHA = float(os.getenv("ROUTING_EWMA_ALPHA", "0.3"))
+    # 失败请求按 延迟 + 惩罚值 计入 EWMA，避免快速失败的模型吸引流量
+    FAILURE_PENALTY = float(os.getenv("ROUTING_FAILURE_PENALTY", "5.0"))
+
+    _loads: Dict[int, _ModelLoad] = {}
+
+    @classmethod
+    def _get(cls, model_id: int) -> _ModelLoad:
+        load = cls._loads.get(model_id)
+        if load is None:
+            load = cls._loads[model_id] = _ModelLoad()
+        return load
+
+    @classmethod
+    def acquire(cls, model_id: int):
+        """请求开始"""
+        cls._get(model_id).outstanding += 1
+
+    @classmethod
+    def release(cls, model_id: int):
+        """请求结束（含取消）"""
+        load = cls._get(model_id)
+        load.outstanding = max(0, load.outstanding - 1)
+
+    @classmethod
+    def observe(cls, model_id: int, latency: float, success: bool = True):
+        """记录一次请求延迟（流式请求为首 token 延迟）"""
+        load = cls._get(model_id)
+        if not success:
+            latency += cls.FAILURE_PENALTY
+        if load.ewma is None:
+            load.ewma = latency
+        else:
+            load.ewma += cls.EWMA_ALPHA * (latency - load.ewma)
+
+    @classmethod
+    def outstanding(cls, model_id: int) -> int:
+        load = cls._loads.get(model_id)
+        return load.outstanding if load else 0
+
+    @classmethod
+    def ewma(cls, model_id: int) -> float:
+        """延迟 EWMA，尚无样本时返回 0（新模型优先获得流量以建立统计）"""
+        load = cls._loads.get(model_id)
+        return load.ewma if load and load.ewma is not None else 0.0
+
+    @classmethod
+    def get_stats(cls) -> Dict[int, Dict[str, float]]:
+        return {
+            model_id: {"outstanding": load.outstanding, "ewma": load.ewma}
+            for model_id, load in cls._loads.items()
+        }
+
+
+class RoutingStrategy:
+    """auto 模式路由策略 - 决定候选模型的尝试顺序
+
+    策略函数接收按优先级排序的可用模型，返回尝试顺序；
+    首个模型失败后按返回顺序继续切换。
+    内置策略：
+      priority              静态优先级（默认）
+      weighted_round_robin  平滑加权轮询，权重取模型参数 weight（默认 1）
+      least_outstanding     进行中请求最少优先
+      p2c_ewma              随机取两个模型，选 延迟EWMA x (进行中请求+1) 较小者
+    新策略通过 RoutingStrategy.register() 注册。
+    """
+
+    NAME = os.getenv("ROUTING_STRATEGY", "priority").lower()
+
+    _registry: Dict[str, Callable[[List], List]] = {}
+    # 平滑加权轮询的当前权重: model_id -> current_weight
+    _wrr_current: Dict[int, float] = {}
+
+    @classmethod
+    def register(cls, name: str, strategy: Callable[[List], List]):
+        """注册路由策略"""
+        cls._registry[name] = strategy
+
+    @classmethod
+    def order(cls, routes: List, name: Optional[str] = None) -> List:
+        """按策略返回候选模型的尝试顺序"""
+        strategy = cls._registry.get(name or cls.NAME)
+        if strategy is None or len(routes) < 2:
+            return routes
+        return strategy(routes)
+
+    @classmethod
+    def _priority(cls, routes: List) -> List:
+        return routes
+
+    @classmethod
+    def _weight(cls, route) -> float:
+        try:
+            return max(0.0, float(route.params.get("weight", 1)))
+        except (TypeError, ValueError):
+            return 1.0
+
+    @classmethod
+    def _weighted_round_robin(cls, routes: List) -> List:
+        # 平滑加权轮询（nginx 算法）：
+        # 每轮各模型累加自身权重，选当前权重最大者并减去总权重
+        total = 0.0
+        best = None
+        for route in routes:
+            weight = cls._weight(route)
+            total += weight
+            current = cls._wrr_current.get(route.id, 0.0) + weight
+            cls._wrr_current[route.id] = current
+            if best is None or current > cls._wrr_current[best.id]:
+                best = route
+        cls._wrr_current[best.id] -= total
+        return [best] + [r for r in routes if r is not best]
+
+    @classmethod
+    def _least_outstanding(cls, routes: List) -> List:
+        # 稳定排序：进行中请求数相同时保持优先级顺序
+        return sorted(routes, key=lambda r: RoutingStats.outstanding(r.id))
+
+    @classmethod
+    def _p2c_ewma(cls, routes: List) -> List:
+        a, b = random.sample(routes, 2)
+
+        def cost(route) -> float:
+            return RoutingStats.ewma(route.id) * (
+                RoutingStats.outstanding(route.id) + 1
+            )
+
+        best = a if cost(a) <= cost(b) else b
+        return [best] + [r for r in routes if r is not best]
+
+
+RoutingStrategy.register("priority", RoutingStrategy._priority)
+RoutingStrategy.register("weighted_round_robin", RoutingStrategy._weighted_round_robin)
+RoutingStrategy.register("least_outstanding", RoutingStrategy._least_outstanding)
+RoutingStrategy.register("p2c_ewma", RoutingStrategy._p2c_ewma)
+
+if RoutingStrategy.NAME not in RoutingStrategy._registry:
+    logger.warning("未知路由策略 %s，使用静态优先级", RoutingStrategy.NAME)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any
+
+from config.database import SessionLocal, run_in_db
+from models.model_config import ModelConfig
+from services.credential_cache import CredentialCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """路由表条目 - ModelConfig 的只读快照，字段名与 ModelConfig 一致，api_key 为明文"""
+
+    id: int
+    vendor: str
+    model_name: str
+    api_base: Optional[str]
+    api_path: Optional[str]
+    api_spec: Optional[str]
+    api_key: Optional[str]
+    priority: int
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_model(cls, model: ModelConfig) -> "ModelRoute":
+        return cls(
+            id=model.id,
+            vendor=model.vendor,
+            model_name=model.model_name,
+            api_base=model.api_base,
+            api_path=model.api_path,
+            api_spec=model.api_spec,
+            api_key=CredentialCache.get(model.id, model.api_key),
+            priority=model.priority if model.priority is not None else 100,
+            params=dict(model.params or {}),
+        )
+
+
+@dataclass(frozen=True)
+class ModelMeta:
+    """模型元数据 - 统计、展示使用，覆盖所有模型（含禁用、断开的），不含密钥"""
+
+    id: int
+    vendor: str
+    model_name: str
+    priority: int
+    status: int
+    connect_status: int
+
+    @classmethod
+    def from_model(cls, model: ModelConfig) -> "ModelMeta":
+        return cls(
+            id=model.id,
+            vendor=model.vendor,
+            model_name=model.model_name,
+            priority=model.priority if model.priority is not None else 100,
+            status=model.status or 0,
+            connect_status=model.connect_status or 0,
+        )
+
+
+class RoutingTable:
+    """内存路由表 - 按优先级排序的可用模型列表 + 按模型名索引 + 全部模型元数据
+
+    lifespan 启动时构建，模型管理接口修改数据后立即重建；
+    另有后台定时刷新，用于同步其他进程（如 backend 容器）对数据库的修改。
+    请求热路径只读内存，不访问数据库（启动前读取时为空表）；
+    统计接口也从这里读取模型名称。
+    """
+
+    REFRESH_INTERVAL = float(os.getenv("ROUTING_REFRESH_INTERVAL", "10"))
+
+    # (按优先级排序的列表, 模型名 -> 条目, 模型ID -> 元数据)，整体替换保证读取一致
+    _snapshot = ([], {}, {})
+    _refresh_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def rebuild(cls, db=None):
+        """从数据库重建路由表"""
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            # 一次查询全部模型，可用模型在内存中筛选
+            models = (
+                db.query(ModelConfig)
+                .order_by(ModelConfig.priority, ModelConfig.id)
+                .all()
+            )
+            routes = [
+                ModelRoute.from_model(m)
+                for m in models
+                if m.status == 1 and m.connect_status == 1
+            ]
+            by_id = {m.id: ModelMeta.from_model(m) for m in models}
+        finally:
+            if own_session:
+                db.close()
+
+        by_name: Dict[str, ModelRoute] = {}
+        for route in routes:
+            # 同名模型取优先级最高的一个
+            by_name.setdefault(route.model_name, route)
+
+        cls._snapshot = (routes, by_name, by_id)
+
+    @classmethod
+    def get_routes(cls) -> List[ModelRoute]:
+        """获取所有可用模型（按优先级排序）"""
+        return list(cls._snapshot[0])
+
+    @classmethod
+    def get_route(cls, model_name: str) -> Optional[ModelRoute]:
+        """按模型名查找可用模型"""
+        return cls._snapshot[1].get(model_name)
+
+    @classmethod
+    def get_models(cls) -> Dict[int, ModelMeta]:
+        """获取全部模型元数据（按优先级排序，只读）"""
+        return cls._snapshot[2]
+
+    @classmethod
+    async def _refresh_loop(cls):
+        while True:
+            await asyncio.sleep(cls.REFRESH_INTERVAL)
+            try:
+                await run_in_db(cls.rebuild)
+            except Exception as e:
+                logger.warning("路由表刷新失败: %s", e)
+
+    @classmethod
+    async def start(cls):
+        """构建路由表并启动后台刷新（lifespan 启动时调用）"""
+        await run_in_db(cls.rebuild)
+        if cls.REFRESH_INTERVAL > 0:
+            cls._refresh_task = asyncio.create_task(cls._refresh_loop())
+
+    @classmethod
+    async def stop(cls):
+        """停止后台刷新"""
+        task = cls._refresh_task
+        cls._refresh_task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
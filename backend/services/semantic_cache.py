@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖，未安装时语义缓存不可用
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """语义缓存 - 近似重复提示词的响应缓存（精确匹配缓存之后的第二层）
+
+    对规范化后的消息文本计算字符 n-gram 哈希向量（本地计算，无需外部嵌入服务），
+    在进程内向量索引中查找同一模型、同一采样参数下余弦相似度超过阈值的历史请求。
+    索引容量固定，满时淘汰最久未使用的条目；定期及关闭时持久化到磁盘。
+
+    相似度阈值默认取 SEMANTIC_CACHE_THRESHOLD，可在模型参数中通过
+    semantic_cache_threshold 按模型覆盖。需安装 numpy。
+    """
+
+    ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.98"))
+    MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+    TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+    DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "512"))
+    NGRAM_SIZES = (2, 3)
+    PATH = os.getenv("SEMANTIC_CACHE_PATH", "./data/semantic_cache.npz")
+    SAVE_INTERVAL = float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL", "300"))
+
+    # 索引：按槽位存放，model_id = -1 表示空槽
+    _vectors = None
+    _model_ids = None
+    _param_keys = None
+    _last_used = None
+    _created = None
+    _responses: list = []
+    _save_task: Optional[asyncio.Task] = None
+    _stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return cls.ENABLED and np is not None and cls.MAX_ENTRIES > 0
+
+    @classmethod
+    def _ensure_index(cls):
+        if cls._vectors is None:
+            cls._reset(cls.MAX_ENTRIES)
+
+    @classmethod
+    def _reset(cls, capacity: int):
+        cls._vectors = np.zeros((capacity, cls.DIM), dtype=np.float32)
+        cls._model_ids = np.full(capacity, -1, dtype=np.int64)
+        cls._param_keys = np.zeros(capacity, dtype=np.int64)
+        cls._last_used = np.zeros(capacity, dtype=np.float64)
+        cls._created = np.zeros(capacity, dtype=np.float64)
+        cls._responses = [None] * capacity
+
+    @classmethod
+    def _normalize(cls, messages: list) -> str:
+        """消息规范化：拼接角色与内容，统一大小写，标点与空白折叠为单个空格"""
+        parts = []
+        for message in messages:
+            content = message.get("content")
+            if not isinstance(content, str):
+                content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+            parts.append(f"{message.get('role', '')} {content}")
+        text = " ".join(parts).lower()
+        text = "".join(
+            " " if unicodedata.category(ch)[0] in "PZC" else ch for ch in text
+        )
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def embed(cls, text: str):
+        """字符 n-gram 哈希向量（L2 归一化），哈希函数与进程无关，可持久化"""
+        indices = []
+        signs = []
+        for n in cls.NGRAM_SIZES:
+            for i in range(max(len(text) - n + 1, 1)):
+                h = zlib.crc32(text[i : i + n].encode("utf-8"))
+                indices.append(h % cls.DIM)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+
+        vector = np.bincount(indices, weights=signs, minlength=cls.DIM).astype(
+            np.float32
+        )
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @classmethod
+    def prepare(cls, request_data: Dict[str, Any]) -> Optional[Tuple[Any, int]]:
+        """计算请求的查询键：(消息向量, 采样参数签名)，与目标模型无关"""
+        if not cls.is_available():
+            return None
+
+        params = {
+            k: v for k, v in request_data.items() if k not in ("model", "messages")
+        }
+        digest = hashlib.blake2b(
+            json.dumps(params, sort_keys=True).encode("utf-8"), digest_size=8
+        ).digest()
+        param_key = int.from_bytes(digest, "little", signed=True)
+        return cls.embed(cls._normalize(request_data["messages"])), param_key
+
+    @classmethod
+    def get(
+        cls, model_id: int, query: Tuple[Any, int], threshold: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """查找相似度最高且超过阈值的缓存响应"""
+        cls._ensure_index()
+        vector, param_key = query
+        threshold = cls.THRESHOLD if threshold is None else threshold
+
+        now = time.time()
+        candidates = (
+            (cls._model_ids == model_id)
+            & (cls._param_keys == param_key)
+            & (cls._created >= now - cls.TTL)
+        )
+        if not candidates.any():
+            cls._stats["misses"] += 1
+            return None
+
+        scores = np.where(candidates, cls._vectors @ vector, -1.0)
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            cls._stats["misses"] += 1
+            return None
+
+        cls._last_used[best] = now
+        cls._stats["hits"] += 1
+        return json.loads(cls._responses[best])
+
+    @classmethod
+    def put(cls, model_id: int, query: Tuple[Any, int], response: Dict[str, Any]):
+        """写入缓存，优先使用空槽或过期槽，否则淘汰最久未使用的条目"""
+        cls._ensure_index()
+        vector, param_key = query
+        now = time.time()
+
+        free = np.flatnonzero((cls._model_ids == -1) | (cls._created < now - cls.TTL))
+        if len(free):
+            slot = int(free[0])
+        else:
+            slot = int(np.argmin(cls._last_used))
+            cls._stats["evictions"] += 1
+
+        cls._vectors[slot] = vector
+        cls._model_ids[slot] = model_id
+        cls._param_keys[slot] = param_key
+        cls._last_used[slot] = now
+        cls._created[slot] = now
+        cls._responses[slot] = json.dumps(response, ensure_ascii=False)
+
+    @classmethod
+    def _snapshot(cls) -> Dict[str, Any]:
+        """复制当前有效条目（在事件循环线程中调用，写盘在线程中进行）"""
+        used = np.flatnonzero(cls._model_ids != -1)
+        return {
+            "vectors": cls._vectors[used].copy(),
+            "model_ids": cls._model_ids[used].copy(),
+            "param_keys": cls._param_keys[used].copy(),
+            "last_used": cls._last_used[used].copy(),
+            "created": cls._created[used].copy(),
+            "responses": np.array(json.dumps([cls._responses[i] for i in used])),
+        }
+
+    @classmethod
+    def _write(cls, snapshot: Dict[str, Any]):
+        """写入磁盘（先写临时文件再替换，避免中途退出损坏文件）"""
+        directory = os.path.dirname(cls.PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = cls.PATH + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **snapshot)
+        os.replace(tmp_path, cls.PATH)
+
+    @classmethod
+    def load(cls):
+        """从磁盘恢复索引，向量维度不一致或文件损坏时丢弃"""
+        cls._reset(cls.MAX_ENTRIES)
+        if not os.path.exists(cls.PATH):
+            return
+
+        try:
+            with np.load(cls.PATH) as data:
+                vectors = data["vectors"]
+                if vectors.ndim != 2 or vectors.shape[1] != cls.DIM:
+                    logger.warning("语义缓存向量维度已变化，忽略已保存的索引")
+                    return
+                responses = json.loads(str(data["responses"]))
+                # 容量变小时保留最近使用的条目
+                keep = np.argsort(data["last_used"])[::-1][: cls.MAX_ENTRIES]
+                count = len(keep)
+                cls._vectors[:count] = vectors[keep]
+                cls._model_ids[:count] = data["model_ids"][keep]
+                cls._param_keys[:count] = data["param_keys"][keep]
+                cls._last_used[:count] = data["last_used"][keep]
+                cls._created[:count] = data["created"][keep]
+                for slot, i in enumerate(keep):
+                    cls._responses[slot] = responses[i]
+        except Exception as e:
+            logger.warning("语义缓存加载失败: %s", e)
+            cls._reset(cls.MAX_ENTRIES)
+
+    @classmethod
+    async def save(cls):
+        if cls._vectors is None:
+            return
+        try:
+            await asyncio.to_thread(cls._write, cls._snapshot())
+        except Exception as e:
+            logger.warning("语义缓存保存失败: %s", e)
+
+    @classmethod
+    async def _save_loop(cls):
+        while True:
+            await asyncio.sleep(cls.SAVE_INTERVAL)
+            await cls.save()
+
+    @classmethod
+    async def start(cls):
+        """加载持久化索引并启动定期保存（lifespan 启动时调用）"""
+        if not cls.ENABLED:
+            return
+        if np is None:
+            logger.error("未安装 numpy，语义缓存未启用；请按 requirements.txt 安装依赖")
+            cls.ENABLED = False
+            return
+
+        await asyncio.to_thread(cls.load)
+        if cls.SAVE_INTERVAL > 0:
+            cls._save_task = asyncio.create_task(cls._save_loop())
+
+    @classmethod
+    async def stop(cls):
+        """停止定期保存并写盘（lifespan 结束时调用）"""
+        task = cls._save_task
+        cls._save_task = None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if cls.is_available():
+            await cls.save()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取缓存统计"""
+        entries = 0
+        if cls._model_ids is not None:
+            entries = int((cls._model_ids != -1).sum())
+        return {**cls._stats, "entries": entries}
@@ -0,0 +1,55 @@
+import asyncio
+import copy
+import os
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """请求合并 - 相同的进行中请求共享一次上游调用
+
+    第一个请求发起上游调用，其余相同键的请求等待同一个 Future，
+    每个等待方拿到结果的独立副本。单个等待方取消（如客户端断开、对冲落败）
+    不影响其他等待方，所有等待方都取消后才取消上游调用。
+    """
+
+    ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+    # key -> [Future, 等待方数量]
+    _inflight: Dict[str, list] = {}
+    _stats = {"leaders": 0, "shared": 0}
+
+    @classmethod
+    async def run(cls, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """执行或加入 key 对应的进行中调用"""
+        entry = cls._inflight.get(key)
+        if entry is None:
+            future = asyncio.ensure_future(factory())
+            entry = cls._inflight[key] = [future, 0]
+            future.add_done_callback(lambda f: cls._release(key, f))
+            cls._stats["leaders"] += 1
+        else:
+            cls._stats["shared"] += 1
+
+        future = entry[0]
+        entry[1] += 1
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not future.done():
+                future.cancel()
+        return copy.deepcopy(result)
+
+    @classmethod
+    def _release(cls, key: str, future: asyncio.Future):
+        entry = cls._inflight.get(key)
+        if entry is not None and entry[0] is future:
+            del cls._inflight[key]
+        # 等待方已全部离开时，避免未读取异常的告警
+        if not future.cancelled():
+            future.exception()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        """获取合并统计"""
+        return {**cls._stats, "inflight": len(cls._inflight)}
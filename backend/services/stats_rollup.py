@@ -0,0 +1,152 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, exists, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from config.database import SessionLocal
+from models.log_rollup import LogRollup
+from models.operation_log import OperationLog
+
+logger = logging.getLogger(__name__)
+
+# (小时, 模型ID, 日志类型, 状态)
+_Key = Tuple[str, int, int, int]
+_KEY_COLUMNS = ("hour", "model_id", "log_type", "status")
+_COUNTERS = ("request_count", "prompt_tokens", "completion_tokens")
+
+
+def _token_count(usage: Optional[Dict[str, Any]], field: str) -> int:
+    value = (usage or {}).get(field)
+    return int(value) if isinstance(value, (int, float)) and value > 0 else 0
+
+
+class StatsRollup:
+    """日志统计汇总 - 维护 log_rollup 小时汇总表
+
+    LogWriter 每批写入日志时在同一事务中累加对应的汇总行，
+    统计接口只读取汇总表，不再对 operation_log 全表计数和分组。
+    表为空时从已有日志回填一次（升级前写入的历史数据）。
+    """
+
+    @staticmethod
+    def hour_of(moment: datetime) -> str:
+        """时间所在的小时桶"""
+        return moment.strftime("%Y-%m-%d %H")
+
+    @classmethod
+    def aggregate(cls, rows: List[Dict[str, Any]]) -> Dict[_Key, List[int]]:
+        """按汇总键累计一批日志行，并移除行中不属于日志表的 usage 字段"""
+        counts: Dict[_Key, List[int]] = {}
+        for row in rows:
+            usage = row.pop("usage", None)
+            key = (
+                cls.hour_of(row["create_time"]),
+                row.get("model_id") or 0,
+                row.get("log_type") or 0,
+                row.get("status") or 0,
+            )
+            entry = counts.get(key)
+            if entry is None:
+                entry = counts[key] = [0, 0, 0]
+            entry[0] += 1
+            entry[1] += _token_count(usage, "prompt_tokens")
+            entry[2] += _token_count(usage, "completion_tokens")
+        return counts
+
+    @classmethod
+    def apply(cls, db, counts: Dict[_Key, List[int]]):
+        """把累计值加到汇总表（调用方负责提交事务）"""
+        if not counts:
+            return
+        rows = [
+            {**dict(zip(_KEY_COLUMNS, key)), **dict(zip(_COUNTERS, values))}
+            for key, values in counts.items()
+        ]
+        table = LogRollup.__table__
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            stmt = dialect_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(_KEY_COLUMNS),
+                set_={name: table.c[name] + stmt.excluded[name] for name in _COUNTERS},
+            )
+            db.execute(stmt, rows)
+            return
+
+        # 其他数据库：逐行先更新，不存在时插入
+        for row in rows:
+            result = db.execute(
+                update(table)
+                .where(and_(*(table.c[name] == row[name] for name in _KEY_COLUMNS)))
+                .values({name: table.c[name] + row[name] for name in _COUNTERS})
+            )
+            if result.rowcount == 0:
+                db.execute(insert(table), row)
+
+    @classmethod
+    def backfill(cls) -> int:
+        """汇总表为空时从已有日志回填，返回写入的汇总行数"""
+        db = SessionLocal()
+        try:
+            if db.get_bind().dialect.name != "sqlite":
+                logger.warning("日志汇总回填仅支持 SQLite，已跳过")
+                return 0
+            if db.execute(select(LogRollup.id).limit(1)).first() is not None:
+                return 0
+
+            log = OperationLog
+            usage = case(
+                (func.json_valid(log.log_content) == 1, log.log_content), else_="{}"
+            )
+            hour = func.strftime("%Y-%m-%d %H", log.create_time)
+            model_id = func.coalesce(log.model_id, 0)
+            log_type = func.coalesce(log.log_type, 0)
+            status = func.coalesce(log.status, 0)
+            source = (
+                select(
+                    hour,
+                    model_id,
+                    log_type,
+                    status,
+                    func.count(),
+                    func.sum(
+                        func.coalesce(
+                            func.json_extract(usage, "$.usage.prompt_tokens"), 0
+                        )
+                    ),
+                    func.sum(
+                        func.coalesce(
+                            func.json_extract(usage, "$.usage.completion_tokens"), 0
+                        )
+                    ),
+                )
+                .where(
+                    log.create_time.isnot(None),
+                    # 与检查在同一条语句中，避免与其他进程的写入重复计数
+                    ~exists().select_from(LogRollup),
+                )
+                .group_by(hour, model_id, log_type, status)
+            )
+            result = db.execute(
+                insert(LogRollup).from_select([*_KEY_COLUMNS, *_COUNTERS], source)
+            )
+            db.commit()
+            if result.rowcount:
+                logger.info("已从历史日志回填 %s 条汇总", result.rowcount)
+            return result.rowcount or 0
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @classmethod
+    def clear(cls, db, log_type: Optional[int] = None):
+        """清空汇总（随日志一起清空，调用方负责提交事务）"""
+        query = db.query(LogRollup)
+        if log_type is not None:
+            query = query.filter(LogRollup.log_type == log_type)
+        query.delete(synchronize_session=False)
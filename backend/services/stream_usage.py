@@ -0,0 +1,116 @@
+import json
+import re
+from typing import Any, Dict, Optional, Union
+
+# 非空的 usage 对象，或 choices 为空的最后一个事件（include_usage 时其余 chunk 的
+# usage 为 null，不需要解析）
+_USAGE_EVENT = re.compile(rb'"usage"\s*:\s*\{|"choices"\s*:\s*\[\s*\]')
+
+
+class StreamUsage:
+    """流式响应用量统计 - 随流逐个 SSE 事件解析
+
+    上游在最后的 chunk 中返回 usage 时（OpenAI 兼容上游可通过
+    stream_options.include_usage 请求）直接使用；否则按内容字节数估算输出 token 数，
+    输入 token 数使用调用方的估算值。
+    只缓冲尚未结束的最后一个事件，不保存完整响应文本。
+
+    只有带非空 usage 或 choices 为空的事件才做 JSON 解析。同一个流中每个事件的 JSON 外壳
+    （id、model、created 等）基本不变，首个带内容的事件解析一次得到外壳长度，
+    之后按 data 长度减去外壳长度估算内容字节数，不再逐个解码 delta。
+
+    strip_usage_chunk 为 True 时（网关代客户端请求了 include_usage），
+    只含 usage 的 chunk 不转发给客户端，避免客户端收到 choices 为空的 chunk。
+    """
+
+    def __init__(self, prompt_tokens: int = 0, strip_usage_chunk: bool = False):
+        self.prompt_tokens = prompt_tokens
+        self.strip_usage_chunk = strip_usage_chunk
+        self.usage: Optional[Dict[str, Any]] = None
+        self._content_bytes = 0
+        self._envelope: Optional[int] = None
+        self._buffer = b""
+        self._bytes_mode = True
+
+    def feed(self, chunk: Union[str, bytes]) -> Union[str, bytes]:
+        """处理一个 chunk，返回需要转发给客户端的内容"""
+        is_bytes = self._bytes_mode = isinstance(chunk, bytes)
+        aligned = not self._buffer
+        self._buffer += (chunk if is_bytes else chunk.encode("utf-8")).replace(
+            b"\r\n", b"\n"
+        )
+        *events, self._buffer = self._buffer.split(b"\n\n")
+
+        if not self.strip_usage_chunk:
+            for event in events:
+                self._observe(event)
+            return chunk
+
+        # 需要过滤事件时按完整事件转发，未结束的事件留到后续 chunk；
+        # chunk 恰好由完整事件组成且都转发时原样返回
+        kept = [event for event in events if self._observe(event)]
+        if aligned and not self._buffer and len(kept) == len(events):
+            return chunk
+        joined = b"".join(event + b"\n\n" for event in kept)
+        return joined if is_bytes else joined.decode("utf-8")
+
+    def flush(self) -> Union[str, bytes]:
+        """流结束时处理剩余的不完整事件，返回需要转发的内容"""
+        tail, self._buffer = self._buffer, b""
+        keep = self._observe(tail) if tail.strip() else True
+        if not (self.strip_usage_chunk and keep):
+            tail = b""
+        return tail if self._bytes_mode else tail.decode("utf-8")
+
+    def _observe(self, event: bytes) -> bool:
+        """解析一个事件，返回是否转发给客户端"""
+        keep = True
+        for line in event.split(b"\n"):
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if not data or data == b"[DONE]":
+                continue
+            if self._envelope is not None and not _USAGE_EVENT.search(data):
+                self._content_bytes += max(0, len(data) - self._envelope)
+                continue
+            try:
+                data_obj = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(data_obj, dict):
+                continue
+
+            choices = data_obj.get("choices") or []
+            usage = data_obj.get("usage")
+            content_bytes = 0
+            for choice in choices:
+                # 部分厂商（如 Moonshot）在最后一个 choice 中返回 usage
+                usage = usage or choice.get("usage")
+                delta = choice.get("delta") or {}
+                for field in ("content", "reasoning_content"):
+                    text = delta.get(field)
+                    if isinstance(text, str):
+                        content_bytes += len(text.encode("utf-8"))
+            self._content_bytes += content_bytes
+            if self._envelope is None and content_bytes:
+                self._envelope = len(data) - content_bytes
+            if usage:
+                self.usage = usage
+                if not choices:
+                    keep = not self.strip_usage_chunk
+        return keep
+
+    def result(self) -> Dict[str, Any]:
+        """本次流式响应的用量，上游未返回时为估算值"""
+        if self.usage:
+            return self.usage
+        completion = round(self._content_bytes / 4)
+        if self._content_bytes:
+            completion = max(1, completion)
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": completion,
+            "total_tokens": self.prompt_tokens + completion,
+            "estimated": True,
+        }
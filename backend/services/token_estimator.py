@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，未安装时只使用近似分词
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# 近似分词参数:
+# (每个 CJK 字符的 token 数, 单个 token 覆盖的英文单词字符数, 数字分组长度)
+_PROFILES: Dict[str, Tuple[float, int, int]] = {
+    "openai": (1.0, 8, 3),
+    "claude": (1.2, 6, 3),
+    "gemini": (0.8, 8, 1),
+    # 国内厂商的词表对中文更友好，数字逐位切分
+    "chinese": (0.7, 8, 1),
+    "default": (1.0, 6, 2),
+}
+
+_VENDOR_PROFILES = {
+    "openai": "openai",
+    "groq": "openai",
+    "perplexity": "openai",
+    "mistral": "openai",
+    "claude": "claude",
+    "gemini": "gemini",
+    "qwen": "chinese",
+    "qwen_official": "chinese",
+    "zhipu": "chinese",
+    "deepseek": "chinese",
+    "moonshot": "chinese",
+    "doubao": "chinese",
+    "hunyuan": "chinese",
+    "spark": "chinese",
+    "spark_websocket": "chinese",
+    "minimax": "chinese",
+    "stepfun": "chinese",
+}
+
+# CJK 字符 | 英文单词 | 数字串 | 换行 | 其他非空白字符（空格并入相邻 token）
+_PIECES = re.compile(
+    r"(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])"
+    r"|(?P<word>[A-Za-z]+)|(?P<digits>\d+)|(?P<newline>\n+)|(?P<other>[^\s])"
+)
+
+# 常见模型的上下文长度（按名称前缀匹配，先匹配更具体的前缀），仅用于告警
+_CONTEXT_WINDOWS = [
+    ("gpt-4.1", 1047576),
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4-32k", 32768),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo", 16385),
+    ("o1", 200000),
+    ("o3", 200000),
+    ("o4", 200000),
+    ("claude", 200000),
+    ("gemini-1.5", 1048576),
+    ("gemini-2", 1048576),
+    ("gemini-pro", 32768),
+    ("deepseek", 65536),
+    ("qwen-long", 10000000),
+    ("qwen-max", 32768),
+    ("qwen-plus", 131072),
+    ("qwen-turbo", 131072),
+    ("glm-4", 128000),
+]
+# 名称中带长度后缀的模型，如 moonshot-v1-32k
+_CONTEXT_SUFFIX = re.compile(r"-(\d+)k\b")
+
+# 消息格式开销：每条消息 + 回复前缀
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+
+
+class TokenEstimator:
+    """离线 token 估算 - 发出请求前计算输入 token 数
+
+    OpenAI 模型在安装 tiktoken 时使用 BPE 编码（首次使用时后台加载，
+    加载完成前用近似分词）；其他厂商按字符类别近似估算：
+    CJK 字符、英文单词、数字串分别按厂商参数折算。
+    按 (分词器, 消息内容哈希) 缓存每条消息的 token 数，多轮对话中重复的历史消息
+    只计算一次；同一请求中未命中缓存的消息用 encode_ordinary_batch 批量编码。
+    """
+
+    USE_TIKTOKEN = os.getenv("TOKEN_ESTIMATOR_TIKTOKEN", "true").lower() == "true"
+    CACHE_SIZE = int(os.getenv("TOKEN_ESTIMATOR_CACHE_SIZE", "20000"))
+
+    # (分词器, 内容哈希) -> token 数
+    _cache: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+    # 编码名 -> tiktoken 编码器，加载失败时为 None
+    _encoders: Dict[str, Any] = {}
+    _loading: set = set()
+    _lock = threading.Lock()
+    _stats = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def _bpe_name(
+        cls, vendor: Optional[str], model_name: Optional[str]
+    ) -> Optional[str]:
+        if vendor != "openai" or not model_name:
+            return None
+        if model_name.startswith(("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")):
+            return "o200k_base"
+        return "cl100k_base"
+
+    @classmethod
+    def _get_encoder(cls, name: str):
+        """获取 tiktoken 编码器，未加载时在后台线程加载并返回 None"""
+        if tiktoken is None or not cls.USE_TIKTOKEN:
+            return None
+        encoder = cls._encoders.get(name)
+        if encoder is not None or name in cls._encoders:
+            return encoder
+        with cls._lock:
+            if name in cls._loading:
+                return None
+            cls._loading.add(name)
+        # 加载编码文件可能需要读取磁盘或下载，不在请求路径上等待
+        threading.Thread(target=cls._load_encoder, args=(name,), daemon=True).start()
+        return None
+
+    @classmethod
+    def _load_encoder(cls, name: str):
+        try:
+            cls._encoders[name] = tiktoken.get_encoding(name)
+        except Exception as e:
+            cls._encoders[name] = None
+            logger.warning("tiktoken 编码 %s 加载失败，使用近似分词: %s", name, e)
+
+    @classmethod
+    def approximate(cls, text: str, profile: str = "default") -> int:
+        """按字符类别近似估算 token 数"""
+        cjk_ratio, word_chars, digit_group = _PROFILES.get(
+            profile, _PROFILES["default"]
+        )
+        cjk = 0
+        tokens = 0
+        for match in _PIECES.finditer(text):
+            kind = match.lastgroup
+            if kind == "cjk":
+                cjk += 1
+            elif kind == "word":
+                tokens += 1 + (match.end() - match.start() - 1) // word_chars
+            elif kind == "digits":
+                tokens += math.ceil((match.end() - match.start()) / digit_group)
+            else:
+                tokens += 1
+        return tokens + math.ceil(cjk * cjk_ratio)
+
+    @classmethod
+    def count_messages(
+        cls,
+        vendor: Optional[str],
+        model_name: Optional[str],
+        messages: List[Dict[str, Any]],
+    ) -> int:
+        """估算消息列表的输入 token 数"""
+        bpe_name = cls._bpe_name(vendor, model_name)
+        encoder = cls._get_encoder(bpe_name) if bpe_name else None
+        if encoder is not None:
+            tokenizer = f"bpe:{bpe_name}"
+        else:
+            profile = _VENDOR_PROFILES.get(vendor, "default")
+            tokenizer = f"approx:{profile}"
+
+        counts = []
+        misses = []
+        for message in messages:
+            content = message.get("content")
+            if not isinstance(content, str) or not content:
+                counts.append(0)
+                continue
+            key = (
+                tokenizer,
+                hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest(),
+            )
+            count = cls._cache.get(key)
+            if count is None:
+                misses.append((len(counts), key, content))
+                cls._stats["misses"] += 1
+            else:
+                cls._cache.move_to_end(key)
+                cls._stats["hits"] += 1
+            counts.append(count or 0)
+
+        if misses:
+            if encoder is not None:
+                encoded = encoder.encode_ordinary_batch([m[2] for m in misses])
+                results = [len(tokens) for tokens in encoded]
+            else:
+                results = [cls.approximate(m[2], profile) for m in misses]
+            for (index, key, _), count in zip(misses, results):
+                counts[index] = count
+                cls._cache[key] = count
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+
+        return sum(counts) + _TOKENS_PER_MESSAGE * len(messages) + _TOKENS_PER_REPLY
+
+    @classmethod
+    def context_window(cls, params: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """模型参数 context_window 配置的上下文长度，未配置时返回 None"""
+        value = (params or {}).get("context_window")
+        if value:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                pass
+        return None
+
+    @classmethod
+    def guess_context_window(cls, model_name: str) -> Optional[int]:
+        """按常见模型名推断上下文长度，未知时返回 None
+
+        推断值可能过时，只用于提示，不作为拒绝请求的依据。
+        """
+        name = (model_name or "").lower()
+        suffix = _CONTEXT_SUFFIX.search(name)
+        if suffix:
+            return int(suffix.group(1)) * 1024
+        for prefix, size in _CONTEXT_WINDOWS:
+            if name.startswith(prefix):
+                return size
+        return None
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取缓存统计"""
+        return {
+            **cls._stats,
+            "entries": len(cls._cache),
+            "encoders": sorted(k for k, v in cls._encoders.items() if v is not None),
+        }
@@ -0,0 +1,78 @@
+from typing import Callable, Dict, Optional
+
+
+class VendorAdapter:
+    """厂商适配器 - 单个模型配置预编译后的转发对象
+
+    缓存解析后的请求 URL、静态请求头，以及该厂商的请求构建、响应解析、流式解析函数。
+    每个模型配置创建一次并复用，请求路径上不再查配置或走 if/elif 分支。
+
+    新厂商通过 VendorAdapter.register() 注册处理函数，无需修改网关核心。
+    """
+
+    # 厂商 -> {"request": 构建函数, "response": 解析函数, "stream": 流式解析函数}
+    _registry: Dict[str, Dict[str, Callable]] = {}
+    _default: Dict[str, Callable] = {}
+
+    @classmethod
+    def register(
+        cls,
+        vendor: str,
+        request_builder: Optional[Callable] = None,
+        response_parser: Optional[Callable] = None,
+        stream_parser: Optional[Callable] = None,
+    ):
+        """注册厂商处理函数，未提供的部分使用默认（OpenAI 兼容）实现"""
+        handlers = {}
+        if request_builder:
+            handlers["request"] = request_builder
+        if response_parser:
+            handlers["response"] = response_parser
+        if stream_parser:
+            handlers["stream"] = stream_parser
+        cls._registry[vendor] = handlers
+
+    @classmethod
+    def set_default(
+        cls,
+        request_builder: Callable,
+        response_parser: Callable,
+        stream_parser: Callable,
+    ):
+        """设置默认（OpenAI 兼容）处理函数"""
+        cls._default = {
+            "request": request_builder,
+            "response": response_parser,
+            "stream": stream_parser,
+        }
+
+    @classmethod
+    def get_handlers(cls, vendor: str) -> Dict[str, Callable]:
+        """获取厂商处理函数（已合并默认实现）"""
+        return {**cls._default, **cls._registry.get(vendor, {})}
+
+    @classmethod
+    def is_registered(cls, vendor: str) -> bool:
+        """厂商是否注册了自定义处理函数"""
+        return vendor in cls._registry
+
+    def __init__(
+        self,
+        vendor: str,
+        url: str,
+        headers: Dict[str, str],
+        stream_passthrough: bool = False,
+        stream_usage: bool = False,
+    ):
+        handlers = self.get_handlers(vendor)
+
+        self.vendor = vendor
+        self.url = url
+        self.headers = headers
+        # 上游已是 OpenAI SSE 格式时，流式响应按字节原样转发，不逐行解析
+        self.stream_passthrough = stream_passthrough
+        # 上游支持 stream_options.include_usage，在最后的 chunk 中返回用量
+        self.stream_usage = stream_usage
+        self.build_request: Callable[[Dict], Dict] = handlers["request"]
+        self.parse_response: Callable[[Dict], Dict] = handlers["response"]
+        self.parse_stream_chunk: Callable[[str], Optional[str]] = handlers["stream"]
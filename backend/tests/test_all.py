@@ -239,6 +239,15 @@ class TestDatabase:
         assert "vendor" in dict_without_sensitive
         assert "model_name" in dict_without_sensitive
 
+    def test_run_in_db_uses_executor(self):
+        """数据库调用在专用线程池中执行"""
+        import threading
+        from config.database import run_in_db
+
+        thread_name = asyncio.run(run_in_db(lambda: threading.current_thread().name))
+
+        assert thread_name.startswith("db-worker")
+
 
 class TestGatewayCore:
     """网关核心服务测试"""
@@ -276,7 +285,7 @@ class TestGatewayCore:
     async def test_test_connectivity_success(self):
         """测试连通性测试成功"""
         from services.gateway_core import GatewayCore
-        import httpx
+        from services.http_client_pool import HttpClientPool
         
         # 使用Mock避免真实网络请求
         with patch.object(GatewayCore, 'VENDOR_CONFIGS', {
@@ -287,10 +296,10 @@ class TestGatewayCore:
                 "auth_format": "Bearer"
             }
         }):
-            with patch('httpx.AsyncClient') as mock_client:
+            with patch.object(HttpClientPool, 'get_client') as mock_get_client:
                 mock_response = Mock()
                 mock_response.status_code = 200
-                mock_client.return_value.__aenter__.return_value.post.return_value = mock_response
+                mock_get_client.return_value.post = AsyncMock(return_value=mock_response)
                 
                 result = await GatewayCore.test_connectivity(
                     "test",
@@ -363,6 +372,95 @@ class TestGatewayCore:
         # 由于Claude格式不同，choices可能为空，这是预期行为
         # 实际使用时需要配置正确的response_mapping
 
+    def test_adapter_cached_per_model_config(self):
+        """同一模型配置复用预编译的适配器"""
+        from services.gateway_core import GatewayCore
+
+        a1 = GatewayCore.get_adapter("deepseek", "https://api.deepseek.com/v1", "sk-1")
+        a2 = GatewayCore.get_adapter("deepseek", "https://api.deepseek.com/v1", "sk-1")
+        a3 = GatewayCore.get_adapter("deepseek", "https://api.deepseek.com/v1", "sk-2")
+
+        assert a1 is a2
+        assert a1 is not a3
+        assert a1.url == "https://api.deepseek.com/v1/chat/completions"
+        assert a1.headers["Authorization"] == "Bearer sk-1"
+
+    def test_adapter_uses_vendor_handlers(self):
+        """适配器使用厂商注册的构建与解析函数"""
+        from services.gateway_core import GatewayCore
+
+        adapter = GatewayCore.get_adapter("claude", "https://api.anthropic.com", "k")
+        request = adapter.build_request({
+            "model": "claude-3",
+            "messages": [
+                {"role": "system", "content": "be brief"},
+                {"role": "user", "content": "hi"}
+            ]
+        })
+
+        assert request["system"] == "be brief"
+        assert adapter.headers["anthropic-version"] == "2023-06-01"
+        assert adapter.parse_response == GatewayCore._parse_claude_response
+
+    def test_register_new_vendor(self):
+        """新厂商注册后无需修改网关核心即可使用"""
+        from services.gateway_core import GatewayCore
+        from services.vendor_adapter import VendorAdapter
+
+        VendorAdapter.register(
+            "test_vendor",
+            response_parser=lambda data: {"choices": [], "raw": data},
+        )
+        try:
+            adapter = GatewayCore.get_adapter("test_vendor", "https://x.test", "k")
+
+            assert adapter.parse_response({"a": 1})["raw"] == {"a": 1}
+            # 未注册的部分使用默认 OpenAI 兼容实现
+            assert adapter.build_request({"model": "m", "messages": []})["model"] == "m"
+        finally:
+            VendorAdapter._registry.pop("test_vendor", None)
+
+    def test_stream_passthrough_flags(self):
+        """仅 OpenAI 兼容且无自定义转换的厂商启用流式透传"""
+        from services.gateway_core import GatewayCore
+
+        assert GatewayCore.get_adapter("deepseek", "https://d.test", "k").stream_passthrough
+        assert GatewayCore.get_adapter("groq", "https://g.test", "k").stream_passthrough
+        assert not GatewayCore.get_adapter("claude", "https://c.test", "k").stream_passthrough
+        assert not GatewayCore.get_adapter("qwen", "https://q.test", "k").stream_passthrough
+
+    def test_stream_passthrough_forwards_raw_bytes(self):
+        """透传模式原样转发上游字节，保留 usage 等字段"""
+        import httpx
+        from services.gateway_core import GatewayCore
+        from services.http_client_pool import HttpClientPool
+
+        upstream_body = (
+            b'data: {"id":"c1","choices":[{"delta":{"content":"hi"}}],"system_fingerprint":"fp"}\n\n'
+            b'data: {"id":"c1","choices":[],"usage":{"total_tokens":3}}\n\n'
+            b"data: [DONE]\n\n"
+        )
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, content=upstream_body)
+            )
+        )
+
+        async def collect():
+            chunks = []
+            async for chunk in GatewayCore.stream_request(
+                "deepseek", "https://api.deepseek.com", "k",
+                {"model": "deepseek-chat", "messages": [], "stream": True}
+            ):
+                chunks.append(chunk)
+            await client.aclose()
+            return chunks
+
+        with patch.object(HttpClientPool, "get_client", return_value=client):
+            chunks = asyncio.run(collect())
+
+        assert b"".join(chunks) == upstream_body
+
 
 class TestModelSwitcher:
     """模型切换服务测试"""
@@ -633,6 +731,2130 @@ class TestAPIEndpoints:
         assert response.status_code == 422  # 验证错误
 
 
+class TestHttpClientPool:
+    """上游连接池测试"""
+
+    def test_client_reused_per_host(self):
+        """同一主机复用同一客户端"""
+        from services.http_client_pool import HttpClientPool
+
+        HttpClientPool.open()
+        c1 = HttpClientPool.get_client("https://api.openai.com/v1/chat/completions")
+        c2 = HttpClientPool.get_client("https://api.openai.com/v1/models")
+        c3 = HttpClientPool.get_client("https://api.deepseek.com/chat/completions")
+
+        assert c1 is c2
+        assert c1 is not c3
+        assert HttpClientPool.get_stats()["hosts"] == 2
+
+        asyncio.run(HttpClientPool.close())
+        assert c1.is_closed
+        assert HttpClientPool.get_stats()["hosts"] == 0
+
+    def test_host_key_default_port(self):
+        """默认端口与显式端口视为同一主机"""
+        from services.http_client_pool import HttpClientPool
+
+        assert HttpClientPool._host_key(
+            "https://api.openai.com/v1"
+        ) == HttpClientPool._host_key("https://api.openai.com:443/v1/models")
+        assert HttpClientPool._host_key(
+            "http://localhost:11434/api/chat"
+        ) != HttpClientPool._host_key("http://localhost:8000/api/chat")
+
+    def test_connection_stats_reads_pool(self):
+        """当前 httpx/httpcore 版本下能读取连接池的活跃与空闲连接数"""
+        from services import http_client_pool
+        from services.http_client_pool import HttpClientPool
+
+        assert http_client_pool._POOL_STATS_SUPPORTED
+
+        async def serve(reader, writer):
+            try:
+                while await reader.readuntil(b"\r\n\r\n"):
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+        async def run():
+            server = await asyncio.start_server(serve, "127.0.0.1", 0)
+            url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+            HttpClientPool.open()
+            try:
+                response = await HttpClientPool.get_client(url).get(url)
+                assert response.text == "ok"
+                return HttpClientPool._host_key(url), HttpClientPool.connection_stats()
+            finally:
+                await HttpClientPool.close()
+                server.close()
+
+        key, stats = asyncio.run(run())
+        assert stats == {key: (0, 1)}
+
+    def test_connection_stats_disabled_on_unknown_versions(self):
+        """未验证的版本不读取内部连接池"""
+        from services import http_client_pool
+        from services.http_client_pool import HttpClientPool
+
+        with patch.object(http_client_pool, "_POOL_STATS_SUPPORTED", False), \
+                patch.object(HttpClientPool, "_pool_stats_warned", False), \
+                patch.object(HttpClientPool, "_clients", {"k": Mock()}):
+            assert HttpClientPool.connection_stats() == {}
+            assert HttpClientPool._pool_stats_warned
+
+
+class TestRoutingTable:
+    """内存路由表测试"""
+
+    def test_rebuild_orders_by_priority(self, db_session):
+        """重建后按优先级排序，仅包含启用且连通的模型"""
+        from models.model_config import ModelConfig
+        from services.routing_table import RoutingTable
+
+        models = [
+            ModelConfig(vendor="openai", model_name="rt-low", api_key="k",
+                        priority=-50, status=1, connect_status=1),
+            ModelConfig(vendor="openai", model_name="rt-high", api_key="k",
+                        priority=-100, status=1, connect_status=1),
+            ModelConfig(vendor="openai", model_name="rt-disabled", api_key="k",
+                        priority=-200, status=0, connect_status=1),
+        ]
+        db_session.add_all(models)
+        db_session.commit()
+
+        try:
+            RoutingTable.rebuild(db_session)
+            names = [r.model_name for r in RoutingTable.get_routes()]
+
+            assert names.index("rt-high") < names.index("rt-low")
+            assert "rt-disabled" not in names
+            assert RoutingTable.get_route("rt-low").priority == -50
+            assert RoutingTable.get_route("rt-disabled") is None
+        finally:
+            for m in models:
+                db_session.delete(m)
+            db_session.commit()
+            RoutingTable.rebuild(db_session)
+
+        assert RoutingTable.get_route("rt-low") is None
+
+    def test_reads_never_query_database(self):
+        """读取只访问内存快照，启动时在线程池中构建"""
+        from services.routing_table import RoutingTable
+
+        with patch.object(RoutingTable, "_snapshot", ([], {}, {})), \
+                patch("services.routing_table.SessionLocal",
+                      side_effect=AssertionError("hot path hit the database")):
+            assert RoutingTable.get_routes() == []
+            assert RoutingTable.get_route("m") is None
+            assert RoutingTable.get_models() == {}
+
+        with patch.object(RoutingTable, "rebuild") as rebuild, \
+                patch.object(RoutingTable, "REFRESH_INTERVAL", 0):
+            asyncio.run(RoutingTable.start())
+        rebuild.assert_called_once_with()
+
+
+class TestLogWriter:
+    """异步日志写入测试"""
+
+    def test_flush_on_stop(self, db_session):
+        """停止时刷出队列中剩余日志"""
+        from models.operation_log import OperationLog
+        from services.log_writer import LogWriter
+
+        marker = f"log-writer-test-{datetime.now().timestamp()}"
+
+        async def run():
+            await LogWriter.start()
+            for _ in range(5):
+                await LogWriter.write(log_type=1, model_id=None, log_content=marker)
+            await LogWriter.stop()
+
+        before = LogWriter.get_stats()
+        with patch.object(LogWriter, "FLUSH_INTERVAL", 60.0):
+            asyncio.run(run())
+        after = LogWriter.get_stats()
+
+        rows = db_session.query(OperationLog).filter(
+            OperationLog.log_content == marker
+        ).all()
+        assert len(rows) == 5
+        assert after["queued"] - before["queued"] == 5
+        assert after["flushed"] - before["flushed"] == 5
+
+        for row in rows:
+            db_session.delete(row)
+        db_session.commit()
+
+    def test_drop_when_queue_full(self):
+        """drop 策略下队列满时丢弃并计数"""
+        from services.log_writer import LogWriter
+
+        async def run():
+            LogWriter._queue = asyncio.Queue(maxsize=1)
+            try:
+                await LogWriter.write(log_type=1, model_id=None, log_content="a")
+                await LogWriter.write(log_type=1, model_id=None, log_content="b")
+            finally:
+                LogWriter._queue = None
+
+        before = LogWriter.get_stats()["dropped"]
+        with patch.object(LogWriter, "OVERFLOW_POLICY", "drop"):
+            asyncio.run(run())
+
+        assert LogWriter.get_stats()["dropped"] - before == 1
+
+
+class TestStreamFailover:
+    """流式故障切换测试"""
+
+    @staticmethod
+    def _fake_stream(chunks, delay=0.0):
+        async def stream_request(
+            vendor, api_base, api_key, request_data, on_response=None, usage=None
+        ):
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield chunk
+
+        return stream_request
+
+    def test_open_stream_replays_head(self):
+        """首个内容前的 chunk 会被缓冲并在提交后重放"""
+        from services.gateway_core import GatewayCore
+
+        chunks = [
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n',
+            'data: {"choices": [{"delta": {"content": "hi"}}]}\n\n',
+            "data: [DONE]\n\n",
+        ]
+
+        async def run():
+            stream = await GatewayCore.open_stream("openai", "", "k", {})
+            return [chunk async for chunk in stream]
+
+        with patch.object(GatewayCore, "stream_request", self._fake_stream(chunks)):
+            assert asyncio.run(run()) == chunks
+
+    def test_open_stream_rejects_error_event(self):
+        """内容前出现错误事件时抛出异常"""
+        from services.gateway_core import GatewayCore
+
+        chunks = [f"data: {json.dumps({'error': '请求失败'})}\n\n"]
+        with patch.object(GatewayCore, "stream_request", self._fake_stream(chunks)):
+            with pytest.raises(Exception, match="上游返回错误"):
+                asyncio.run(GatewayCore.open_stream("openai", "", "k", {}))
+
+    def test_open_stream_ttft_timeout(self):
+        """超过首 token 预算时抛出超时"""
+        from services.gateway_core import GatewayCore
+
+        chunks = [b'data: {"choices": [{"delta": {"content": "late"}}]}\n\n']
+        with patch.object(
+            GatewayCore, "stream_request", self._fake_stream(chunks, delay=0.5)
+        ):
+            with pytest.raises(TimeoutError):
+                asyncio.run(
+                    GatewayCore.open_stream("openai", "", "k", {}, ttft_budget=0.05)
+                )
+
+    def test_auto_mode_switches_before_first_token(self):
+        """auto 模式下首个模型失败时切换到下一个模型"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [
+            ModelRoute(1, "openai", "bad", "https://bad.test", None, None, "k", 1),
+            ModelRoute(2, "openai", "good", "https://good.test", None, None, "k", 2),
+        ]
+
+        async def stream_request(
+            vendor, api_base, api_key, request_data, on_response=None, usage=None
+        ):
+            if api_base == "https://bad.test":
+                yield f"data: {json.dumps({'error': '请求失败'})}\n\n"
+            else:
+                yield 'data: {"choices": [{"delta": {"content": "ok"}}]}\n\n'
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}], stream=True
+            )
+            response = await chat_completions(request, authorization="Bearer k")
+            return [chunk async for chunk in response.body_iterator]
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(GatewayCore, "stream_request", stream_request), \
+                patch.object(LogWriter, "write", AsyncMock()) as write:
+            body = asyncio.run(run())
+
+        assert body == ['data: {"choices": [{"delta": {"content": "ok"}}]}\n\n']
+        assert [c.kwargs["log_type"] for c in write.call_args_list] == [3, 1]
+
+    def test_stream_error_after_first_token_logged_as_failure(self):
+        """已开始响应后上游中断：发送错误事件，按失败记录日志与熔断"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.circuit_breaker import CircuitBreaker
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [ModelRoute(1, "openai", "m1", "https://a.test", None, None, "k", 1)]
+
+        async def stream_request(
+            vendor, api_base, api_key, request_data, on_response=None, usage=None
+        ):
+            yield 'data: {"choices": [{"delta": {"content": "par"}}]}\n\n'
+            raise ConnectionError("reset by peer")
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}], stream=True
+            )
+            response = await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+            return [chunk async for chunk in response.body_iterator]
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(GatewayCore, "stream_request", stream_request), \
+                patch.object(CircuitBreaker, "record", AsyncMock()) as record, \
+                patch.object(LogWriter, "write", AsyncMock()) as write:
+            body = asyncio.run(run())
+
+        assert json.loads(body[-1][len("data: "):]) == {"error": "上游流式响应中断"}
+        assert [c.args[1] for c in record.await_args_list] == [False]
+        log = write.call_args_list[-1].kwargs
+        assert log["status"] == 0
+        assert json.loads(log["log_content"])["error"] == "reset by peer"
+
+    def test_stream_records_total_duration_for_circuit(self):
+        """熔断按整个流的耗时记录一次，而不是首 token 时间"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.circuit_breaker import CircuitBreaker
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [ModelRoute(1, "openai", "m1", "https://a.test", None, None, "k", 1)]
+
+        async def stream_request(
+            vendor, api_base, api_key, request_data, on_response=None, usage=None
+        ):
+            yield 'data: {"choices": [{"delta": {"content": "a"}}]}\n\n'
+            await asyncio.sleep(0.1)
+            yield 'data: {"choices": [{"delta": {"content": "b"}}]}\n\n'
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}], stream=True
+            )
+            response = await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+            return [chunk async for chunk in response.body_iterator]
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(GatewayCore, "stream_request", stream_request), \
+                patch.object(CircuitBreaker, "record", AsyncMock()) as record, \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+
+        assert record.await_count == 1
+        _, success, latency = record.await_args.args[:3]
+        assert success is True
+        assert latency >= 0.1
+
+
+class TestHedgePolicy:
+    """对冲请求测试"""
+
+    @staticmethod
+    def _route(model_id):
+        from services.routing_table import ModelRoute
+
+        return ModelRoute(model_id, "openai", f"m{model_id}", "", None, None, "k", model_id)
+
+    @staticmethod
+    def _call(delays, failing=()):
+        calls = []
+
+        async def call(model):
+            calls.append(model.id)
+            await asyncio.sleep(delays[model.id])
+            if model.id in failing:
+                raise Exception(f"model {model.id} failed")
+            return {"id": model.id}
+
+        return call, calls
+
+    def test_histogram_percentile(self):
+        """直方图分位数随样本变化"""
+        from services.hedging import LatencyHistogram
+
+        histogram = LatencyHistogram()
+        assert histogram.percentile(0.95) is None
+        for _ in range(95):
+            histogram.observe(0.1)
+        for _ in range(5):
+            histogram.observe(5.0)
+        assert 0.1 <= histogram.percentile(0.9) < 0.13
+        assert histogram.percentile(0.99) >= 5.0
+
+    def test_delay_from_histogram(self):
+        """样本足够时对冲延迟取历史分位数"""
+        from services.hedging import HedgePolicy
+
+        with patch.object(HedgePolicy, "_histograms", {}):
+            assert HedgePolicy.get_delay(1) == HedgePolicy.DEFAULT_DELAY
+            for _ in range(HedgePolicy.MIN_SAMPLES):
+                HedgePolicy.observe(1, 0.2)
+            assert 0.2 <= HedgePolicy.get_delay(1) < 0.25
+
+    def test_backup_wins_when_primary_slow(self):
+        """主模型超过对冲延迟时由备用模型返回，主请求被取消"""
+        from services.hedging import HedgePolicy
+
+        call, calls = self._call({1: 5.0, 2: 0.01})
+        with patch.object(HedgePolicy, "get_delay", return_value=0.02), \
+                patch.object(HedgePolicy, "_tokens", 5):
+            winner, response, failures = asyncio.run(
+                asyncio.wait_for(
+                    HedgePolicy.run(self._route(1), self._route(2), call), 1
+                )
+            )
+        assert winner.id == 2
+        assert response == {"id": 2}
+        assert failures == []
+        assert calls == [1, 2]
+
+    def test_no_hedge_when_primary_fast(self):
+        """主模型及时返回时不发出对冲请求"""
+        from services.hedging import HedgePolicy
+
+        call, calls = self._call({1: 0.01, 2: 0.01})
+        with patch.object(HedgePolicy, "get_delay", return_value=0.5):
+            winner, _, _ = asyncio.run(
+                HedgePolicy.run(self._route(1), self._route(2), call)
+            )
+        assert winner.id == 1
+        assert calls == [1]
+
+    def test_budget_limits_hedges(self):
+        """令牌耗尽时不再对冲，等待主模型返回"""
+        from services.hedging import HedgePolicy
+
+        call, calls = self._call({1: 0.05, 2: 0.01}, failing={1})
+        with patch.object(HedgePolicy, "get_delay", return_value=0.01), \
+                patch.object(HedgePolicy, "_tokens", 0), \
+                patch.object(HedgePolicy, "BUDGET_RATIO", 0.1):
+            winner, _, failures = asyncio.run(
+                HedgePolicy.run(self._route(1), self._route(2), call)
+            )
+        assert winner is None
+        assert [m.id for m, _ in failures] == [1]
+        assert calls == [1]
+
+
+class TestResponseCache:
+    """精确匹配响应缓存测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_cache(self):
+        from services.response_cache import ResponseCache
+
+        ResponseCache.clear()
+        yield
+        ResponseCache.clear()
+
+    def test_key_is_canonical(self):
+        """键与字段顺序无关，与模型和参数相关"""
+        from services.response_cache import ResponseCache
+
+        a = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+        b = {"temperature": 0, "messages": [{"content": "hi", "role": "user"}], "model": "m"}
+        assert ResponseCache.make_key(1, a) == ResponseCache.make_key(1, b)
+        assert ResponseCache.make_key(1, a) != ResponseCache.make_key(2, a)
+        assert ResponseCache.make_key(1, a) != ResponseCache.make_key(1, {**a, "max_tokens": 5})
+
+    def test_cacheable_rules(self):
+        """默认只缓存 temperature=0，可通过 Cache-Control 关闭"""
+        from services.response_cache import ResponseCache
+
+        assert ResponseCache.is_cacheable(0)
+        assert not ResponseCache.is_cacheable(0.7)
+        assert not ResponseCache.is_cacheable(None)
+        assert not ResponseCache.is_cacheable(0, "no-cache")
+
+    def test_lru_eviction_and_ttl(self):
+        """超过条目上限淘汰最久未使用的条目，过期条目视为未命中"""
+        from services.response_cache import ResponseCache
+
+        with patch.object(ResponseCache, "MAX_ENTRIES", 2):
+            ResponseCache.put("a", {"v": 1})
+            ResponseCache.put("b", {"v": 2})
+            assert ResponseCache.get("a") == {"v": 1}
+            ResponseCache.put("c", {"v": 3})
+            assert ResponseCache.get("b") is None
+            assert ResponseCache.get("a") == {"v": 1}
+
+        with patch.object(ResponseCache, "TTL", -1):
+            ResponseCache.put("d", {"v": 4})
+        assert ResponseCache.get("d") is None
+
+    def test_memory_cap(self):
+        """超过内存上限时淘汰旧条目"""
+        from services.response_cache import ResponseCache
+
+        with patch.object(ResponseCache, "MAX_BYTES", 60):
+            ResponseCache.put("a", {"text": "x" * 30})
+            ResponseCache.put("b", {"text": "y" * 30})
+            assert ResponseCache.get("a") is None
+            assert ResponseCache.get("b") == {"text": "y" * 30}
+            assert ResponseCache.get_stats()["bytes"] <= 60
+
+    def test_hit_skips_upstream_and_logs_cached(self):
+        """命中缓存不请求上游，日志标记 cached"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [ModelRoute(1, "openai", "m1", "https://a.test", None, None, "k", 1)]
+        upstream = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto",
+                messages=[{"role": "user", "content": "classify"}],
+                temperature=0,
+            )
+            headers = {"authorization": "Bearer k", "x_hedge": None, "cache_control": None}
+            first = await chat_completions(request, **headers)
+            second = await chat_completions(request, **headers)
+            return first, second
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()) as write:
+            first, second = asyncio.run(run())
+
+        assert first == second
+        assert upstream.await_count == 1
+        logged = [json.loads(c.kwargs["log_content"]) for c in write.call_args_list]
+        assert [entry["cached"] for entry in logged] == [False, True]
+
+
+class TestSemanticCache:
+    """语义缓存测试"""
+
+    @pytest.fixture(autouse=True)
+    def semantic_cache(self, tmp_path):
+        pytest.importorskip("numpy")
+        from services.semantic_cache import SemanticCache
+
+        with patch.object(SemanticCache, "ENABLED", True), \
+                patch.object(SemanticCache, "PATH", str(tmp_path / "semantic.npz")), \
+                patch.object(SemanticCache, "MAX_ENTRIES", 3):
+            SemanticCache._reset(3)
+            yield SemanticCache
+            SemanticCache._vectors = None
+
+    @staticmethod
+    def _request(content, **params):
+        return {"model": "m", "messages": [{"role": "user", "content": content}], **params}
+
+    def test_near_duplicate_hits(self, semantic_cache):
+        """近似重复的提示词命中，不相关的提示词未命中"""
+        base = semantic_cache.prepare(
+            self._request("请把下面这句话分类为正面或负面：这家餐厅的服务非常好", temperature=0)
+        )
+        near = semantic_cache.prepare(
+            self._request("请把下面这句话分类为正面或负面： 这家餐厅的服务非常好！", temperature=0)
+        )
+        flipped = semantic_cache.prepare(
+            self._request("请把下面这句话分类为正面或负面：这家餐厅的服务非常差", temperature=0)
+        )
+        other = semantic_cache.prepare(
+            self._request("Write a haiku about autumn leaves", temperature=0)
+        )
+        semantic_cache.put(1, base, {"answer": "正面"})
+
+        assert semantic_cache.get(1, near) == {"answer": "正面"}
+        assert semantic_cache.get(1, flipped) is None
+        assert semantic_cache.get(1, other) is None
+        assert semantic_cache.get(2, near) is None
+        assert semantic_cache.get(1, near, threshold=1.01) is None
+
+    def test_sampling_params_must_match(self, semantic_cache):
+        """采样参数不同的请求不共享缓存"""
+        semantic_cache.put(1, semantic_cache.prepare(self._request("hi", temperature=0)), {"a": 1})
+        assert semantic_cache.get(
+            1, semantic_cache.prepare(self._request("hi", temperature=0, max_tokens=5))
+        ) is None
+
+    def test_eviction_bounded(self, semantic_cache):
+        """容量满时淘汰最久未使用的条目"""
+        queries = [
+            semantic_cache.prepare(self._request(text, temperature=0))
+            for text in ("alpha beta", "gamma delta", "epsilon zeta", "eta theta")
+        ]
+        for i, query in enumerate(queries[:3]):
+            semantic_cache.put(1, query, {"i": i})
+        assert semantic_cache.get(1, queries[0]) == {"i": 0}
+        semantic_cache.put(1, queries[3], {"i": 3})
+
+        assert semantic_cache.get_stats()["entries"] == 3
+        assert semantic_cache.get(1, queries[1]) is None
+        assert semantic_cache.get(1, queries[0]) == {"i": 0}
+
+    def test_persistence_roundtrip(self, semantic_cache):
+        """保存后重新加载仍可命中"""
+        query = semantic_cache.prepare(self._request("持久化测试", temperature=0))
+        semantic_cache.put(7, query, {"answer": "ok"})
+        asyncio.run(semantic_cache.save())
+
+        semantic_cache._reset(3)
+        assert semantic_cache.get(7, query) is None
+        semantic_cache.load()
+        assert semantic_cache.get(7, query) == {"answer": "ok"}
+
+
+class TestCredentialCache:
+    """凭据缓存测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_cache(self):
+        from services.credential_cache import CredentialCache
+
+        CredentialCache.invalidate()
+        yield
+        CredentialCache.invalidate()
+
+    def test_decrypt_once(self):
+        """同一模型的 Key 只解密一次"""
+        from config.encryption import encrypt_api_key
+        from services import credential_cache
+        from services.credential_cache import CredentialCache
+
+        encrypted = encrypt_api_key("sk-secret")
+        with patch.object(
+            credential_cache, "decrypt_api_key", wraps=credential_cache.decrypt_api_key
+        ) as decrypt:
+            assert CredentialCache.get(1, encrypted) == "sk-secret"
+            assert CredentialCache.get(1, encrypted) == "sk-secret"
+        assert decrypt.call_count == 1
+
+    def test_plaintext_fallback(self):
+        """明文存储的 Key 原样返回"""
+        from services.credential_cache import CredentialCache
+
+        assert CredentialCache.get(1, "sk-plain-key") == "sk-plain-key"
+        assert CredentialCache.get(2, None) is None
+
+    def test_refresh_on_change_and_invalidate(self):
+        """数据库中的值变化或显式失效后重新解密"""
+        from config.encryption import encrypt_api_key
+        from services.credential_cache import CredentialCache
+
+        assert CredentialCache.get(1, encrypt_api_key("old")) == "old"
+        assert CredentialCache.get(1, encrypt_api_key("new")) == "new"
+
+        CredentialCache.invalidate(1)
+        assert 1 not in CredentialCache._secrets
+
+
+class TestSingleFlight:
+    """请求合并测试"""
+
+    def test_identical_requests_share_one_call(self):
+        """并发的相同请求只调用一次上游，每个等待方拿到独立副本"""
+        from services.single_flight import SingleFlight
+
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"choices": [{"message": {"content": "ok"}}]}
+
+        async def run():
+            return await asyncio.gather(
+                *(SingleFlight.run("k", upstream) for _ in range(5))
+            )
+
+        results = asyncio.run(run())
+        assert len(calls) == 1
+        assert all(r == results[0] for r in results)
+        results[0]["choices"].clear()
+        assert results[1]["choices"]
+        assert SingleFlight.get_stats()["inflight"] == 0
+
+    def test_error_propagates_to_all_waiters(self):
+        """上游失败时所有等待方都收到异常"""
+        from services.single_flight import SingleFlight
+
+        async def upstream():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def run():
+            return await asyncio.gather(
+                *(SingleFlight.run("err", upstream) for _ in range(3)),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, ValueError) for r in results)
+
+    def test_cancel_only_when_all_waiters_leave(self):
+        """单个等待方取消不影响其他方，全部取消后上游调用被取消"""
+        from services.single_flight import SingleFlight
+
+        async def upstream():
+            await asyncio.sleep(0.05)
+            return {"ok": True}
+
+        async def run():
+            first = asyncio.create_task(SingleFlight.run("c", upstream))
+            second = asyncio.create_task(SingleFlight.run("c", upstream))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            result = await second
+
+            third = asyncio.create_task(SingleFlight.run("d", upstream))
+            await asyncio.sleep(0.01)
+            shared = SingleFlight._inflight["d"][0]
+            third.cancel()
+            await asyncio.sleep(0)
+            return result, shared
+
+        result, shared = asyncio.run(run())
+        assert result == {"ok": True}
+        assert shared.cancelled()
+
+
+class TestCircuitBreaker:
+    """模型熔断器测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_circuits(self):
+        from services.circuit_breaker import CircuitBreaker
+
+        with patch.object(CircuitBreaker, "_circuits", {}), \
+                patch.object(CircuitBreaker, "ENABLED", True), \
+                patch.object(CircuitBreaker, "MIN_REQUESTS", 4):
+            yield CircuitBreaker
+
+    @staticmethod
+    def _route(model_id=1):
+        from services.routing_table import ModelRoute
+
+        return ModelRoute(model_id, "openai", f"m{model_id}", "https://a.test", None, None, "k", 1)
+
+    def test_opens_on_error_rate_and_logs_switch(self, clean_circuits):
+        """错误率超过阈值时熔断并写入切换日志"""
+        from services.log_writer import LogWriter
+
+        route = self._route()
+
+        async def run():
+            for success in (True, False, False, False):
+                await clean_circuits.record(route, success, 0.1)
+
+        with patch.object(LogWriter, "write", AsyncMock()) as write:
+            asyncio.run(run())
+
+        assert not clean_circuits.allow(1)
+        assert write.call_args.kwargs["log_type"] == 2
+        content = json.loads(write.call_args.kwargs["log_content"])
+        assert content["circuit"] == {"from": "closed", "to": "open"}
+
+    def test_opens_on_slow_calls(self, clean_circuits):
+        """慢调用比例超过阈值时熔断"""
+        from services.log_writer import LogWriter
+
+        route = self._route()
+
+        async def run():
+            for _ in range(4):
+                await clean_circuits.record(route, True, clean_circuits.SLOW_CALL_SECONDS)
+
+        with patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+        assert not clean_circuits.allow(1)
+
+    def test_half_open_probe(self, clean_circuits):
+        """熔断时间到后探测，失败保持熔断，成功恢复"""
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import RoutingTable
+
+        route = self._route()
+
+        async def run():
+            for _ in range(4):
+                await clean_circuits.record(route, False, 0.1)
+            with patch.object(
+                GatewayCore, "sync_request", AsyncMock(side_effect=Exception("down"))
+            ):
+                await clean_circuits.probe_due()
+            still_open = not clean_circuits.allow(1)
+            with patch.object(GatewayCore, "sync_request", AsyncMock(return_value={})):
+                await clean_circuits.probe_due()
+            return still_open
+
+        with patch.object(clean_circuits, "OPEN_DURATION", 0), \
+                patch.object(RoutingTable, "get_routes", return_value=[route]), \
+                patch.object(LogWriter, "write", AsyncMock()) as write:
+            assert asyncio.run(run())
+
+        assert clean_circuits.allow(1)
+        content = json.loads(write.call_args.kwargs["log_content"])
+        assert content["circuit"] == {"from": "open", "to": "closed"}
+
+    def test_client_errors_not_counted(self, clean_circuits):
+        """上游 4xx 不计入错误率，5xx 与连接错误计入"""
+        import httpx
+        from services.gateway_core import UpstreamError
+        from services.log_writer import LogWriter
+
+        route = self._route()
+
+        async def run():
+            for _ in range(4):
+                await clean_circuits.record(
+                    route, False, 0.1, UpstreamError(400, "context length")
+                )
+            assert clean_circuits.allow(1)
+            await clean_circuits.record(route, False, 0.1, UpstreamError(502, "bad"))
+            await clean_circuits.record(route, False, 0.1, httpx.ConnectError("x"))
+            await clean_circuits.record(route, False, 0.1, TimeoutError())
+            await clean_circuits.record(route, False, 0.1, UpstreamError(503, "x"))
+
+        with patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+        assert not clean_circuits.allow(1)
+
+    def test_probe_prunes_removed_models(self, clean_circuits):
+        """探测时移除不在路由表中的模型，并使用路由表中的最新配置"""
+        from dataclasses import replace
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import RoutingTable
+
+        removed, kept = self._route(1), self._route(2)
+        updated = replace(kept, api_base="https://new.test")
+        upstream = AsyncMock(return_value={})
+
+        async def run():
+            for route in (removed, kept):
+                for _ in range(4):
+                    await clean_circuits.record(route, False, 0.1)
+            await clean_circuits.probe_due()
+
+        with patch.object(clean_circuits, "OPEN_DURATION", 0), \
+                patch.object(RoutingTable, "get_routes", return_value=[updated]), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+
+        assert list(clean_circuits._circuits) == [2]
+        assert upstream.await_count == 1
+        assert upstream.await_args.args[1] == "https://new.test"
+
+    def test_auto_mode_skips_open_circuit(self, clean_circuits):
+        """auto 模式跳过熔断中的模型"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import RoutingTable
+
+        routes = [self._route(1), self._route(2)]
+        upstream = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+
+        async def run():
+            for _ in range(4):
+                await clean_circuits.record(routes[0], False, 0.1)
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}]
+            )
+            return await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+
+        assert upstream.await_count == 1
+        assert upstream.await_args.args[3]["model"] == "m2"
+
+
+class TestRoutingStrategy:
+    """路由策略测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_stats(self):
+        from services.routing_strategy import RoutingStats, RoutingStrategy
+
+        with patch.object(RoutingStats, "_loads", {}), \
+                patch.object(RoutingStrategy, "_wrr_current", {}):
+            yield
+
+    @staticmethod
+    def _routes(weights=(1, 1, 1)):
+        from services.routing_table import ModelRoute
+
+        return [
+            ModelRoute(i + 1, "openai", f"m{i + 1}", "", None, None, "k", i + 1, {"weight": w})
+            for i, w in enumerate(weights)
+        ]
+
+    def test_priority_is_default(self):
+        """默认保持静态优先级顺序"""
+        from services.routing_strategy import RoutingStrategy
+
+        routes = self._routes()
+        assert RoutingStrategy.order(routes, "priority") == routes
+        assert RoutingStrategy.order(routes, "unknown") == routes
+
+    def test_weighted_round_robin(self):
+        """按权重比例分配首选模型，且分布平滑"""
+        from services.routing_strategy import RoutingStrategy
+
+        routes = self._routes((5, 1, 1))
+        picks = [RoutingStrategy.order(routes, "weighted_round_robin")[0].id for _ in range(7)]
+        assert picks.count(1) == 5
+        assert picks.count(2) == 1 and picks.count(3) == 1
+        assert picks[:2] != [1, 1] or picks[2] != 1
+
+    def test_least_outstanding(self):
+        """进行中请求最少的模型优先，失败后仍可切换到其余模型"""
+        from services.routing_strategy import RoutingStats, RoutingStrategy
+
+        routes = self._routes()
+        RoutingStats.acquire(1)
+        RoutingStats.acquire(1)
+        RoutingStats.acquire(2)
+        order = RoutingStrategy.order(routes, "least_outstanding")
+        assert [r.id for r in order] == [3, 2, 1]
+
+        RoutingStats.release(1)
+        RoutingStats.release(1)
+        assert RoutingStats.outstanding(1) == 0
+
+    def test_p2c_prefers_lower_ewma(self):
+        """两个候选中选择延迟 EWMA 较低的模型"""
+        from services.routing_strategy import RoutingStats, RoutingStrategy
+
+        routes = self._routes((1, 1))
+        RoutingStats.observe(1, 2.0)
+        RoutingStats.observe(2, 0.1)
+        for _ in range(5):
+            order = RoutingStrategy.order(routes, "p2c_ewma")
+            assert [r.id for r in order] == [2, 1]
+
+        RoutingStats.observe(2, 0.1, success=False)
+        assert RoutingStats.ewma(2) > 1.0
+
+
+class TestRateLimiter:
+    """本地限流测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_limits(self):
+        from services.rate_limiter import RateLimiter
+
+        with patch.object(RateLimiter, "_keys", {}), \
+                patch.object(RateLimiter, "_models", {}):
+            yield RateLimiter
+
+    @staticmethod
+    def _route(model_id, **params):
+        from services.routing_table import ModelRoute
+
+        return ModelRoute(
+            model_id, "openai", f"m{model_id}", f"https://m{model_id}.test",
+            None, None, "k", model_id, params,
+        )
+
+    def test_token_bucket_queues_then_rejects(self):
+        """令牌不足时在期限内排队，超过期限拒绝"""
+        from services.rate_limiter import TokenBucket
+
+        bucket = TokenBucket(rate=10, capacity=1)
+        now = bucket.updated
+        assert bucket.wait_time(1, now) == 0
+        bucket.take(1)
+        assert bucket.wait_time(1, now) == pytest.approx(0.1)
+        bucket.take(1)
+        # 预约式扣减：后到的请求排在前一个之后
+        assert bucket.wait_time(1, now) == pytest.approx(0.2)
+
+    def test_key_limit(self, clean_limits):
+        """网关 Key 超过请求速率时返回限流异常"""
+        import time
+        from services.rate_limiter import RateLimitExceeded
+
+        async def run():
+            await clean_limits.acquire_key("k", 10, 0)
+            started = time.perf_counter()
+            await clean_limits.acquire_key("k", 10, 1)
+            waited = time.perf_counter() - started
+            with pytest.raises(RateLimitExceeded) as exc:
+                await clean_limits.acquire_key("k", 10, 0)
+            return waited, exc.value
+
+        with patch.object(clean_limits, "KEY_RPS", 20), \
+                patch.object(clean_limits, "KEY_BURST", 1):
+            waited, error = asyncio.run(run())
+        assert waited >= 0.04
+        assert error.retry_after > 0
+
+    def test_model_tpm_settles_with_usage(self, clean_limits):
+        """模型 token 桶按估算值预扣，按实际 usage 结算"""
+        route = self._route(1, rate_limit_tpm=600)
+
+        asyncio.run(clean_limits.acquire_model(route, 500, 0))
+        limit = clean_limits._models[1]
+        assert limit.tokens.tokens == pytest.approx(100, abs=1)
+        clean_limits.settle_model(1, 500, {"total_tokens": 50})
+        assert limit.tokens.tokens == pytest.approx(550, abs=1)
+
+    def test_upstream_headers(self, clean_limits):
+        """上游 429 的 Retry-After 及剩余额度为 0 时暂停模型"""
+        from services.rate_limiter import RateLimitExceeded, _parse_duration
+
+        assert _parse_duration("1m30s") == 90
+        assert _parse_duration("20ms") == pytest.approx(0.02)
+
+        clean_limits.observe_upstream(1, 429, {"retry-after": "7"})
+        with pytest.raises(RateLimitExceeded) as exc:
+            asyncio.run(clean_limits.acquire_model(self._route(1), 10, 0))
+        assert exc.value.retry_after == pytest.approx(7, abs=0.5)
+
+        clean_limits.observe_upstream(
+            2,
+            200,
+            {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"},
+        )
+        with pytest.raises(RateLimitExceeded):
+            asyncio.run(clean_limits.acquire_model(self._route(2), 10, 0))
+
+    def test_chat_completions_skips_throttled_model(self, clean_limits):
+        """auto 模式跳过被限流的模型；指定模型时返回 429"""
+        from fastapi import HTTPException
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import RoutingTable
+
+        routes = [self._route(1), self._route(2)]
+        upstream = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+        clean_limits.observe_upstream(1, 429, {"retry-after": "30"})
+
+        async def call(model):
+            request = ChatCompletionRequest(
+                model=model, messages=[{"role": "user", "content": "hi"}]
+            )
+            return await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(RoutingTable, "get_route", return_value=routes[0]), \
+                patch.object(clean_limits, "MAX_WAIT", 0.1), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()) as write:
+            asyncio.run(call("auto"))
+            with pytest.raises(HTTPException) as exc:
+                asyncio.run(call("m1"))
+
+        assert upstream.await_count == 1
+        assert upstream.await_args.args[3]["model"] == "m2"
+        assert [c.kwargs["log_type"] for c in write.call_args_list] == [1]
+        assert exc.value.status_code == 429
+        assert exc.value.headers["Retry-After"] == "30"
+
+    def test_cached_response_bypasses_key_limit(self, clean_limits):
+        """达到网关 Key 限流的请求命中缓存时仍返回，不占用令牌"""
+        from fastapi import HTTPException
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.response_cache import ResponseCache
+        from services.routing_table import RoutingTable
+
+        routes = [self._route(1)]
+        upstream = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+
+        async def call(content):
+            request = ChatCompletionRequest(
+                model="auto",
+                messages=[{"role": "user", "content": content}],
+                temperature=0,
+            )
+            return await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+
+        ResponseCache.clear()
+        try:
+            with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                    patch.object(clean_limits, "KEY_RPS", 0.01), \
+                    patch.object(clean_limits, "KEY_BURST", 1), \
+                    patch.object(clean_limits, "MAX_WAIT", 0), \
+                    patch.object(GatewayCore, "sync_request", upstream), \
+                    patch.object(LogWriter, "write", AsyncMock()):
+                first = asyncio.run(call("cached"))
+                with pytest.raises(HTTPException) as exc:
+                    asyncio.run(call("other"))
+                second = asyncio.run(call("cached"))
+        finally:
+            ResponseCache.clear()
+
+        assert exc.value.status_code == 429
+        assert second == first
+        assert upstream.await_count == 1
+
+    def test_key_tokens_refunded_when_all_models_fail(self, clean_limits):
+        """所有模型失败时返还网关 Key 预扣的 token"""
+        from fastapi import HTTPException
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import RoutingTable
+
+        routes = [self._route(1), self._route(2)]
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}]
+            )
+            with pytest.raises(HTTPException):
+                await chat_completions(
+                    request, authorization="Bearer k", x_hedge=None, cache_control=None
+                )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(clean_limits, "KEY_TPM", 6000), \
+                patch.object(GatewayCore, "sync_request",
+                             AsyncMock(side_effect=Exception("down"))), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+
+        tokens = clean_limits._keys["k"].tokens
+        assert tokens.tokens == pytest.approx(tokens.capacity, abs=1)
+
+
+class TestQuotaTracker:
+    """实时额度统计测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_tracker(self):
+        from services.quota_tracker import QuotaTracker
+
+        with patch.object(QuotaTracker, "_pending", {}), \
+                patch.object(QuotaTracker, "_exhausted", set()), \
+                patch.object(QuotaTracker, "_remaining", {}), \
+                patch.object(QuotaTracker, "_loaded", True):
+            yield QuotaTracker
+
+    def test_record_accumulates_in_memory(self, clean_tracker):
+        """用量只在内存中累加，缺少 total_tokens 时按输入+输出计算"""
+        clean_tracker.record(1, {"total_tokens": 30})
+        clean_tracker.record(1, {"prompt_tokens": 5, "completion_tokens": 7})
+        clean_tracker.record(1, {})
+        clean_tracker.record(2, None)
+        assert clean_tracker._pending == {1: 42}
+
+    def test_flush_updates_quota_and_excludes_model(self, db_session, clean_tracker):
+        """批量写入后重算 used_ratio，达到切换阈值的模型移出轮换"""
+        from models.model_config import ModelConfig
+        from models.quota_stat import QuotaStat
+        from services.log_writer import LogWriter
+
+        model = ModelConfig(vendor="openai", model_name="quota-test", priority=1)
+        db_session.add(model)
+        db_session.commit()
+        db_session.add(QuotaStat(model_id=model.id, total_quota=1000, used_quota=0))
+        db_session.commit()
+
+        try:
+            clean_tracker.record(model.id, {"total_tokens": 995})
+            with patch.object(LogWriter, "write", AsyncMock()) as write:
+                asyncio.run(clean_tracker.flush())
+
+            db_session.expire_all()
+            stat = db_session.query(QuotaStat).filter_by(model_id=model.id).one()
+            assert stat.used_quota == 995
+            assert stat.remain_quota == 5
+            assert stat.used_ratio == pytest.approx(99.5)
+            assert db_session.get(ModelConfig, model.id).quota_status == 0
+            assert not clean_tracker.allow(model.id)
+            assert clean_tracker._pending == {}
+            assert write.await_args.kwargs["log_type"] == 2
+        finally:
+            db_session.query(QuotaStat).filter_by(model_id=model.id).delete()
+            db_session.delete(model)
+            db_session.commit()
+
+    def test_auto_mode_skips_exhausted_model(self, clean_tracker):
+        """auto 模式跳过额度达到阈值的模型，并统计上游用量"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [
+            ModelRoute(1, "openai", "m1", "https://a.test", None, None, "k", 1),
+            ModelRoute(2, "openai", "m2", "https://b.test", None, None, "k", 2),
+        ]
+        upstream = AsyncMock(
+            return_value={
+                "choices": [{"message": {"content": "ok"}}],
+                "usage": {"total_tokens": 12},
+            }
+        )
+        clean_tracker._exhausted.add(1)
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}]
+            )
+            return await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+
+        assert upstream.await_args.args[3]["model"] == "m2"
+        assert clean_tracker._pending == {2: 12}
+
+
+class TestStreamUsage:
+    """流式用量统计测试"""
+
+    USAGE = {"prompt_tokens": 9, "completion_tokens": 2, "total_tokens": 11}
+
+    def _events(self):
+        return [
+            'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n',
+            'data: {"choices": [{"delta": {"content": "lo"}}]}\n\n',
+            f'data: {json.dumps({"choices": [], "usage": self.USAGE})}\n\n',
+            "data: [DONE]\n\n",
+        ]
+
+    def test_reads_final_usage_chunk_across_chunk_boundaries(self):
+        """字节流在事件中间断开时仍能解析最后的 usage chunk"""
+        from services.stream_usage import StreamUsage
+
+        raw = "".join(self._events()).encode()
+        usage = StreamUsage()
+        out = [usage.feed(raw[i:i + 7]) for i in range(0, len(raw), 7)]
+        out.append(usage.flush())
+
+        assert b"".join(out) == raw
+        assert usage.result() == self.USAGE
+        # 只保留未结束的事件
+        assert usage._buffer == b""
+
+    def test_strip_usage_chunk(self):
+        """网关代为请求 usage 时不转发只含 usage 的 chunk"""
+        from services.stream_usage import StreamUsage
+
+        events = self._events()
+        usage = StreamUsage(strip_usage_chunk=True)
+        out = "".join(usage.feed(event) for event in events) + usage.flush()
+
+        assert out == events[0] + events[1] + events[3]
+        assert usage.result() == self.USAGE
+
+    def test_estimates_without_upstream_usage(self):
+        """上游未返回 usage 时按 delta 估算输出 token"""
+        from services.stream_usage import StreamUsage
+
+        events = self._events()[:2] + [
+            'data: {"choices": [{"delta": {"content": "你好世界"}}]}\n\n',
+            "data: [DONE]\n\n",
+        ]
+        usage = StreamUsage(prompt_tokens=5)
+        with patch.object(json, "loads", wraps=json.loads) as loads:
+            for event in events:
+                usage.feed(event)
+        result = usage.result()
+
+        # 只解析首个内容事件，之后按 data 长度估算（3 + 2 + 12 字节）
+        assert loads.call_count == 1
+        assert result["estimated"] is True
+        assert result["completion_tokens"] == 4
+        assert result["total_tokens"] == 9
+
+    def test_skips_null_usage_chunks(self):
+        """include_usage 时每个 chunk 带 "usage": null，只解析首个内容事件与最后的 usage"""
+        from services.stream_usage import StreamUsage
+
+        chunks = [
+            f'data: {{"choices": [{{"delta": {{"content": "t{i}"}}}}], '
+            f'"usage": null}}\n\n'.encode()
+            for i in range(100)
+        ]
+        chunks.append(
+            f'data: {json.dumps({"choices": [], "usage": self.USAGE})}\n\n'.encode()
+        )
+        usage = StreamUsage(strip_usage_chunk=True)
+        with patch.object(json, "loads", wraps=json.loads) as loads:
+            out = [usage.feed(chunk) for chunk in chunks]
+
+        assert loads.call_count == 2
+        # 完整事件组成的 chunk 原样转发，只去掉只含 usage 的 chunk
+        assert all(a is b for a, b in zip(out[:-1], chunks))
+        assert out[-1] == b""
+        assert usage.result() == self.USAGE
+
+    def test_stream_request_requests_include_usage(self):
+        """支持的上游自动请求 include_usage，用量不转发给客户端"""
+        import httpx
+        from services.gateway_core import GatewayCore
+        from services.http_client_pool import HttpClientPool
+        from services.stream_usage import StreamUsage
+
+        body = "".join(self._events()).encode()
+        sent = {}
+
+        def handler(request):
+            sent.update(json.loads(request.content))
+            return httpx.Response(200, content=body)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        usage = StreamUsage()
+
+        async def run():
+            chunks = [
+                chunk
+                async for chunk in GatewayCore.stream_request(
+                    "openai",
+                    "https://usage.test/v1",
+                    "k",
+                    {"model": "m", "messages": [], "stream": True},
+                    usage=usage,
+                )
+            ]
+            await client.aclose()
+            return b"".join(chunks)
+
+        with patch.object(HttpClientPool, "get_client", return_value=client):
+            forwarded = asyncio.run(run())
+
+        assert sent["stream_options"] == {"include_usage": True}
+        assert b'"usage"' not in forwarded
+        assert forwarded.endswith(b"data: [DONE]\n\n")
+        assert usage.result() == self.USAGE
+
+
+class TestTokenEstimator:
+    """离线 token 估算测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_cache(self):
+        from collections import OrderedDict
+        from services.token_estimator import TokenEstimator
+
+        with patch.object(TokenEstimator, "_cache", OrderedDict()), \
+                patch.object(TokenEstimator, "_encoders", {}), \
+                patch.object(TokenEstimator, "_loading", set()):
+            yield TokenEstimator
+
+    def test_approximate_profiles(self, clean_cache):
+        """中文词表的厂商对 CJK 文本估算更少的 token"""
+        text = "你好，请介绍一下大语言模型的工作原理。"
+        assert clean_cache.approximate(text, "chinese") < clean_cache.approximate(
+            text, "openai"
+        )
+        assert clean_cache.approximate("hello world", "openai") == 2
+        assert clean_cache.approximate("") == 0
+
+    def test_memoizes_per_message_content(self, clean_cache):
+        """多轮对话中重复的历史消息只计算一次"""
+        history = [{"role": "user", "content": "hello there"}]
+        first = clean_cache.count_messages("qwen", "qwen-turbo", history)
+        with patch.object(clean_cache, "approximate", wraps=clean_cache.approximate) as approx:
+            second = clean_cache.count_messages(
+                "qwen", "qwen-turbo", history + [{"role": "user", "content": "more"}]
+            )
+        assert approx.call_count == 1
+        assert second > first
+
+    def test_bpe_encoder_batches_misses(self, clean_cache):
+        """已加载 BPE 编码器时批量编码未命中缓存的消息"""
+        encoder = Mock()
+        encoder.encode_ordinary_batch.side_effect = lambda texts: [[0] * 5 for _ in texts]
+        clean_cache._encoders["cl100k_base"] = encoder
+
+        with patch("services.token_estimator.tiktoken", Mock()):
+            count = clean_cache.count_messages(
+                "openai",
+                "gpt-4",
+                [{"role": "system", "content": "a"}, {"role": "user", "content": "b"}],
+            )
+
+        encoder.encode_ordinary_batch.assert_called_once_with(["a", "b"])
+        assert count == 5 * 2 + 4 * 2 + 3
+
+    def test_context_window(self, clean_cache):
+        assert clean_cache.context_window({"context_window": 4096}) == 4096
+        assert clean_cache.context_window({}) is None
+        assert clean_cache.guess_context_window("moonshot-v1-32k") == 32768
+        assert clean_cache.guess_context_window("gpt-4o-mini") == 128000
+        assert clean_cache.guess_context_window("unknown-model") is None
+
+    def test_chat_completions_checks_before_network(self, clean_cache):
+        """超出上下文长度或剩余额度的模型在发出请求前被跳过或拒绝"""
+        from fastapi import HTTPException
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.quota_tracker import QuotaTracker
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [
+            ModelRoute(1, "openai", "small", "https://a.test", None, None, "k", 1,
+                       {"context_window": 50}),
+            ModelRoute(2, "openai", "large", "https://b.test", None, None, "k", 2),
+            # 未配置 context_window，按模型名推断的长度只告警不拒绝
+            ModelRoute(3, "openai", "gpt-4-0613", "https://c.test", None, None, "k",
+                       3),
+        ]
+        upstream = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+
+        async def call(model, max_tokens):
+            request = ChatCompletionRequest(
+                model=model,
+                messages=[{"role": "user", "content": "hi"}],
+                max_tokens=max_tokens,
+            )
+            return await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(RoutingTable, "get_route",
+                             side_effect={r.model_name: r for r in routes}.get), \
+                patch.object(QuotaTracker, "_remaining", {2: 1000}), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(call("auto", 100))
+            with pytest.raises(HTTPException) as context_error:
+                asyncio.run(call("small", 100))
+            with pytest.raises(HTTPException) as quota_error:
+                asyncio.run(call("large", 2000))
+            asyncio.run(call("gpt-4-0613", 10000))
+
+        assert upstream.await_count == 2
+        assert upstream.await_args_list[0].args[3]["model"] == "large"
+        assert upstream.await_args.args[3]["model"] == "gpt-4-0613"
+        assert context_error.value.status_code == 400
+        assert quota_error.value.status_code == 429
+
+    def test_quota_exhausted_fallback_not_rejected(self, clean_cache):
+        """所有模型额度均达到切换阈值时仍尝试，剩余额度不足不返回 429"""
+        from main import chat_completions, ChatCompletionRequest
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+        from services.quota_tracker import QuotaTracker
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [
+            ModelRoute(1, "openai", "a", "https://a.test", None, None, "k", 1),
+            ModelRoute(2, "openai", "b", "https://b.test", None, None, "k", 2),
+        ]
+        upstream = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+        request = ChatCompletionRequest(
+            model="auto", messages=[{"role": "user", "content": "hi"}], max_tokens=500
+        )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(QuotaTracker, "_exhausted", {1, 2}), \
+                patch.object(QuotaTracker, "_remaining", {1: 10, 2: 10}), \
+                patch.object(GatewayCore, "sync_request", upstream), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            ))
+
+        assert upstream.await_count == 1
+        assert upstream.await_args.args[3]["model"] == "a"
+
+
+class TestHealthMonitor:
+    """后台健康检查测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_monitor(self):
+        from services.health_monitor import HealthMonitor
+
+        with patch.object(HealthMonitor, "_failures", {}), \
+                patch.object(HealthMonitor, "_disconnected", set()), \
+                patch.object(HealthMonitor, "_restored", True), \
+                patch.object(HealthMonitor, "FAILURE_THRESHOLD", 2):
+            yield HealthMonitor
+
+    def test_probe_uses_cheap_endpoint_per_vendor(self):
+        """按厂商请求模型列表或发送 HEAD，认证失败与 5xx 视为不可用，404/405 无法判断"""
+        import httpx
+        from services.gateway_core import GatewayCore
+        from services.http_client_pool import HttpClientPool
+
+        seen = []
+        statuses = {"a.test": 200, "b.test": 401, "c.test": 503, "d.test": 404,
+                    "g.test": 405, "h.test": 405}
+
+        def handler(request):
+            seen.append((request.method, str(request.url)))
+            return httpx.Response(statuses.get(request.url.host, 200))
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        probe = GatewayCore.probe_health
+        with patch.object(HttpClientPool, "get_client", return_value=client):
+            assert asyncio.run(probe("openai", "https://a.test/v1", "k")) is True
+            assert asyncio.run(probe("openai", "https://b.test/v1", "k")) is False
+            assert asyncio.run(probe("openai", "https://c.test/v1", "k")) is False
+            assert asyncio.run(probe("spark", "https://d.test", "k")) is None
+            assert asyncio.run(probe("spark", "https://g.test", "k")) is None
+            assert asyncio.run(probe("openai", "https://h.test", "k")) is None
+            assert asyncio.run(probe("ollama", "http://e.test/v1", "")) is True
+            assert asyncio.run(probe("spark_websocket", "wss://f.test", "k")) is None
+
+        assert seen == [
+            ("GET", "https://a.test/v1/models"),
+            ("GET", "https://b.test/v1/models"),
+            ("GET", "https://c.test/v1/models"),
+            ("HEAD", "https://d.test"),
+            ("HEAD", "https://g.test"),
+            ("GET", "https://h.test/v1/models"),
+            ("GET", "http://e.test/api/tags"),
+        ]
+
+    def test_status_written_only_on_change(self, db_session, clean_monitor):
+        """同一上游只探测一次，连续失败达到阈值才断开，状态不变时不写库"""
+        from models.model_config import ModelConfig
+        from services.gateway_core import GatewayCore
+        from services.log_writer import LogWriter
+
+        models = [
+            ModelConfig(vendor="openai", model_name="hm-1", api_base="https://h.test",
+                        priority=1, status=1, connect_status=1),
+            ModelConfig(vendor="openai", model_name="hm-2", api_base="https://h.test",
+                        priority=2, status=1, connect_status=1),
+        ]
+        db_session.add_all(models)
+        db_session.commit()
+        ids = [m.id for m in models]
+
+        healthy = AsyncMock(return_value=False)
+        save = Mock(wraps=clean_monitor._save)
+        try:
+            with patch.object(GatewayCore, "probe_health", healthy), \
+                    patch.object(clean_monitor, "_save", save), \
+                    patch.object(LogWriter, "write", AsyncMock()):
+                asyncio.run(clean_monitor.check_all(max_delay=0))
+                assert save.call_count == 0
+                asyncio.run(clean_monitor.check_all(max_delay=0))
+                assert save.call_count == 1
+                asyncio.run(clean_monitor.check_all(max_delay=0))
+                assert save.call_count == 1
+
+            probed = [c for c in healthy.await_args_list if c.args[1] == "https://h.test"]
+            assert len(probed) == 3
+            db_session.expire_all()
+            assert [db_session.get(ModelConfig, i).connect_status for i in ids] == [0, 0]
+        finally:
+            db_session.query(ModelConfig).filter(ModelConfig.id.in_(ids)).delete()
+            db_session.commit()
+
+    def test_restores_only_models_it_disconnected(self, clean_monitor):
+        """探测成功只恢复由健康检查断开的模型，不改动管理员未测试通过的模型"""
+        from services.gateway_core import GatewayCore
+
+        models = [
+            {"id": i, "vendor": "openai", "model_name": f"m{i}",
+             "api_base": f"https://{i}.test", "api_key": "k", "connect_status": 1}
+            for i in (1, 2)
+        ]
+        models[1]["connect_status"] = 0
+        healthy = AsyncMock(return_value=False)
+        save = Mock()
+
+        with patch.object(clean_monitor, "_load_models", return_value=models), \
+                patch.object(clean_monitor, "_save", save), \
+                patch.object(clean_monitor, "_log_transition", AsyncMock()), \
+                patch.object(GatewayCore, "probe_health", healthy):
+            for _ in range(2):
+                asyncio.run(clean_monitor.check_all(max_delay=0))
+            assert save.call_args.args[0] == [(models[0], 0)]
+            models[0]["connect_status"] = 0
+
+            healthy.return_value = True
+            asyncio.run(clean_monitor.check_all(max_delay=0))
+
+        assert save.call_count == 2
+        assert save.call_args.args[0] == [(models[0], 1)]
+        assert clean_monitor._disconnected == set()
+
+    def test_not_found_probe_keeps_model_connected(self, clean_monitor):
+        """HEAD 根地址或 GET /models 返回 404 时不断开模型"""
+        import httpx
+        from services.http_client_pool import HttpClientPool
+
+        models = [
+            {"id": 1, "vendor": "minimax", "model_name": "m1",
+             "api_base": "https://head.test/v1/text", "api_key": "k",
+             "connect_status": 1},
+            {"id": 2, "vendor": "perplexity", "model_name": "m2",
+             "api_base": "https://list.test", "api_key": "k", "connect_status": 1},
+        ]
+        seen = []
+
+        def handler(request):
+            seen.append((request.method, str(request.url)))
+            return httpx.Response(404)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        save = Mock()
+        with patch.object(clean_monitor, "_load_models", return_value=models), \
+                patch.object(clean_monitor, "_save", save), \
+                patch.object(HttpClientPool, "get_client", return_value=client):
+            for _ in range(3):
+                asyncio.run(clean_monitor.check_all(max_delay=0))
+
+        assert ("HEAD", "https://head.test/v1/text") in seen
+        assert ("GET", "https://list.test/models") in seen
+        assert save.call_count == 0
+        assert clean_monitor._failures == {}
+
+    def test_restores_disconnected_from_logs(self, db_session, clean_monitor):
+        """重启后按最近的切换日志识别由健康检查断开的模型"""
+        from models.model_config import ModelConfig
+        from models.operation_log import OperationLog
+
+        models = [
+            ModelConfig(vendor="openai", model_name=f"hr-{i}", api_base="https://r.test",
+                        priority=i, status=1, connect_status=0)
+            for i in (1, 2)
+        ]
+        db_session.add_all(models)
+        db_session.commit()
+        ids = [m.id for m in models]
+        down = json.dumps({"from_model": "x", "to_model": None,
+                           "reason": "健康检查连续 2 次失败，移出路由"})
+        db_session.add_all([
+            OperationLog(log_type=2, model_id=ids[0], log_content=down),
+            OperationLog(log_type=2, model_id=ids[1], log_content=down),
+            OperationLog(log_type=2, model_id=ids[1],
+                         log_content=json.dumps({"reason": "测试连接失败"})),
+        ])
+        db_session.commit()
+        try:
+            with patch.object(clean_monitor, "_restored", False):
+                clean_monitor._load_models()
+            assert clean_monitor._disconnected == {ids[0]}
+        finally:
+            db_session.query(OperationLog).filter(
+                OperationLog.model_id.in_(ids)).delete()
+            db_session.query(ModelConfig).filter(ModelConfig.id.in_(ids)).delete()
+            db_session.commit()
+
+    def test_concurrency_bounded(self, clean_monitor):
+        """同时进行的探测数不超过 CONCURRENCY"""
+        from services.gateway_core import GatewayCore
+
+        models = [
+            {"id": i, "vendor": "openai", "model_name": f"m{i}",
+             "api_base": f"https://{i}.test", "api_key": "k", "connect_status": 1}
+            for i in range(10)
+        ]
+        active = 0
+        peak = 0
+
+        async def probe(*args):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return True
+
+        with patch.object(clean_monitor, "_load_models", return_value=models), \
+                patch.object(clean_monitor, "CONCURRENCY", 3), \
+                patch.object(GatewayCore, "probe_health", probe):
+            asyncio.run(clean_monitor.check_all(max_delay=0))
+
+        assert peak == 3
+
+
+class TestMetrics:
+    """Prometheus 指标测试"""
+
+    @pytest.fixture(autouse=True)
+    def clean_metrics(self):
+        from services.metrics import Metrics
+
+        Metrics.reset()
+        yield Metrics
+        Metrics.reset()
+
+    def test_histogram_renders_cumulative_buckets(self):
+        """直方图按分桶累计导出，包含 +Inf、count 与 sum"""
+        from services.metrics import Histogram
+
+        histogram = Histogram("t_seconds", "test", ("model",), (0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value, ("m",))
+
+        samples = {
+            (name, values[-1] if name.endswith("_bucket") else None): value
+            for name, _, values, value in histogram.samples()
+        }
+        assert samples[("t_seconds_bucket", 0.1)] == 1
+        assert samples[("t_seconds_bucket", 1.0)] == 3
+        assert samples[("t_seconds_bucket", "+Inf")] == 4
+        assert samples[("t_seconds_count", None)] == 4
+        assert samples[("t_seconds_sum", None)] == pytest.approx(4.25)
+
+    def test_chat_completions_instrumented(self, clean_metrics):
+        """请求数按结果统计，上游调用按模型/厂商记录延迟与 token 数"""
+        import httpx
+        from fastapi import HTTPException
+        from fastapi.testclient import TestClient
+        from main import app, chat_completions, ChatCompletionRequest
+        from services.http_client_pool import HttpClientPool
+        from services.log_writer import LogWriter
+        from services.routing_table import ModelRoute, RoutingTable
+
+        routes = [ModelRoute(1, "openai", "m1", "https://a.test/v1", None, None, "k", 1)]
+
+        def handler(request):
+            return httpx.Response(
+                200,
+                json={
+                    "choices": [{"message": {"content": "ok"}}],
+                    "usage": {"prompt_tokens": 7, "completion_tokens": 3},
+                },
+            )
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run():
+            request = ChatCompletionRequest(
+                model="auto", messages=[{"role": "user", "content": "hi"}]
+            )
+            await chat_completions(
+                request, authorization="Bearer k", x_hedge=None, cache_control=None
+            )
+            with pytest.raises(HTTPException):
+                await chat_completions(
+                    request, authorization=None, x_hedge=None, cache_control=None
+                )
+
+        with patch.object(RoutingTable, "get_routes", return_value=routes), \
+                patch.object(HttpClientPool, "get_client", return_value=client), \
+                patch.object(LogWriter, "write", AsyncMock()):
+            asyncio.run(run())
+
+        assert clean_metrics.requests.values == {("success",): 1, ("client_error",): 1}
+        assert clean_metrics.inflight.values[()] == 0
+        assert clean_metrics.upstream_requests.values == {("openai", "m1", "success"): 1}
+        assert clean_metrics.tokens.values[("openai", "m1", "in")] == 7
+        assert clean_metrics.tokens.values[("openai", "m1", "out")] == 3
+
+        body = TestClient(app).get("/metrics").text
+        assert 'gateway_upstream_requests_total{vendor="openai",model="m1",outcome="success"} 1' in body
+        assert 'gateway_upstream_latency_seconds_count{vendor="openai",model="m1"} 1' in body
+        assert "# TYPE gateway_cache_hit_ratio gauge" in body
+
+    def test_stream_records_ttft_and_cancellation(self, clean_metrics):
+        """流式调用记录首个 chunk 延迟，提前关闭的流计为取消"""
+        import httpx
+        from services.gateway_core import GatewayCore
+        from services.http_client_pool import HttpClientPool
+
+        def handler(request):
+            body = b'data: {"choices":[{"delta":{"content":"a"}}]}\n\n' * 3
+            return httpx.Response(200, content=body)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run(read_all):
+            stream = GatewayCore.stream_request(
+                "openai", "https://a.test/v1", "k", {"model": "m1", "stream": True}
+            )
+            async for _ in stream:
+                if not read_all:
+                    break
+            await stream.aclose()
+
+        with patch.object(HttpClientPool, "get_client", return_value=client):
+            asyncio.run(run(True))
+            asyncio.run(run(False))
+
+        assert clean_metrics.upstream_requests.values == {
+            ("openai", "m1", "success"): 1,
+            ("openai", "m1", "cancelled"): 1,
+        }
+        assert sum(clean_metrics.upstream_ttft.values[("openai", "m1")][:-1]) == 2
+
+
+class TestStructuredLogging:
+    """结构化日志测试"""
+
+    def test_json_output_with_request_id_and_extra(self):
+        """日志经队列由后台线程写出为 JSON，携带请求 ID 与 extra 字段"""
+        import io
+        import logging
+        from config.logging_config import request_id_var, setup_logging
+
+        stream = io.StringIO()
+        setup_logging(level="DEBUG", log_format="json", stream=stream)
+        token = request_id_var.set("req-1")
+        try:
+            logging.getLogger("test.logging").info("使用模型 %s", "m1", extra={"ttft": 0.5})
+        finally:
+            request_id_var.reset(token)
+            setup_logging()
+
+        entry = json.loads(stream.getvalue().strip())
+        assert entry["message"] == "使用模型 m1"
+        assert entry["level"] == "INFO"
+        assert entry["request_id"] == "req-1"
+        assert entry["ttft"] == 0.5
+
+    def test_debug_sampling_is_per_request(self):
+        """DEBUG 日志按请求 ID 采样，同一请求的日志一起保留或丢弃"""
+        import logging
+        from config.logging_config import RequestContextFilter, request_id_var
+
+        sampler = RequestContextFilter(sample_rate=0.5)
+
+        def kept(level, request_id):
+            record = logging.LogRecord("t", level, "", 0, "msg", (), None)
+            token = request_id_var.set(request_id)
+            try:
+                return sampler.filter(record)
+            finally:
+                request_id_var.reset(token)
+
+        decisions = {kept(logging.DEBUG, f"req-{i}") for i in range(50)}
+        assert decisions == {True, False}
+        for i in range(20):
+            assert kept(logging.DEBUG, f"req-{i}") == kept(logging.DEBUG, f"req-{i}")
+            assert kept(logging.WARNING, f"req-{i}")
+
+    def test_request_id_header(self):
+        """请求 ID 沿用客户端传入值，未传入时生成并回传"""
+        from fastapi.testclient import TestClient
+        from main import app
+
+        client = TestClient(app)
+        assert client.get("/", headers={"X-Request-ID": "abc"}).headers["x-request-id"] == "abc"
+        assert client.get("/").headers["x-request-id"]
+
+
+class TestStatsRollup:
+    """日志小时汇总测试"""
+
+    @pytest.fixture
+    def isolated_db(self):
+        """独立的内存数据库，汇总表的计数不受其他用例影响"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from config.database import Base
+
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine)
+        with patch("services.stats_rollup.SessionLocal", factory), patch(
+            "services.log_writer.SessionLocal", factory
+        ):
+            yield factory
+        engine.dispose()
+
+    def test_flush_upserts_counters(self, isolated_db):
+        """批量写入日志时在同一事务中累加汇总"""
+        from models.log_rollup import LogRollup
+        from services.log_writer import LogWriter
+
+        now = datetime.now()
+
+        def row(log_type, model_id, usage=None):
+            return {"log_type": log_type, "model_id": model_id, "log_content": "x",
+                    "status": 1, "create_time": now, "usage": usage}
+
+        LogWriter._flush([
+            row(1, 7, {"prompt_tokens": 10, "completion_tokens": 5}),
+            row(1, 7, {"prompt_tokens": 3, "completion_tokens": 2}),
+            row(2, None),
+        ])
+        LogWriter._flush([row(1, 7, {"prompt_tokens": 10, "completion_tokens": 5})])
+
+        db = isolated_db()
+        rows = {(r.model_id, r.log_type): r for r in db.query(LogRollup).all()}
+        db.close()
+
+        assert len(rows) == 2
+        assert rows[(7, 1)].hour == now.strftime("%Y-%m-%d %H")
+        assert rows[(7, 1)].request_count == 3
+        assert rows[(7, 1)].prompt_tokens == 23
+        assert rows[(7, 1)].completion_tokens == 12
+        assert rows[(0, 2)].request_count == 1
+
+    def test_backfill_once(self, isolated_db):
+        """汇总表为空时从历史日志回填，之后不再重复回填"""
+        from models.log_rollup import LogRollup
+        from models.operation_log import OperationLog
+        from services.stats_rollup import StatsRollup
+
+        db = isolated_db()
+        day = datetime(2024, 5, 1, 9, 30)
+        db.add_all([
+            OperationLog(log_type=1, model_id=3, status=1, create_time=day,
+                         log_content=json.dumps({"usage": {"prompt_tokens": 4,
+                                                    "completion_tokens": 6}})),
+            OperationLog(log_type=1, model_id=3, status=1, create_time=day,
+                         log_content="plain text"),
+            OperationLog(log_type=1, model_id=3, status=0, create_time=day,
+                         log_content=None),
+        ])
+        db.commit()
+
+        assert StatsRollup.backfill() == 2
+        assert StatsRollup.backfill() == 0
+
+        ok = db.query(LogRollup).filter(LogRollup.status == 1).one()
+        assert (ok.hour, ok.request_count) == ("2024-05-01 09", 2)
+        assert (ok.prompt_tokens, ok.completion_tokens) == (4, 6)
+        db.close()
+
+    def test_stats_read_rollups(self, isolated_db):
+        """趋势和排行接口只读取汇总表"""
+        from models.log_rollup import LogRollup
+        from models.model_config import ModelConfig
+        from routers.stats import get_model_ranking, get_usage_trend
+        from services.routing_table import RoutingTable
+        from services.stats_rollup import StatsRollup
+
+        db = isolated_db()
+        now = datetime.now()
+        db.add(ModelConfig(id=1, vendor="openai", model_name="gpt-4o",
+                           api_key="k", priority=1, status=1))
+        db.add_all([
+            LogRollup(hour=StatsRollup.hour_of(now), model_id=1, log_type=1,
+                      status=1, request_count=30),
+            LogRollup(hour=StatsRollup.hour_of(now), model_id=1, log_type=1,
+                      status=0, request_count=10),
+        ])
+        db.commit()
+
+        trend = asyncio.run(get_usage_trend(days=7, db=db))["data"]["trend"]
+        assert trend[-1] == {"date": now.strftime("%Y-%m-%d"), "requests": 40}
+
+        # 路由表中没有的模型批量回查数据库
+        with patch.object(RoutingTable, "_snapshot", ([], {}, {})):
+            rankings = asyncio.run(get_model_ranking(db=db))["data"]["rankings"]
+        assert rankings == [
+            {"model": "openai - gpt-4o", "requests": 40, "percentage": 100.0}
+        ]
+        db.close()
+
+    def test_stats_query_count_constant(self, isolated_db):
+        """统计接口的查询次数不随模型数量增长"""
+        from sqlalchemy import event
+        from models.log_rollup import LogRollup
+        from models.model_config import ModelConfig
+        from models.quota_stat import QuotaStat
+        from routers.stats import (
+            get_dashboard_stats, get_model_ranking, get_quota_overview,
+        )
+        from services.routing_table import RoutingTable
+        from services.stats_rollup import StatsRollup
+
+        db = isolated_db()
+        hour = StatsRollup.hour_of(datetime.now())
+        for i in range(1, 21):
+            db.add(ModelConfig(id=i, vendor="openai", model_name=f"m-{i}",
+                               api_key="k", priority=i, status=1, connect_status=1))
+            db.add(QuotaStat(model_id=i, total_quota=100, used_quota=90,
+                             remain_quota=10, used_ratio=90))
+            db.add(LogRollup(hour=hour, model_id=i, log_type=1, status=1,
+                             request_count=i))
+        db.commit()
+
+        statements = []
+        event.listen(db.get_bind(), "before_cursor_execute",
+                     lambda *args: statements.append(args[2]))
+
+        with patch.object(RoutingTable, "_snapshot", ([], {}, {})), \
+                patch("services.routing_table.SessionLocal", isolated_db):
+            RoutingTable.rebuild()
+            statements.clear()
+
+            dashboard = asyncio.run(get_dashboard_stats(db=db))["data"]
+            dashboard_queries = len(statements)
+            statements.clear()
+            rankings = asyncio.run(get_model_ranking(db=db))["data"]["rankings"]
+            ranking_queries = len(statements)
+            statements.clear()
+            quota = asyncio.run(get_quota_overview(db=db))["data"]
+            quota_queries = len(statements)
+
+        assert dashboard["stats"]["activeModels"] == 20
+        assert dashboard["currentModel"]["model_name"] == "m-1"
+        assert len(dashboard["alertModels"]) == 20
+        assert rankings[0]["model"] == "openai - m-20"
+        assert quota["models"][0]["model_name"] == "m-1"
+        assert (dashboard_queries, ranking_queries, quota_queries) == (4, 1, 1)
+        db.close()
+
+
+class TestMigrations:
+    """数据库迁移测试"""
+
+    @staticmethod
+    def _create_legacy_schema(engine):
+        """旧版本结构的数据库：缺少 api_spec 列、索引，额度记录有重复"""
+        from sqlalchemy import text
+        from config.database import Base
+
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE model_config (id INTEGER PRIMARY KEY, "
+                "vendor VARCHAR(50), model_name VARCHAR(100))"
+            ))
+            conn.execute(text(
+                "CREATE TABLE quota_stat (id INTEGER PRIMARY KEY, model_id INTEGER, "
+                "total_quota FLOAT, used_quota FLOAT, remain_quota FLOAT, "
+                "used_ratio FLOAT)"
+            ))
+            conn.execute(text(
+                "CREATE TABLE operation_log (id INTEGER PRIMARY KEY, log_type INTEGER, "
+                "model_id INTEGER, log_content TEXT, status INTEGER, create_time DATETIME)"
+            ))
+            conn.execute(text(
+                "INSERT INTO quota_stat (id, model_id, total_quota, used_quota) "
+                "VALUES (1, 7, 1000, 100), (2, 7, 2000, 300), (3, 8, 500, 50)"
+            ))
+        Base.metadata.create_all(engine)
+
+    @pytest.fixture
+    def legacy_engine(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import StaticPool
+
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        self._create_legacy_schema(engine)
+        yield engine
+        engine.dispose()
+
+    def test_upgrade_legacy_schema(self, legacy_engine):
+        """按顺序执行全部迁移，再次执行时跳过"""
+        from sqlalchemy import inspect, text
+        from config.migrations import MIGRATIONS, run_migrations
+
+        assert run_migrations(legacy_engine) == [v for v, _, _ in MIGRATIONS]
+        assert run_migrations(legacy_engine) == []
+
+        inspector = inspect(legacy_engine)
+        columns = {c["name"] for c in inspector.get_columns("model_config")}
+        assert "api_spec" in columns
+        log_indexes = {i["name"] for i in inspector.get_indexes("operation_log")}
+        assert "ix_operation_log_type_time" in log_indexes
+        quota_indexes = {i["name"]: i for i in inspector.get_indexes("quota_stat")}
+        assert quota_indexes["uq_quota_stat_model_id"]["unique"]
+
+        # 重复记录合并到最早的一条：已用额度累加，总额度取最大值
+        with legacy_engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT id, model_id, total_quota, used_quota, remain_quota, "
+                "used_ratio FROM quota_stat"
+            )).all()
+        assert sorted(rows) == [(1, 7, 2000, 400, 1600, 20), (3, 8, 500, 50, None, None)]
+
+    def test_concurrent_starters(self, tmp_path):
+        """两个进程同时启动时迁移只执行一次，后获得锁的一方跳过"""
+        import threading
+        from sqlalchemy import create_engine
+        from config.migrations import MIGRATIONS, run_migrations
+
+        url = f"sqlite:///{tmp_path / 'migrate.db'}"
+        setup = create_engine(url)
+        self._create_legacy_schema(setup)
+        setup.dispose()
+
+        engines = [create_engine(url) for _ in range(2)]
+        barrier = threading.Barrier(2)
+        results, errors = [], []
+
+        def start(engine):
+            barrier.wait()
+            try:
+                results.append(run_migrations(engine))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=start, args=(e,)) for e in engines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for engine in engines:
+            engine.dispose()
+
+        assert errors == []
+        assert sorted(sum(results, [])) == [v for v, _, _ in MIGRATIONS]
+
+    def test_log_queries_use_indexes(self, legacy_engine):
+        """日志列表与仪表盘的查询走复合索引，无需全表扫描后排序"""
+        from sqlalchemy import desc, text
+        from sqlalchemy.orm import Session
+        from config.migrations import run_migrations
+        from models.operation_log import OperationLog
+
+        run_migrations(legacy_engine)
+        db = Session(legacy_engine)
+        queries = {
+            "ix_operation_log_type_time": db.query(OperationLog)
+            .filter(OperationLog.log_type == 2)
+            .order_by(desc(OperationLog.create_time)).limit(10),
+            "ix_operation_log_model_time": db.query(OperationLog)
+            .filter(OperationLog.model_id == 3)
+            .order_by(desc(OperationLog.create_time)).limit(20),
+            "ix_operation_log_create_time": db.query(OperationLog)
+            .order_by(desc(OperationLog.create_time)).limit(20),
+        }
+        for index, query in queries.items():
+            sql = str(query.statement.compile(
+                legacy_engine, compile_kwargs={"literal_binds": True}
+            ))
+            plan = " ".join(
+                row[-1] for row in db.execute(text("EXPLAIN QUERY PLAN " + sql))
+            )
+            assert index in plan and "TEMP B-TREE" not in plan, plan
+        db.close()
+
+
 # ==================== 集成测试 ====================
 
 class TestIntegration: